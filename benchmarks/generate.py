@@ -0,0 +1,126 @@
+"""
+Deterministic synthetic patches for benchmarks: the same parameters and
+seed always give the same patch text.
+
+    python -m benchmarks.generate --objects 10000 --depth 3 out.pd
+"""
+
+import argparse
+import random
+
+OBJECTS = [
+    ("osc~", lambda r: [str(r.randint(20, 2000))]),
+    ("*~", lambda r: [f"{r.random():.3f}"]),
+    ("+~", lambda r: []),
+    ("lop~", lambda r: [str(r.randint(100, 5000))]),
+    ("metro", lambda r: [str(r.randint(10, 1000))]),
+    ("t", lambda r: ["b", "f"]),
+    ("f", lambda r: []),
+    ("+", lambda r: [str(r.randint(1, 10))]),
+    ("s", lambda r: [f"bus-{r.randint(0, 9)}"]),
+    ("r", lambda r: [f"bus-{r.randint(0, 9)}"]),
+    ("tabplay~", lambda r: [f"table-{r.randint(0, 99)}"]),
+    ("dac~", lambda r: []),
+]
+
+ESCAPED = [r"\$1", r"\,", r"\;", r"\$0-bus"]
+
+class PatchGenerator:
+    """
+    Args:
+        objects (int): Boxes in the whole patch, split evenly between the
+            top level and each nesting level.
+        density (float): Connections per box, within each (sub)patch.
+        depth (int): Nesting depth of the subpatches.
+        arrays (int): Arrays, each in its own graph at the top level.
+        array_size (int): Points in each array.
+        escapes (float): Share of boxes that are messages or comments with
+            escaped characters ($, comma, semicolon).
+        seed (int): Random seed.
+    """
+    def __init__(self, objects=1000, density=1.0, depth=2, arrays=4, array_size=1000,
+                 escapes=0.05, seed=0):
+        self.objects = objects
+        self.density = density
+        self.depth = depth
+        self.arrays = arrays
+        self.array_size = array_size
+        self.escapes = escapes
+        self.seed = seed
+
+    def parameters(self):
+        return dict(vars(self))
+
+    def generate(self) -> str:
+        self.random = random.Random(self.seed)
+        lines = ["#N canvas 0 0 1200 800 12;"]
+        per_level = self.objects // (self.depth + 1)
+        self.add_boxes(lines, per_level + self.objects % (self.depth + 1), self.depth, per_level)
+        for i in range(self.arrays):
+            self.add_array(lines, f"table-{i}", 10 + i * 210, 10)
+        del self.random
+        return "\n".join(lines)
+
+    def box(self, x, y):
+        r = self.random
+        if r.random() < self.escapes:
+            kind = r.choice(["msg", "text"])
+            words = [r.choice(ESCAPED) if r.random() < 0.5 else r.choice(["set", "foo", "1", "bang"])
+                     for _ in range(r.randint(1, 6))]
+            return f"#X {kind} {x} {y} {' '.join(words)};", kind == "msg"
+        name, args = r.choice(OBJECTS)
+        return f"#X obj {x} {y} {' '.join([name] + args(r))};", True
+
+    def add_boxes(self, lines, count, depth, per_level):
+        """Adds count boxes, then a subpatch holding the next level. Returns the number of items."""
+        r = self.random
+        connectable = []
+        for i in range(count):
+            line, can_connect = self.box((i % 40) * 30, (i // 40) * 30)
+            lines.append(line)
+            if can_connect:
+                connectable.append(i)
+        items = count
+
+        if depth > 0:
+            lines.append(f"#N canvas 0 0 800 600 level{depth} 0;")
+            self.add_boxes(lines, per_level, depth - 1, per_level)
+            lines.append(f"#X restore {r.randint(0, 1000)} {r.randint(0, 700)} pd level{depth};")
+            connectable.append(items)
+            items += 1
+
+        if len(connectable) > 1:
+            for _ in range(int(len(connectable) * self.density)):
+                source, target = sorted(r.sample(connectable, 2))
+                lines.append(f"#X connect {source} 0 {target} 0;")
+        return items
+
+    def add_array(self, lines, name, x, y):
+        r = self.random
+        lines.append("#N canvas 0 0 200 140 (subpatch) 0;")
+        lines.append(f"#X array {name} {self.array_size} float 3 black black;")
+        data = [f"{r.uniform(-1, 1):.6g}" for _ in range(self.array_size)]
+        for i in range(0, self.array_size, 100):
+            lines.append(f"#A {i} {' '.join(data[i:i + 100])};")
+        lines.append(f"#X coords 0 1 {self.array_size} -1 200 140 1;")
+        lines.append(f"#X restore {x} {y} graph;")
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic Pure Data patch.")
+    parser.add_argument('--objects', type=int, default=1000, help='Number of boxes')
+    parser.add_argument('--density', type=float, default=1.0, help='Connections per box')
+    parser.add_argument('--depth', type=int, default=2, help='Subpatch nesting depth')
+    parser.add_argument('--arrays', type=int, default=4, help='Number of arrays')
+    parser.add_argument('--array-size', type=int, default=1000, help='Points per array')
+    parser.add_argument('--escapes', type=float, default=0.05, help='Share of boxes with escaped characters')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('output', type=str, help='Path of the patch to write')
+    args = parser.parse_args()
+
+    generator = PatchGenerator(args.objects, args.density, args.depth, args.arrays, args.array_size,
+                               args.escapes, args.seed)
+    with open(args.output, 'w') as f:
+        f.write(generator.generate())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Times the "fast" resampler against resampy ("hq") on common rate
+conversions and reports the signal-to-noise ratio of the fast output,
+taking resampy as the reference.
+
+    python -m benchmarks.resample [--seconds 10] [--min-snr 60]
+"""
+
+import argparse
+import sys
+import time
+import numpy as np
+
+from scripts.resample import resample
+
+RATES = [(44100, 48000), (48000, 44100), (48000, 96000), (96000, 48000), (44100, 96000)]
+
+def test_signal(samplerate, seconds, seed=0):
+    # Stereo tones below the lower Nyquist frequency of every conversion
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(samplerate * seconds)) / samplerate
+    channels = []
+    for _ in range(2):
+        frequencies = rng.uniform(50, 18000, 16)
+        phases = rng.uniform(0, 2 * np.pi, 16)
+        channels.append(0.05 * np.sin(2 * np.pi * frequencies[:, None] * t + phases[:, None]).sum(axis=0))
+    return np.stack(channels, axis=1)
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def snr(reference, estimate, margin):
+    # Edges are left out, the filters don't treat the padding the same way
+    reference, estimate = reference[margin:-margin], estimate[margin:-margin]
+    noise = np.sum((reference - estimate) ** 2)
+    return 10 * np.log10(np.sum(reference ** 2) / noise)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fast resampler against resampy.")
+    parser.add_argument('--seconds', type=float, default=10, help='Length of the test signal')
+    parser.add_argument('--min-snr', type=float, default=None, help='Exit with an error below this SNR (dB)')
+    args = parser.parse_args()
+
+    # Warm up numba so the first conversion isn't charged for compilation
+    _, warmup = timed(resample, np.zeros(1000), 44100, 48000, 'hq')
+    print(f"resampy warm-up: {warmup:.2f}s")
+
+    failed = False
+    print(f"{'conversion':>16} {'hq':>8} {'fast':>8} {'speedup':>8} {'SNR':>8}")
+    for sr_orig, sr_new in RATES:
+        data = test_signal(sr_orig, args.seconds)
+        hq, hq_time = timed(resample, data, sr_orig, sr_new, 'hq')
+        fast, fast_time = timed(resample, data, sr_orig, sr_new, 'fast')
+        ratio = snr(hq, fast, sr_new // 100)
+        failed |= args.min_snr is not None and ratio < args.min_snr
+        print(f"{sr_orig:>7}->{sr_new:<7} {hq_time:7.3f}s {fast_time:7.3f}s "
+              f"{hq_time / fast_time:7.1f}x {ratio:6.1f}dB")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
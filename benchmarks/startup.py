@@ -0,0 +1,66 @@
+"""
+Measures how long pdu takes to start, on top of a bare interpreter, and
+fails when a command goes over its budget.
+
+    python -m benchmarks.startup [--runs 20] [--scale 1.0]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Milliseconds allowed on top of "python -c pass"
+BUDGETS = {
+    'pdu --help': 40,
+    'pdu channels': 80,
+}
+
+PATCH = """#N canvas 0 0 800 600 12;
+#X obj 10 10 osc~ 440;
+#X obj 10 40 dac~;
+#X connect 0 0 1 0;
+#X connect 0 0 1 1;"""
+
+PDU = "import sys; from pdulate.scripts import main; main(sys.argv[1:])"
+
+def median_time(command, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pdu startup time.")
+    parser.add_argument('--runs', type=int, default=20, help='Runs per command, the median is kept')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the budgets, for slow machines')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        patch_path = os.path.join(directory, 'patch.pd')
+        with open(patch_path, 'w') as f:
+            f.write(PATCH)
+
+        commands = {
+            'pdu --help': [sys.executable, '-c', PDU, '--help'],
+            'pdu channels': [sys.executable, '-c', PDU, 'channels', patch_path],
+        }
+        baseline = median_time([sys.executable, '-c', 'pass'], args.runs)
+        print(f"{'python -c pass':>16} {baseline:7.1f}ms")
+
+        failed = False
+        for name, command in commands.items():
+            overhead = median_time(command, args.runs) - baseline
+            budget = BUDGETS[name] * args.scale
+            over = overhead > budget
+            failed |= over
+            print(f"{name:>16} +{overhead:6.1f}ms (budget {budget:.0f}ms){' OVER' if over else ''}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
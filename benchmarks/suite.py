@@ -0,0 +1,172 @@
+"""
+Times the main pdulate operations on a synthetic patch and writes the
+results as JSON, to be compared across commits.
+
+    python -m benchmarks.suite --objects 20000 --output before.json
+    python -m benchmarks.suite --objects 20000 --compare before.json
+
+Serializing an array heavy patch is also timed with each number of
+processes in --scaling-jobs, as serialize_arrays_<jobs>.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pdulate.parser import Parser
+from pdulate.serialize import serialize_patch
+from pdulate.tools import search_objects, replace, duplicate
+from pdulate.items import Object
+from benchmarks.generate import PatchGenerator
+
+def measure(run, setup=None, repeat=5):
+    """
+    Times run(state) repeat times, state coming from setup(), which isn't
+    timed. Returns the statistics in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'runs': repeat}
+
+def write_wavs(directory, count, seconds, samplerate=44100):
+    import numpy as np
+    import soundfile as sf
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        data = 0.5 * rng.uniform(-1, 1, (int(samplerate * seconds), 2))
+        sf.write(os.path.join(directory, f"sample{i}.wav"), data, samplerate)
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_suite(generator, repeat=5, wavs=8, wav_seconds=1.0):
+    content = generator.generate()
+    parse = lambda _=None: Parser().parse_patch(content)
+    patch = parse()
+    results = {}
+
+    results['parse_patch'] = measure(parse, repeat=repeat)
+    results['serialize_patch'] = measure(lambda _: serialize_patch(patch), repeat=repeat)
+    results['search_objects'] = measure(lambda _: search_objects(patch, 'osc~*'), repeat=repeat)
+
+    def replace_all(patch):
+        for item in search_objects(patch, '*~ *'):
+            replace(patch, item, Object(item.x, item.y, 'pow~', list(item.args)))
+    results['replace'] = measure(replace_all, parse, repeat)
+    results['duplicate'] = measure(lambda patch: duplicate(patch, search_objects(patch, '*'), 10, 10), parse, repeat)
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from scripts.channels import channel_dacs
+    results['channels'] = measure(channel_dacs, parse, repeat)
+
+    try:
+        from scripts.load_audio import load_audio
+    except ImportError as e:
+        results['load_audio'] = {'skipped': str(e)}
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            audio_dir = os.path.join(directory, 'audio')
+            os.mkdir(audio_dir)
+            write_wavs(audio_dir, wavs, wav_seconds)
+            patch_path = os.path.join(directory, 'patch.pd')
+
+            def setup():
+                if os.path.exists(patch_path):
+                    os.remove(patch_path)
+            results['load_audio'] = measure(lambda _: load_audio([audio_dir], patch_path), setup, repeat)
+    return results
+
+def default_scaling_jobs():
+    cpus = os.cpu_count() or 1
+    jobs = [1]
+    while jobs[-1] * 2 < cpus:
+        jobs.append(jobs[-1] * 2)
+    return jobs + [cpus] if cpus > 1 else jobs
+
+def run_scaling(generator, jobs_counts, repeat=5):
+    """Times serialize_patch on the patch of generator, formatting its arrays in each number of processes."""
+    from concurrent.futures import ProcessPoolExecutor
+    patch = Parser().parse_patch(generator.generate())
+    results = {}
+    for jobs in jobs_counts:
+        if jobs == 1:
+            results['serialize_arrays_1'] = measure(lambda _: serialize_patch(patch), repeat=repeat)
+            continue
+        # Starting the pool isn't timed, it can be kept across patches
+        with ProcessPoolExecutor(jobs) as executor:
+            serialize_patch(patch, executor=executor)
+            results[f'serialize_arrays_{jobs}'] = measure(lambda _: serialize_patch(patch, executor=executor),
+                                                          repeat=repeat)
+    return results
+
+def compare(results, previous):
+    print(f"{'scenario':>20} {'before':>10} {'after':>10} {'ratio':>7}")
+    for name, result in results.items():
+        before = previous.get('results', {}).get(name, {})
+        if 'median' in result and 'median' in before:
+            print(f"{name:>20} {before['median']:9.4f}s {result['median']:9.4f}s "
+                  f"{result['median'] / before['median']:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pdulate on a synthetic patch.")
+    parser.add_argument('--objects', type=int, default=5000, help='Number of boxes')
+    parser.add_argument('--density', type=float, default=1.0, help='Connections per box')
+    parser.add_argument('--depth', type=int, default=2, help='Subpatch nesting depth')
+    parser.add_argument('--arrays', type=int, default=8, help='Number of arrays')
+    parser.add_argument('--array-size', type=int, default=10000, help='Points per array')
+    parser.add_argument('--escapes', type=float, default=0.05, help='Share of boxes with escaped characters')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per scenario')
+    parser.add_argument('--wavs', type=int, default=8, help='Stereo WAV files for load_audio')
+    parser.add_argument('--wav-seconds', type=float, default=1.0, help='Length of the WAV files')
+    parser.add_argument('--scaling-jobs', type=str, help='Comma separated process counts, powers of 2 up to the CPUs by default, 0 to skip')
+    parser.add_argument('--scaling-arrays', type=int, default=8, help='Arrays of the patch serialized with processes')
+    parser.add_argument('--scaling-size', type=int, default=250000, help='Points per array of that patch')
+    parser.add_argument('--output', type=str, help='Write the JSON results there instead of stdout')
+    parser.add_argument('--compare', type=str, help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    generator = PatchGenerator(args.objects, args.density, args.depth, args.arrays, args.array_size,
+                               args.escapes, args.seed)
+    scaling_jobs = ([int(jobs) for jobs in args.scaling_jobs.split(',') if int(jobs)] if args.scaling_jobs
+                    else default_scaling_jobs())
+    report = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': dict(generator.parameters(), repeat=args.repeat, wavs=args.wavs,
+                           wav_seconds=args.wav_seconds, scaling_jobs=scaling_jobs,
+                           scaling_arrays=args.scaling_arrays, scaling_size=args.scaling_size),
+        'results': run_suite(generator, args.repeat, args.wavs, args.wav_seconds),
+    }
+    if scaling_jobs:
+        scaling = PatchGenerator(200, args.density, 1, args.scaling_arrays, args.scaling_size, 0, args.seed)
+        report['results'].update(run_scaling(scaling, scaling_jobs, args.repeat))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report['results'], json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,21 @@
 A script replacing all stereo [dac~] objects scattered around in a patch
 into enumerated mono [dac~ n] channels (0->inf), which may then be connected
 elsewhere, for example via Pipewire, and easily controlled.
+
+Subpatches are enumerated with their patch. Several patches, or directories
+of them, are enumerated as one project: channels are numbered across all of
+them, above the highest channel any of them already uses, so no two files
+share a channel.
 """
 
 from pathlib import Path
-from pdulate.tools import search_objects, replace
-from pdulate.items import Subpatch, Object
-from pdulate.serialize import serialize_patch
-from pdulate.parser import Parser
+from pdulate.tools import replace
+from pdulate.items import Patch, Subpatch, Object
+from pdulate.store import PatchStore
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import os
 import sys
+import tempfile
 
 import logging
 logger = logging.getLogger(__name__)
@@ -25,42 +32,53 @@ def main():
     file_path = Path(sys.argv[1])
     channels(file_path)
 
-def channels(file_path):
+def channel_number(arg: str) -> Optional[int]:
+    """The channel an argument of [dac~] stands for, None if it isn't a finite number, e.g. $1 or inf."""
     try:
-        with open(file_path, 'r') as f:
-            content = f.read()
-    except FileNotFoundError:
-        print(f"File not found: {file_path}")
-        sys.exit(1)
-    except IOError:
-        print(f"Error reading file: {file_path}")
-        sys.exit(1)
+        return int(float(arg))
+    except (ValueError, OverflowError):
+        return None
 
-    # Parse the patch
-    parser = Parser()
-    patch = parser.parse_patch(content)
+def is_dac(item) -> bool:
+    return isinstance(item, Object) and item.name == 'dac~'
 
-    # Search for dac~
-    all_dacs = search_objects(patch, r'dac~*')
+def find_dacs(patch: Patch) -> List[Tuple[Patch, Object]]:
+    """The [dac~] objects of a patch and its subpatches, with the (sub)patch holding them."""
+    dacs = []
+    for item in patch.get_items():
+        if isinstance(item, Subpatch):
+            dacs.extend(find_dacs(item))
+        elif is_dac(item):
+            dacs.append((patch, item))
+    return dacs
 
-    default_dacs = [dac for dac in all_dacs if not dac.args]
+def highest_channel(dacs: Iterable[Object]) -> int:
+    numbers = [channel_number(arg) for dac in dacs for arg in dac.args]
+    skipped = numbers.count(None)
+    if skipped:
+        logger.warning("Ignoring %d [dac~] arguments that aren't channel numbers", skipped)
+    return max([number for number in numbers if number is not None] + [0])
 
-    if not default_dacs:
-        logger.info(f"No [dac~] objects found.")
-        sys.exit(0)
-    
-    highest_value = max([ int(arg)  for dac in all_dacs if dac.args for arg in dac.args ] + [0])
+def number_dacs(dacs: List[Tuple[Patch, Object]], n: int) -> int:
+    """
+    Replaces the given [dac~] objects without arguments with enumerated ones,
+    starting at channel n.
 
-    n = highest_value + 1
-    for dac in default_dacs:
+    Returns:
+        int: The next free channel.
+    """
+    for patch, dac in dacs:
 
-        active_inlets = list(dac.get_inlets())
+        # [dac~] has no outlets, connections from one don't carry signal
+        active_inlets = [(inlet, [(outlet, item) for outlet, item in conns if not is_dac(item)])
+                         for inlet, conns in dac.get_inlets()]
+        active_inlets = [(inlet, conns) for inlet, conns in active_inlets if conns]
 
         if len(active_inlets) == 0:
             continue
-        
+
         if len(active_inlets) == 1:
-            replacement = Object(dac.x, dac.y, "dac~", [str(n)]) 
+            replacement = Object(dac.x, dac.y, "dac~", [str(n)])
             _, conns = active_inlets[0]
             for outlet, item in conns:
                 item.connect(outlet, replacement, 0)
@@ -77,26 +95,229 @@ def channels(file_path):
                     break
 
             if identical:
-                replacement = Object(dac.x, dac.y, "dac~", [str(n)]) 
+                replacement = Object(dac.x, dac.y, "dac~", [str(n)])
                 n += 1
             else:
-                replacement = Object(dac.x, dac.y, "dac~", [str(n), str(n+1)]) 
+                replacement = Object(dac.x, dac.y, "dac~", [str(n), str(n+1)])
                 n += 2
             replace(patch, dac, replacement, collapse_inlets=identical)
 
-    # Serialize the modified patch
-    modified_content = serialize_patch(patch)
+    return n
+
+def channel_dacs(patch, start=None):
+    """
+    Replaces the [dac~] objects without arguments of a patch and its
+    subpatches with enumerated ones, starting at channel start, above the
+    highest channel already used by default.
+
+    Returns:
+        int: The number of [dac~] objects without arguments found.
+    """
+    all_dacs = find_dacs(patch)
+    default_dacs = [(owner, dac) for owner, dac in all_dacs if not dac.args]
+
+    if not default_dacs:
+        return 0
+
+    if start is None:
+        start = highest_channel(dac for _, dac in all_dacs) + 1
+    number_dacs(default_dacs, start)
+    return len(default_dacs)
+
+def dac_channels(inlets: Dict[int, set]) -> int:
+    """The channels number_dacs gives a default [dac~], from the sources connected to each of its inlets."""
+    sources = [conns for conns in inlets.values() if conns]
+    if not sources:
+        return 0
+    return 1 if all(conns == sources[0] for conns in sources) else 2
+
+def scan_channels(path: str) -> Tuple[int, int]:
+    """
+    Reads the channels of a patch file from its records, without parsing it.
+
+    Returns:
+        Tuple[int, int]: The highest channel used by [dac~] objects with
+        arguments, and the number of channels channel_dacs would add.
+    """
+    from pdulate.stats import iter_records
+
+    highest, needed = 0, 0
+    # For each open canvas: its number of items so far, the indices of its
+    # [dac~], and for each of its default [dac~], the sources connected to each inlet
+    counts: List[int] = []
+    all_dacs: List[set] = []
+    dacs: List[Dict[int, Dict[int, set]]] = []
+    with open(path, 'r') as f:
+        for record in iter_records(f):
+            if record.startswith('#A'):
+                continue
+            words = record.split()
+            kind = ' '.join(words[:2])
+            if kind == '#N canvas':
+                if counts:
+                    counts[-1] += 1
+                counts.append(0)
+                all_dacs.append(set())
+                dacs.append({})
+            elif not counts:
+                continue
+            elif kind == '#X restore':
+                counts.pop()
+                all_dacs.pop()
+                needed += sum(dac_channels(inlets) for inlets in dacs.pop().values())
+            elif kind == '#X connect' and len(words) == 6:
+                source, outlet, target, inlet = map(int, words[2:])
+                if target in dacs[-1] and source not in all_dacs[-1]:
+                    dacs[-1][target].setdefault(inlet, set()).add((outlet, source))
+            elif kind in ('#X obj', '#X msg', '#X floatatom', '#X symbolatom', '#X text', '#X array'):
+                if kind == '#X obj' and len(words) > 4 and words[4] == 'dac~':
+                    all_dacs[-1].add(counts[-1])
+                    if len(words) == 5:
+                        dacs[-1][counts[-1]] = {}
+                    numbers = [channel_number(arg) for arg in words[5:]]
+                    highest = max([number for number in numbers if number is not None] + [highest])
+                counts[-1] += 1
+
+    # The main canvas has no restore
+    for canvas in dacs:
+        needed += sum(dac_channels(inlets) for inlets in canvas.values())
+    return highest, needed
+
+def write_atomic(path: str, content: str):
+    """Writes content to path through a temporary file renamed over it, so readers never see half a patch."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        if os.path.exists(path):
+            os.chmod(temporary, os.stat(path).st_mode & 0o7777)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+def channeled_path(file_path: Path) -> Path:
+    return file_path.with_name(f"{file_path.stem}.channeled{file_path.suffix}")
+
+def channel_file(path: str, start: int, in_place: bool = False) -> int:
+    """
+    Enumerates the default [dac~] of the patch at path from channel start,
+    writing it back in place or next to it as .channeled.pd.
+
+    Returns:
+        int: The next free channel.
+    """
+    from pdulate.serialize import serialize_patch
+
+    patch = PatchStore().read(path)
+    dacs = [(owner, dac) for owner, dac in find_dacs(patch) if not dac.args]
+    n = number_dacs(dacs, start)
+    if n == start:
+        return n
+    if in_place:
+        write_atomic(path, serialize_patch(patch))
+    else:
+        PatchStore().write(channeled_path(Path(path)), patch)
+    return n
+
+def find_patches(paths: Iterable[str]) -> List[str]:
+    """The .pd files among paths and in the directories among them, in a stable order."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, files in os.walk(path):
+                subdirectories.sort()
+                found.extend(os.path.join(directory, name) for name in sorted(files)
+                             if name.endswith('.pd') and not name.endswith('.channeled.pd'))
+        else:
+            found.append(path)
+    # A file given twice would get two ranges of channels
+    return list(dict.fromkeys(os.path.abspath(path) for path in found))
+
+def channels_project(paths: Sequence[str], in_place: bool = False, jobs: Optional[int] = None,
+                     store=None) -> Dict[str, Tuple[int, int]]:
+    """
+    Enumerates the default [dac~] of several patches as one project.
+
+    A first pass reads every file, in parallel, for the channels already used
+    and the channels its default [dac~] need, so each file gets its own range
+    above the highest channel used anywhere. Files are then rewritten in
+    parallel processes, in place through an atomic rename if in_place, else
+    as .channeled.pd copies.
+
+    Args:
+        paths (Sequence[str]): Patch files and directories searched for them.
+        in_place (bool): Overwrite the patches instead of writing copies.
+        jobs (int): Number of processes, the number of CPUs by default.
+        store (PatchStore): Told about the files rewritten in place.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: The first and last channels given to each
+        file that had default [dac~] objects.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    files = find_patches(paths)
+    parallel = len(files) > 1 and jobs != 1
+    executor = ProcessPoolExecutor(jobs) if parallel else None
+    try:
+        scanned = list(executor.map(scan_channels, files, chunksize=8) if parallel else map(scan_channels, files))
+
+        n = max([highest for highest, _ in scanned] + [0]) + 1
+        ranges = {}
+        for path, (_, needed) in zip(files, scanned):
+            if needed:
+                ranges[path] = (n, n + needed - 1)
+                n += needed
+        logger.info("Allocating %d channels to %d of %d patches", n - 1, len(ranges), len(files))
+
+        starts = [start for start, _ in ranges.values()]
+        flags = [in_place] * len(ranges)
+        if parallel and len(ranges) > 1:
+            ends = list(executor.map(channel_file, ranges, starts, flags))
+        else:
+            ends = list(map(channel_file, ranges, starts, flags))
+    finally:
+        if executor:
+            executor.shutdown()
+
+    for (path, (start, last)), end in zip(ranges.items(), ends):
+        if end != last + 1:
+            # The file changed between the passes
+            logger.warning("%s took channels %d to %d instead of %d to %d", path, start, end - 1, start, last)
+        if in_place and store:
+            store.discard(path)
+    return ranges
+
+def channels(file_path, store=None):
+    store = store or PatchStore()
+    try:
+        # Parse the patch
+        patch = store.read(file_path)
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        sys.exit(1)
+    except IOError:
+        print(f"Error reading file: {file_path}")
+        sys.exit(1)
+
+    if not channel_dacs(patch):
+        logger.info(f"No [dac~] objects found.")
+        sys.exit(0)
 
     # save
-    new_file_path = file_path.with_name(f"{file_path.stem}.channeled{file_path.suffix}")
+    new_file_path = channeled_path(file_path)
 
     try:
-        with open(new_file_path, 'w') as file:
-            file.write(modified_content)
+        store.write(new_file_path, patch)
         logger.info(f"Modified patch saved as {new_file_path}")
     except IOError:
         logger.error(f"Error writing to file: {new_file_path}")
         sys.exit(1)
+    finally:
+        # The original file no longer matches the modified patch
+        store.discard(file_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,84 @@
+"""
+A script writing the arrays of a patch, including those nested in
+subpatches, back to audio files, one file per array.
+"""
+
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pdulate.store import PatchStore
+from pdulate.tools import iter_arrays
+import soundfile as sf
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.NOTSET)
+
+EXPORT_FORMATS = ('wav', 'flac')
+BLOCK_SIZE = 65536
+
+def write_array(array, file_path, samplerate, subtype=None):
+    # Converted block by block, the whole array never exists as a second copy
+    with sf.SoundFile(file_path, 'w', samplerate, 1, subtype) as f:
+        for i in range(0, len(array.data), BLOCK_SIZE):
+            f.write(np.asarray(array.data[i:i + BLOCK_SIZE], dtype=np.float32))
+    logger.info(f"Wrote {array.name} to {file_path}")
+    return file_path
+
+def extract_audio(patch_path, output_dir, samplerate=44100, subtype=None, format='wav', jobs=None, store=None):
+    """
+    Writes every array with saved content to output_dir/<array name>.<format>.
+
+    Args:
+        patch_path (str): Path to the patch.
+        output_dir (str): Directory for the audio files, created if needed.
+        samplerate (int): Sample rate of the files, Pd arrays don't have one.
+        subtype (str): soundfile subtype (e.g. "PCM_16", "FLOAT"), the
+            default of the format if None.
+        format (str): "wav" or "flac".
+        jobs (int): Number of arrays written at once, ThreadPoolExecutor's
+            default if None.
+        store (PatchStore): Where the patch is read from, files by default.
+
+    Returns:
+        List[str]: Paths of the written files.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format: {format}")
+
+    patch = (store or PatchStore()).read(patch_path)
+
+    os.makedirs(output_dir, exist_ok=True)
+    used = set()
+    with ThreadPoolExecutor(jobs) as executor:
+        futures = []
+        for path, array in iter_arrays(patch):
+            if not array.saves_content():
+                logger.info(f"Skipping {'/'.join(path + (array.name,))}, its content isn't saved in the patch")
+                continue
+            # Array names are global in Pd, but a patch can still repeat them
+            stem = array.name.replace(os.sep, '_')
+            name, n = stem, 1
+            while name in used:
+                n += 1
+                name = f"{stem}_{n}"
+            used.add(name)
+            file_path = os.path.join(output_dir, f"{name}.{format}")
+            futures.append(executor.submit(write_array, array, file_path, samplerate, subtype))
+        return [future.result() for future in futures]
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the arrays of a Pure Data patch to audio files.")
+    parser.add_argument('--sample-rate', type=int, default=44100, help='Sample rate of the written files')
+    parser.add_argument('--subtype', type=str, help='Sample format, e.g. PCM_16, PCM_24 or FLOAT')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='wav', help='File format')
+    parser.add_argument('--jobs', type=int, help='Number of files written in parallel')
+    parser.add_argument('patch', type=str, help='Path to the patch file')
+    parser.add_argument('output_dir', type=str, help='Directory for the audio files')
+
+    args = parser.parse_args()
+    extract_audio(args.patch, args.output_dir, args.sample_rate, args.subtype, args.format, args.jobs)
+
+if __name__ == "__main__":
+    main()
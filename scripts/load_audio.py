@@ -1,85 +1,707 @@
 import os
+import sys
+import json
 import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from pdulate.parser import Parser
-from pdulate.items import Patch, Subpatch, Object, Message
-from pdulate.common import ArrayPatch
-from pdulate.serialize import serialize_patch
+from typing import Iterable, List, Optional, Tuple
+from pdulate.items import Patch, Subpatch, Object, Message, Comment
+from pdulate.common import ArrayPatch, DataPatch, PREVIEW_SUFFIX
+from pdulate.store import PatchStore
 from pdulate import tools
+from scripts.resample import resample, RESAMPLERS
 import soundfile as sf
-import resampy
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-AUDIO_EXTENSIONS = ('.wav', '.aiff', '.flac', '.ogg', '.mp3')
+AUDIO_EXTENSIONS = ('.wav', '.aiff', '.aif', '.flac', '.ogg', '.mp3')
+# Formats [soundfiler] reads in vanilla Pd, these can be referenced as they are
+SOUNDFILER_EXTENSIONS = ('.wav', '.aiff', '.aif')
+# Written sidecars have to be read by vanilla [soundfiler] too, FLAC would need an external
+SIDECAR_FORMATS = ('wav',)
+
+# Frames per block when converting a file without holding all of it
+STREAM_BLOCK = 1 << 16
 
 def is_audio_file(file_path):
     return file_path.lower().endswith(AUDIO_EXTENSIONS)
 
-def process_audio_file(file_path, target_samplerate):
+def directory_prefix(top, directory):
+    """
+    The prefix of the arrays of files found in directory, under the
+    directory top given to load: the names of the directories from top
+    down, e.g. drums_kicks for drums/kicks.
+    """
+    top = os.path.normpath(top)
+    relative = os.path.relpath(os.path.normpath(directory), os.path.dirname(top))
+    return '_'.join(Path(relative).parts)
+
+def scan_directory(directory):
+    """The audio files and the subdirectories of a directory, sorted, from a single scandir."""
+    files, subdirectories = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectories.append(entry.path)
+                elif is_audio_file(entry.name) and entry.is_file():
+                    files.append(entry.path)
+    except OSError as e:
+        logger.error(f"Error scanning {directory}: {e}")
+    return sorted(files), sorted(subdirectories)
+
+def scan_tree(top, executor=None):
+    """The audio files under the directory top, each level of the tree scanned in parallel, in os.walk order."""
+    found = []
+    level = [top]
+    while level:
+        scanned = list(executor.map(scan_directory, level) if executor else map(scan_directory, level))
+        subdirectories = []
+        for (files, children) in scanned:
+            found.extend(files)
+            subdirectories.extend(children)
+        level = subdirectories
+    # Each directory's files, then its subdirectories
+    return sorted(found, key=lambda path: (Path(path).parent.parts, Path(path).name))
+
+def scan_audio(paths: Iterable[str], jobs: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    Collects the audio files among paths and in the directories among them,
+    in order, scanning directories with parallel threads.
+
+    Returns:
+        List[Tuple[str, str]]: (file path, array name prefix) pairs, see
+        directory_prefix. Files given directly have no prefix.
+    """
+    paths = list(paths)
+    found = []
+    parallel = jobs != 1 and any(os.path.isdir(path) for path in paths)
+    executor = ThreadPoolExecutor(jobs) if parallel else None
+    try:
+        for path in paths:
+            if os.path.isdir(path):
+                found.extend((file, directory_prefix(path, os.path.dirname(file)))
+                             for file in scan_tree(path, executor))
+            elif os.path.isfile(path) and is_audio_file(path):
+                found.append((path, ''))
+            else:
+                logger.warning(f"Skipping {path}, not an audio file or a directory")
+    finally:
+        if executor:
+            executor.shutdown()
+    return found
+
+def read_file_list(f) -> List[str]:
+    """The paths of a NUL-delimited list, as find -print0 writes them, from a binary file."""
+    return [os.fsdecode(path) for path in f.read().split(b'\0') if path]
+
+class Sidecar:
+    """
+    Keeps array data out of the patch. Audio is written to (or, when it can
+    be used unchanged, referenced from) files next to the patch, and the
+    arrays are filled by [soundfiler] on load.
+    """
+    def __init__(self, patch_path, format='wav'):
+        if format not in SIDECAR_FORMATS:
+            raise ValueError(f"Unsupported sidecar format: {format}")
+        self.patch_dir = os.path.dirname(os.path.abspath(patch_path))
+        self.directory = os.path.join(self.patch_dir, f"{Path(patch_path).stem}_audio")
+        self.format = format
+        self.reads = {}  # file path relative to the patch -> array names
+
+    def add(self, file_path, array_names):
+        try:
+            file_path = os.path.relpath(file_path, self.patch_dir)
+        except ValueError:  # Different drive
+            file_path = os.path.abspath(file_path)
+        self.reads[Path(file_path).as_posix()] = list(array_names)
+
+    def write(self, name, data, samplerate, array_names, subtype='FLOAT'):
+        """Writes decoded data, as 32 bit floats by default: resampled audio isn't quantized or clipped."""
+        os.makedirs(self.directory, exist_ok=True)
+        file_path = os.path.join(self.directory, f"{name}.{self.format}")
+        sf.write(file_path, data, samplerate, subtype)
+        logger.info(f"Wrote {file_path}")
+        self.add(file_path, array_names)
+
+    def subtype(self, file_path):
+        """The subtype of file_path if this format can hold it, 32 bit float otherwise, which loses nothing Pd keeps."""
+        subtype = sf.info(file_path).subtype
+        return subtype if sf.check_format(self.format.upper(), subtype) else 'FLOAT'
+
+    def can_reference(self, file_path, target_samplerate):
+        if not file_path.lower().endswith(SOUNDFILER_EXTENSIONS):
+            return None
+        info = sf.info(file_path)
+        if target_samplerate and info.samplerate != target_samplerate:
+            return None
+        return info
+
+class Dedup:
+    """
+    Keeps a single array for each distinct buffer. Later copies become
+    aliases of the first one, resolved in the "play_file" router.
+
+    Files referenced in place aren't decoded to be hashed until another
+    buffer of the same shape shows up, as most have none.
+    """
+    def __init__(self):
+        self.buffers = {}  # digest -> array names holding the data
+        self.aliases = {}  # duplicate name -> shared array name
+        self.shapes = set()  # Shapes of the buffers hashed
+        self.pending = {}  # shape -> (array names, path) of a referenced file not hashed yet
+        self.samples_saved = 0
+        self.bytes_saved = 0
+
+    @staticmethod
+    def digest_data(data):
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        return hashlib.sha1(str(data.shape).encode() + data.tobytes()).hexdigest()
+
+    @staticmethod
+    def digest_audio(file_path, shape):
+        """The digest digest_data gives the decoded content of an audio file, decoded block by block."""
+        digest = hashlib.sha1(str(shape).encode())
+        for block in sf.blocks(file_path, blocksize=STREAM_BLOCK, dtype='float64'):
+            digest.update(np.ascontiguousarray(block).tobytes())
+        return digest.hexdigest()
+
+    def add(self, names, digest, samples, shape):
+        """
+        Registers the arrays holding a buffer of shape. Returns True if the
+        buffer was already registered, making names aliases of the arrays
+        holding it.
+        """
+        self.hash_pending(shape)
+        shared = self.buffers.setdefault(digest, names)
+        if shared is names:
+            return False
+        self.aliases.update(zip(names, shared))
+        self.samples_saved += samples
+        self.bytes_saved += samples * 4  # Pd arrays hold 32 bit floats
+        return True
+
+    def add_file(self, names, file_path, frames, channels):
+        """Like add, for the arrays reading an audio file in place, hashed only if needed."""
+        shape = audio_shape(frames, channels)
+        if shape not in self.shapes and shape not in self.pending:
+            self.pending[shape] = (names, file_path)
+            return False
+        return self.add(names, self.digest_audio(file_path, shape), frames * channels, shape)
+
+    def keep(self, names, digest, shape):
+        """Registers arrays already holding a buffer, which stay as they are even if they are duplicates."""
+        self.hash_pending(shape)
+        self.buffers.setdefault(digest, names)
+
+    def hash_pending(self, shape):
+        """Hashes the referenced file waiting with shape, now that another buffer has it."""
+        self.shapes.add(shape)
+        pending = self.pending.pop(shape, None)
+        if pending:
+            names, file_path = pending
+            self.buffers.setdefault(self.digest_audio(file_path, shape), names)
+
+    def __repr__(self):
+        return (f"Deduplicated {len(self.aliases)} arrays, saving {self.samples_saved} samples "
+                f"({self.bytes_saved} bytes)")
+
+def audio_shape(frames, channels):
+    """The shape of the buffer decoded from an audio file."""
+    return (frames,) if channels == 1 else (frames, channels)
+
+def process_audio_file(file_path, target_samplerate, resampler='hq'):
     try:
         data, samplerate = sf.read(file_path)
         if target_samplerate and samplerate != target_samplerate:
-            data = resampy.resample(data, samplerate, target_samplerate, axis=0)
+            data = resample(data, samplerate, target_samplerate, resampler, axis=0)
             logger.info(f"Resampled {file_path} from {samplerate} to {target_samplerate} Hz")
         return data
     except Exception as e:
         logger.error(f"Error loading {file_path}: {str(e)}")
         return None
 
-def create_array_patch(name, data, x, y):
-    return ArrayPatch(x, y, name, len(data), data.tolist())
+def create_array_patch(name, data, x, y, preview=None):
+    """
+    The graph of an array holding data. With preview, the number of values
+    of its preview, the graph is hidden in a DataPatch shown by the preview.
+    """
+    array_patch = ArrayPatch(x, y, name, len(data), data.tolist())
+    if preview:
+        from pdulate.arrays import make_preview
+        return DataPatch(x, y, array_patch, make_preview(name, data, preview, x, y))
+    return array_patch
+
+def create_array_declaration(name, size, x, y):
+    # Save flag 2: drawn as polygon, content not saved with the patch
+    return ArrayPatch(x, y, name, size, save_flag="2")
 
-def process_path(path, target_samplerate, prefix=''):
+def channel_names(array_name, channels):
+    if channels == 1:
+        return [array_name]
+    return [f"{array_name}_{i+1}" for i in range(channels)]
+
+class AudioSource:
+    """
+    A file to load, as probed from its header without decoding it.
+
+    Attributes:
+        path (str): The file.
+        name (str): Its array name, the prefix of its channel arrays.
+        frames (int): Frames per channel once loaded, estimated when resampled.
+        channels (int): Channel count.
+        samplerate (int): Sample rate of the file.
+        resampled (bool): Whether it has to be resampled.
+        reference (bool): Whether a sidecar can use the file as it is.
+    """
+    def __init__(self, path, name, frames, channels, samplerate, resampled=False, reference=False):
+        self.path = path
+        self.name = name
+        self.frames = frames
+        self.channels = channels
+        self.samplerate = samplerate
+        self.resampled = resampled
+        self.reference = reference
+
+    @property
+    def names(self):
+        return channel_names(self.name, self.channels)
+
+    @property
+    def samples(self):
+        return self.frames * self.channels
+
+    def __repr__(self):
+        return f"AudioSource({self.path!r}, {self.name!r}, {self.frames} frames, {self.channels} channels)"
+
+class AudioPlan:
+    """
+    What loading a set of files takes, known before anything is decoded.
+
+    Attributes:
+        sources (List[AudioSource]): The readable files, in loading order.
+        unreadable (List[str]): Files whose header couldn't be read.
+    """
+    def __init__(self, sources, unreadable=()):
+        self.sources = list(sources)
+        self.unreadable = list(unreadable)
+
+    @property
+    def samples(self):
+        """Total samples of the arrays, all channels included."""
+        return sum(source.samples for source in self.sources)
+
+    @property
+    def bytes(self):
+        """Memory the samples take decoded, as 64-bit floats."""
+        return self.samples * 8
+
+    @property
+    def array_names(self):
+        return [name for source in self.sources for name in source.names]
+
+    def check(self, max_samples, sidecar=False):
+        """
+        Raises ValueError if loading would hold more than max_samples samples
+        in memory at once. Embedded arrays all stay in memory. With a sidecar,
+        files are referenced or converted block by block, except those to
+        resample, which are decoded one at a time.
+        """
+        if max_samples is None:
+            return
+        if not sidecar:
+            if self.samples > max_samples:
+                raise ValueError(f"Loading {len(self.sources)} files takes {self.samples} samples "
+                                 f"({self.bytes} bytes), over {max_samples}, keep the audio in a sidecar instead")
+            return
+        oversized = [source.path for source in self.sources
+                     if source.resampled and not source.reference and source.samples > max_samples]
+        if oversized:
+            raise ValueError(f"{len(oversized)} files to resample are over {max_samples} samples: "
+                             f"{', '.join(oversized)}")
+
+    def as_dict(self):
+        return {'files': len(self.sources), 'unreadable': self.unreadable, 'samples': self.samples,
+                'bytes': self.bytes, 'arrays': self.array_names}
+
+def probe(path, prefix='', target_samplerate=None, sidecar=None):
+    """The AudioSource of a file, from its header, None if it can't be read."""
+    try:
+        info = sf.info(path)
+    except Exception as e:
+        logger.error(f"Error reading {path}: {str(e)}")
+        return None
+    name = f"{prefix}_{Path(path).stem}" if prefix else Path(path).stem
+    resampled = bool(target_samplerate) and info.samplerate != target_samplerate
+    frames = -(-info.frames * target_samplerate // info.samplerate) if resampled else info.frames
+    reference = sidecar is not None and sidecar.can_reference(path, target_samplerate) is not None
+    return AudioSource(path, name, frames, info.channels, info.samplerate, resampled, reference)
+
+def plan_audio(audio_paths, target_samplerate=None, prefix='', sidecar=None, jobs=None):
+    """
+    Scans audio_paths (see scan_audio) and probes every file found, in
+    parallel threads, reading headers only. Files given directly get prefix,
+    files found in directories get the prefix of their directory.
+
+    Returns:
+        AudioPlan: The files, their arrays and sizes.
+    """
+    found = [(path, file_prefix or prefix) for path, file_prefix in scan_audio(audio_paths, jobs)]
+    probe_file = lambda entry: probe(entry[0], entry[1], target_samplerate, sidecar)
+    if len(found) > 1 and jobs != 1:
+        with ThreadPoolExecutor(jobs) as executor:
+            probed = list(executor.map(probe_file, found))
+    else:
+        probed = [probe_file(entry) for entry in found]
+    return AudioPlan([source for source in probed if source],
+                     [path for (path, _), source in zip(found, probed) if source is None])
+
+def stream_to_sidecar(source, sidecar, dedup=None):
+    """
+    Converts a file needing no resampling into the sidecar block by block.
+
+    Returns:
+        bool: False if dedup found it to be a duplicate, and nothing was kept.
+    """
+    os.makedirs(sidecar.directory, exist_ok=True)
+    file_path = os.path.join(sidecar.directory, f"{source.name}.{sidecar.format}")
+    shape = audio_shape(source.frames, source.channels)
+    # The digest Dedup.digest_data gives the whole buffer
+    digest = hashlib.sha1(str(shape).encode())
+    try:
+        with sf.SoundFile(file_path, 'w', source.samplerate, source.channels, sidecar.subtype(source.path)) as out:
+            for block in sf.blocks(source.path, blocksize=STREAM_BLOCK, dtype='float64'):
+                digest.update(np.ascontiguousarray(block).tobytes())
+                out.write(block)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.unlink(file_path)
+        raise
+    if dedup and dedup.add(source.names, digest.hexdigest(), source.samples, shape):
+        os.unlink(file_path)
+        return False
+    logger.info(f"Wrote {file_path}")
+    sidecar.add(file_path, source.names)
+    return True
+
+def process_source(source, target_samplerate, sidecar=None, resampler='hq', dedup=None, preview=None):
+    """The arrays, by name, made from a probed file, see create_array_patch for preview."""
     new_arrays = {}
-    if os.path.isfile(path) and is_audio_file(path):
-        data = process_audio_file(path, target_samplerate)
-        if data is not None:
-            array_name = Path(path).stem
-            if prefix:
-                array_name = f"{prefix}_{array_name}"
-            if len(data.shape) == 1:  # Mono
-                new_arrays[array_name] = create_array_patch(array_name, data, 0, 0)
-            else:  # Multi-channel
-                for i in range(data.shape[1]):
-                    channel_name = f"{array_name}_{i+1}"
-                    new_arrays[channel_name] = create_array_patch(channel_name, data[:, i], 0, 0)
-                    
-    elif os.path.isdir(path):
-        dir_name = os.path.basename(path)
-        for root, _, files in os.walk(path):
-            for file in filter(is_audio_file, files):
-                new_arrays.update(process_path(os.path.join(root, file), target_samplerate, dir_name))
+    path = source.path
+    array_name = source.name
+
+    if source.reference:
+        # Usable as it is, no need to decode anything
+        names = source.names
+        if dedup and dedup.add_file(names, path, source.frames, source.channels):
+            return new_arrays
+        for name in names:
+            new_arrays[name] = create_array_declaration(name, source.frames, 0, 0)
+        sidecar.add(path, names)
+        return new_arrays
+
+    if sidecar and not source.resampled:
+        try:
+            if stream_to_sidecar(source, sidecar, dedup):
+                for name in source.names:
+                    new_arrays[name] = create_array_declaration(name, source.frames, 0, 0)
+        except Exception as e:
+            logger.error(f"Error converting {path}: {str(e)}")
+        return new_arrays
+
+    data = process_audio_file(path, target_samplerate, resampler)
+    if data is not None:
+        names = channel_names(array_name, 1 if len(data.shape) == 1 else data.shape[1])
+        if sidecar:
+            if dedup and dedup.add(names, Dedup.digest_data(data), data.size, data.shape):
+                return new_arrays
+            sidecar.write(array_name, data, target_samplerate or source.samplerate, names)
+            for name in names:
+                new_arrays[name] = create_array_declaration(name, len(data), 0, 0)
+        elif len(data.shape) == 1:  # Mono
+            if not (dedup and dedup.add(names, Dedup.digest_data(data), data.size, data.shape)):
+                new_arrays[array_name] = create_array_patch(array_name, data, 0, 0, preview)
+        else:  # Multi-channel
+            for i, channel_name in enumerate(names):
+                channel = data[:, i]
+                if dedup and dedup.add([channel_name], Dedup.digest_data(channel), channel.size, channel.shape):
+                    continue
+                new_arrays[channel_name] = create_array_patch(channel_name, channel, 0, 0, preview)
+    return new_arrays
+
+def process_path(path, target_samplerate, prefix='', sidecar=None, resampler='hq', dedup=None, preview=None):
+    """The arrays, by name, made from an audio file or the audio files of a directory."""
+    new_arrays = {}
+    for source in plan_audio([path], target_samplerate, prefix, sidecar, jobs=1).sources:
+        new_arrays.update(process_source(source, target_samplerate, sidecar, resampler, dedup, preview))
     return new_arrays
 
-def load_audio(audio_paths, patch_path, target_samplerate=None):
+def keep_embedded_arrays(dedup, subpatch, reloaded):
+    """Registers the arrays with saved content of subpatch in dedup, but those reloaded and previews."""
+    for item in subpatch.get_items():
+        array_patch = ArrayPatch.from_patch(item) or DataPatch.from_patch(item)
+        if not array_patch or array_patch.get_name() in reloaded or array_patch.get_name().endswith(PREVIEW_SUFFIX):
+            continue
+        array = array_patch.get_array()
+        if array.saves_content():
+            dedup.keep([array.name], Dedup.digest_data(array.data), np.shape(array.data))
+
+def read_soundfiler_messages(subpatch):
+    """
+    Collects the "read -resize file array..." messages of a previously
+    generated loader chain, as a dictionary of file -> array names.
+    """
+    reads = {}
+    for item in subpatch.get_items():
+        if isinstance(item, Message):
+            for command in item.message.split(','):
+                parts = command.split()
+                if len(parts) > 3 and parts[:2] == ['read', '-resize']:
+                    reads[parts[2]] = parts[3:]
+    return reads
+
+def read_alias_comments(subpatch):
+    """
+    Collects the "alias name shared_name" comments of a previous
+    deduplicated load, as a dictionary of name -> shared name.
+    """
+    aliases = {}
+    for item in subpatch.get_items():
+        if isinstance(item, Comment):
+            parts = item.text.split()
+            if len(parts) == 3 and parts[0] == 'alias':
+                aliases[parts[1]] = parts[2]
+    return aliases
+
+def read_channel_comments(subpatch):
+    """
+    Collects the "channels name name_1 name_2..." comments of a previous
+    load, as a dictionary of file array name -> channel array names.
+    """
+    channels = {}
+    for item in subpatch.get_items():
+        if isinstance(item, Comment):
+            parts = item.text.split()
+            if len(parts) > 3 and parts[0] == 'channels':
+                channels[parts[1]] = parts[2:]
+    return channels
+
+def add_soundfiler_chain(subpatch, reads, x, y):
+    """
+    Adds [loadbang] -> [read -resize ...( -> [soundfiler] filling the arrays
+    of the subpatch from their files.
+    """
+    loadbang_obj = Object(x, y, "loadbang", [])
+    subpatch.add_item(loadbang_obj)
+    commands = [f"read -resize {file} {' '.join(names)}" for file, names in reads.items()]
+    read_msg = Message(x, y + 30, ", ".join(commands))
+    subpatch.add_item(read_msg)
+    soundfiler_obj = Object(x, y + 60, "soundfiler", [])
+    subpatch.add_item(soundfiler_obj)
+    loadbang_obj.connect(0, read_msg, 0)
+    read_msg.connect(0, soundfiler_obj, 0)
+
+ROUTE_SIZE = 128
+
+def add_route_tree(subpatch, source, count, x, y, outlet=0):
+    """
+    Adds a tree of [route] objects dispatching the index coming from the
+    source outlet, each level taking one base ROUTE_SIZE digit ([div] &
+    [mod] -> [pack] -> [route]), so every index is at most a few routes
+    away however many arrays there are.
+
+    Returns a list of (route, outlet) pairs, one for each index, and the y
+    coordinate below the tree.
+    """
+    span = 1
+    while span * ROUTE_SIZE < count:
+        span *= ROUTE_SIZE
+
+    if span == 1:
+        route_obj = Object(x, y, "route", [str(i) for i in range(count)])
+        subpatch.add_item(route_obj)
+        source.connect(outlet, route_obj, 0)
+        return [(route_obj, i) for i in range(count)], y + 30
+
+    # Split the index into (index // span, index % span)
+    tff_obj = Object(x, y, "t", ["f", "f"])
+    div_obj = Object(x, y + 30, "div", [str(span)])
+    mod_obj = Object(x + 50, y + 30, "mod", [str(span)])
+    pack_obj = Object(x, y + 60, "pack", ["f", "f"])
+    groups = -(-count // span)
+    route_obj = Object(x, y + 90, "route", [str(i) for i in range(groups)])
+    subpatch.add_items([tff_obj, div_obj, mod_obj, pack_obj, route_obj])
+    source.connect(outlet, tff_obj, 0)
+    tff_obj.connect(1, mod_obj, 0)
+    tff_obj.connect(0, div_obj, 0)
+    mod_obj.connect(0, pack_obj, 1)
+    div_obj.connect(0, pack_obj, 0)
+    pack_obj.connect(0, route_obj, 0)
+
+    # Each route outlet passes the remainder on to the next level
+    outlets = []
+    bottom = y + 120
+    for group in range(groups):
+        group_outlets, group_bottom = add_route_tree(subpatch, route_obj, min(span, count - group * span),
+                                                     x + group * 10, y + 120, group)
+        outlets.extend(group_outlets)
+        bottom = max(bottom, group_bottom)
+    return outlets, bottom
+
+def create_playback_subpatch(names):
+    """
+    Creates the "play_file" subpatch playing the array at the index
+    received on its inlet through [tabplay~].
+    """
+    playback_subpatch = Subpatch(20, 50, 200, 200, "play_file")
+
+    # Create receive object
+    receive_obj = Object(10, 10, "inlet", [])
+    playback_subpatch.add_item(receive_obj)
+
+    # Numbers go into [route] objects
+    route_outlets, y = add_route_tree(playback_subpatch, receive_obj, len(names), 10, 40)
+
+    # Bang & set array
+    rows = -(-len(names) // ROUTE_SIZE)
+    y += rows * 30
+    tbs_obj = Object(10, y, 't', ['b', 's'])
+    playback_subpatch.add_item(tbs_obj)
+    set_msg = Message(40, y + 40, "set $1")
+    playback_subpatch.add_item(set_msg)
+    tbs_obj.connect(1, set_msg, 0)
+
+    # Arrays to choose from -> convert & set array
+    for i, (name, (route_obj, outlet)) in enumerate(zip(names, route_outlets)):
+        msg_obj = Message(10 + (i % ROUTE_SIZE) * 10, y - (rows - i // ROUTE_SIZE) * 30, name)
+        playback_subpatch.add_item(msg_obj)
+        route_obj.connect(outlet, msg_obj, 0)
+        msg_obj.connect(0, tbs_obj, 0)
+
+    # Connect to a tabplay~ object
+    tabplay_obj = Object(10, y + 70, "tabplay~", [])
+    playback_subpatch.add_item(tabplay_obj)
+    set_msg.connect(0, tabplay_obj, 0) # Set array
+    tbs_obj.connect(0, tabplay_obj, 0) # Bang
+
+    # Send out
+    outlet_obj = Object(10, y + 100, "outlet~", [])
+    playback_subpatch.add_item(outlet_obj)
+    tabplay_obj.connect(0, outlet_obj, 0)
+
+    return playback_subpatch
+
+def load_audio(audio_paths, patch_path, target_samplerate=None, sidecar_format=None, resampler='hq',
+               deduplicate=False, store=None, max_samples=None, jobs=None, preview=None):
+    """
+    Loads audio files into the "audio_files" subpatch of a patch, one array
+    per channel, and regenerates the "play_file" subpatch.
+
+    With sidecar_format ("wav") array data isn't embedded in the
+    patch. Files that [soundfiler] can read and need no resampling are
+    referenced where they are, anything else is written to a
+    "<patch>_audio" directory, and a [soundfiler] chain loads them when the
+    patch opens.
+
+    The resampler is "hq" (resampy) or "fast" (NumPy polyphase, for drafts).
+
+    With deduplicate, identical buffers among the loaded files are stored
+    once and the other names are kept as aliases ("alias name shared_name"
+    comments in "audio_files") which "play_file" resolves to the shared
+    array.
+
+    Directories are scanned, and every file probed from its header, before
+    anything is decoded (see plan_audio). Arrays of files found in nested
+    directories are prefixed with the directory names from the one given,
+    e.g. drums_kicks_kick1. Loads taking more than max_samples samples in
+    memory raise ValueError, see AudioPlan.check. jobs bounds the threads
+    scanning and probing, one per CPU by default.
+
+    With preview, a number of values, embedded arrays are kept in closed
+    subpatches, which Pd doesn't draw, and shown by a preview array of
+    their min/max envelope (see pdulate.arrays.envelope), computed as they
+    are loaded. Previews of arrays already loaded are kept as they are.
+
+    Patches are read and written through store, a PatchStore by default.
+    Returns the Dedup with the savings if deduplicating, None otherwise.
+    """
+    store = store or PatchStore()
+
     # Load or create the patch
-    if os.path.exists(patch_path):
-        with open(patch_path, 'r') as f:
-            content = f.read()
-        parser = Parser()
-        patch = parser.parse_patch(content)
+    if store.exists(patch_path):
+        patch = store.read(patch_path)
     else:
         patch = Patch(0, 0, 800, 600)
 
+    dedup = add_audio(patch, patch_path, audio_paths, target_samplerate, sidecar_format, resampler, deduplicate,
+                      max_samples=max_samples, jobs=jobs, preview=preview)
+
+    # Serialize and save the modified patch
+    store.write(patch_path, patch)
+    logger.info(f"Modified patch saved as {patch_path}")
+
+    if dedup:
+        logger.info(dedup)
+    return dedup
+
+def add_audio(patch, patch_path, audio_paths, target_samplerate=None, sidecar_format=None, resampler='hq',
+              deduplicate=False, prefix='', max_samples=None, jobs=None, preview=None):
+    """
+    Does the work of load_audio on a patch in memory, patch_path only
+    locates sidecar files. Array names of the files given get prefix, as
+    files found in a directory get the names of the directories. Returns the
+    Dedup with the savings if deduplicating, None otherwise.
+    """
+    sidecar = Sidecar(patch_path, sidecar_format) if sidecar_format else None
+    dedup = Dedup() if deduplicate else None
+
+    # Nothing is decoded, or changed, before the plan is known to fit
+    plan = plan_audio(audio_paths, target_samplerate, prefix, sidecar, jobs)
+    plan.check(max_samples, sidecar is not None)
+    logger.info(f"Loading {len(plan.sources)} files, {plan.samples} samples")
+    if preview and sidecar:
+        logger.warning("Previews are only made of embedded arrays, not of sidecar ones")
+
     # Find or create the "audio_files" subpatch
     old_audio_subpatch = next((item for item in patch.get_items() if isinstance(item, Subpatch) and item.name == "audio_files"), None)
     audio_subpatch = Subpatch(20, 20, 200, 200, "audio_files")
     patch.add_item(audio_subpatch)
 
+    # Arrays already embedded hold the first copy of their buffer
+    if dedup and old_audio_subpatch:
+        keep_embedded_arrays(dedup, old_audio_subpatch, set(plan.array_names))
+
     # Process all new audio files
     new_arrays = {}
-    for path in audio_paths:
-        new_arrays.update(process_path(path, target_samplerate))
+    for source in plan.sources:
+        new_arrays.update(process_source(source, target_samplerate, sidecar, resampler, dedup, preview))
+    new_aliases = dedup.aliases if dedup else {}
 
     # Update existing arrays
+    reads = {}
+    aliases = {}
+    channels = {}
     if old_audio_subpatch:
-        for item in old_audio_subpatch.get_items():
-            array_patch = ArrayPatch.from_patch(item)
-            if array_patch:
-                if array_patch.get_name() in new_arrays:
+        old_reads = read_soundfiler_messages(old_audio_subpatch)
+        aliases = read_alias_comments(old_audio_subpatch)
+        channels = read_channel_comments(old_audio_subpatch)
+        old_arrays = [ArrayPatch.from_patch(item) or DataPatch.from_patch(item)
+                      for item in old_audio_subpatch.get_items()]
+        # Previews go with the array they show
+        hidden = {item.get_name(): item for item in old_arrays if isinstance(item, DataPatch)}
+        for item in old_arrays:
+            if item and item.get_name().endswith(PREVIEW_SUFFIX) and item.get_name()[:-len(PREVIEW_SUFFIX)] in hidden:
+                hidden[item.get_name()[:-len(PREVIEW_SUFFIX)]].preview = item
+        previews = {id(item.preview) for item in hidden.values() if item.preview}
+        for array_patch in old_arrays:
+            if array_patch and id(array_patch) not in previews:
+                if array_patch.get_name() in new_aliases:
+                    continue  # Reloaded as a duplicate
+                elif array_patch.get_name() in new_arrays:
                     new_array_patch = new_arrays.pop(array_patch.get_name())
                     audio_subpatch.add_item(new_array_patch)
                     # tools.replace would consider location and connections - We don't need it
@@ -87,79 +709,110 @@ def load_audio(audio_paths, patch_path, target_samplerate=None):
                     audio_subpatch.add_item(array_patch)
         patch.remove_item(old_audio_subpatch)
 
+        # Keep loading files whose arrays are all still declared and not reloaded
+        kept = {item.get_name() for item in audio_subpatch.get_items()
+                if not item.get_array().saves_content()}
+        reloaded = {name for names in sidecar.reads.values() for name in names} if sidecar else set()
+        reads = {file: names for file, names in old_reads.items()
+                 if kept.issuperset(names) and reloaded.isdisjoint(names)}
+
     for array_patch in new_arrays.values():
         audio_subpatch.add_item(array_patch)
 
-    # Adjust positions
-    x_offset, y_offset = 10, 10
-    for item in audio_subpatch.get_items():
+    array_patches = audio_subpatch.get_items().copy()
+    array_names = [item.get_name() for item in array_patches]
+
+    # Keep previous aliases unless reloaded or left without their array
+    aliases = {name: shared for name, shared in aliases.items() if name not in new_arrays}
+    aliases.update(new_aliases)
+    declared = set(array_names)
+    aliases = {name: shared for name, shared in aliases.items() if shared in declared}
+    # Keep previous channel lists unless reloaded or left without their arrays
+    loaded = {source.name for source in plan.sources}
+    channels = {name: names for name, names in channels.items() if name not in loaded}
+    channels.update((source.name, source.names) for source in plan.sources if source.channels > 1)
+    channels = {name: names for name, names in channels.items() if declared.union(aliases).issuperset(names)}
+    if sidecar:
+        reads.update(sidecar.reads)
+    if reads:
+        add_soundfiler_chain(audio_subpatch, reads, 10, 10)
+
+    # Adjust positions, previews in place of the arrays they show, above them
+    x_offset, y_offset = (10, 110) if reads else (10, 10)
+    for item in array_patches:
+        if isinstance(item, DataPatch) and item.preview:
+            item.preview.set_external_x(x_offset)
+            item.preview.set_external_y(y_offset)
+            audio_subpatch.add_item(item.preview)
+            y_offset += 145
         item.set_external_x(x_offset)
         item.set_external_y(y_offset)
-        y_offset += 150
+        y_offset += 25 if isinstance(item, DataPatch) else 150
         if y_offset > 600:
             y_offset = 10
             x_offset += 210
 
-    # Create a new subpatch for routing and playback if the total number of arrays is <= 128
+    for i, (name, shared) in enumerate(aliases.items()):
+        audio_subpatch.add_item(Comment(x_offset + 210, 10 + i * 20, f"alias {name} {shared}"))
+    for i, (name, names) in enumerate(channels.items(), len(aliases)):
+        audio_subpatch.add_item(Comment(x_offset + 210, 10 + i * 20, f"channels {name} {' '.join(names)}"))
+
+    # Create a new subpatch for routing and playback
     old_playback_subpatch = next((item for item in patch.items if isinstance(item, Subpatch) and item.name == "play_file"), None)
     if old_playback_subpatch:
         patch.remove_item(old_playback_subpatch)
 
-    total_arrays = len(audio_subpatch.get_items())
-    if total_arrays <= 128:
-        playback_subpatch = Subpatch(20, 50, 200, 200, "play_file")
-        
-        # Create receive object
-        receive_obj = Object(10, 10, "inlet", [])
-        playback_subpatch.add_item(receive_obj)
-
-        # Numbers go into a [route] object
-        route_obj = Object(10, 40, "route", list(range(total_arrays)))
-        playback_subpatch.add_item(route_obj)
-        receive_obj.connect(0, route_obj, 0)
-
-        # Bang & set array
-        tbs_obj = Object(10, 100, 't', ['b', 's'])
-        playback_subpatch.add_item(tbs_obj)
-        set_msg = Message(40, 140, "set $1")
-        playback_subpatch.add_item(set_msg)
-        tbs_obj.connect(1, set_msg, 0)
-
-        # Arrays to choose from -> convert & set array
-        for i, item in enumerate(audio_subpatch.get_items()):
-            msg_obj = Message(10 + i*10, 70, item.get_name())
-            playback_subpatch.add_item(msg_obj)
-            route_obj.connect(i, msg_obj, 0)
-            msg_obj.connect(0, tbs_obj, 0)
-
-        # Connect to a tabplay~ object
-        tabplay_obj = Object(10, 170, "tabplay~", [])
-        playback_subpatch.add_item(tabplay_obj)
-        set_msg.connect(0, tabplay_obj, 0) # Set array
-        tbs_obj.connect(0, tabplay_obj, 0) # Bang
-
-        # Send out
-        outlet_obj = Object(10, 200, "outlet~", [])
-        playback_subpatch.add_item(outlet_obj)
-        tabplay_obj.connect(0, outlet_obj, 0)
-
-        # Add the playback subpatch to the main patch
-        patch.add_item(playback_subpatch)
+    if array_patches:
+        # Aliases come last, keeping the indices of the arrays
+        patch.add_item(create_playback_subpatch(array_names + list(aliases.values())))
 
-    # Serialize and save the modified patch
-    modified_content = serialize_patch(patch)
-    with open(patch_path, 'w') as file:
-        file.write(modified_content)
-    logger.info(f"Modified patch saved as {patch_path}")
+    return dedup
+
+def gather_paths(paths, files0_from=None):
+    """paths, then those of the NUL-delimited list in the file files0_from, standard input for -."""
+    paths = list(paths)
+    if files0_from == '-':
+        paths.extend(read_file_list(sys.stdin.buffer))
+    elif files0_from:
+        with open(files0_from, 'rb') as f:
+            paths.extend(read_file_list(f))
+    return paths
+
+def print_plan(audio_paths, target_samplerate=None, sidecar_format=None, patch_path='', jobs=None):
+    """Prints the plan of a load as JSON, without decoding or writing anything."""
+    sidecar = Sidecar(patch_path, sidecar_format) if sidecar_format else None
+    plan = plan_audio(audio_paths, target_samplerate, sidecar=sidecar, jobs=jobs)
+    print(json.dumps(plan.as_dict(), indent=2))
 
 def main():
     parser = argparse.ArgumentParser(description="Load audio files into a Pure Data patch.")
     parser.add_argument('--sample-rate', type=int, nargs='?', help='Target sample rate for audio files')
+    parser.add_argument('--resampler', choices=RESAMPLERS, default='hq', help='hq (resampy) or fast (NumPy only, for common ratios like 44.1k <-> 48k)')
+    parser.add_argument('--dedup', action='store_true', help='Store identical audio only once, aliasing the duplicates')
+    parser.add_argument('--sidecar', choices=SIDECAR_FORMATS, help='Keep audio in files next to the patch, loaded by [soundfiler], instead of embedding it')
+    parser.add_argument('--files0-from', metavar='FILE', help='Also load the files of a NUL-delimited list, as find -print0 writes, - for standard input')
+    parser.add_argument('--max-samples', type=int, help='Refuse loads holding more samples than this in memory')
+    parser.add_argument('--jobs', type=int, help='Number of threads scanning directories and reading file headers')
+    parser.add_argument('--plan', action='store_true', help='Print the files, arrays and sizes of the load as JSON, and stop')
+    parser.add_argument('--preview', type=int, metavar='POINTS', help='Hide embedded arrays in closed subpatches, shown by a min/max envelope of this many points')
     parser.add_argument('patch', type=str, help='Path to the patch file')
-    parser.add_argument('audio_path', nargs='+', type=str, help='List of audio files, or directories containing them, to load')
+    parser.add_argument('audio_path', nargs='*', type=str, help='List of audio files, or directories containing them, to load')
 
     args = parser.parse_args()
-    load_audio(args.audio_path, args.patch, args.sample_rate)
+    paths = gather_paths(args.audio_path, args.files0_from)
+    if not paths:
+        parser.error("No audio files or directories given")
+    if args.plan:
+        print_plan(paths, args.sample_rate, args.sidecar, args.patch, args.jobs)
+        return
+    try:
+        dedup = load_audio(paths, args.patch, args.sample_rate, args.sidecar, args.resampler, args.dedup,
+                           max_samples=args.max_samples, jobs=args.jobs, preview=args.preview)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if dedup:
+        print(dedup)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,98 @@
+"""
+Resamplers for load_audio. "hq" is resampy: accurate, but slow and its
+numba warm-up makes the first call take seconds. "fast" is a NumPy-only
+polyphase windowed-sinc filter for ratios of small integers, e.g.
+44.1k <-> 48k <-> 96k, which falls back to resampy for anything else.
+"""
+
+from math import gcd
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.NOTSET)
+
+RESAMPLERS = ('hq', 'fast')
+# Above this up/down factor the filter table gets too big, resampy takes over
+MAX_POLYPHASE_FACTOR = 1024
+
+def polyphase_filter(up, down, zeros=16, beta=8.0, rolloff=0.95):
+    """
+    Kaiser windowed sinc low-pass at the lower of the two Nyquist
+    frequencies, sampled at the upsampled rate and scaled by up to make up
+    for the inserted zeros.
+
+    Returns:
+        Tuple[np.ndarray, int]: The filter and its half length.
+    """
+    cutoff = rolloff / max(up, down)
+    half = int(np.ceil(zeros / cutoff))
+    n = np.arange(-half, half + 1)
+    h = up * cutoff * np.sinc(cutoff * n) * np.kaiser(2 * half + 1, beta)
+    return h, half
+
+def resample_poly(data, up, down, axis=0):
+    """
+    Resamples data by up/down. Output samples sharing a filter phase
+    (every up-th one) read the input at a fixed stride of down, so each
+    phase is a single dot product over a strided view of the input, and the
+    zero-stuffed signal is never built.
+    """
+    data = np.moveaxis(np.asarray(data, dtype=np.float64), axis, 0)
+    g = gcd(up, down)
+    up, down = up // g, down // g
+    if up == down:
+        return np.moveaxis(data.copy(), 0, axis)
+
+    h, half = polyphase_filter(up, down)
+    taps = 2 * half // up + 1
+    length = data.shape[0]
+    out_length = -(-length * up // down)
+
+    # Zero padding around the input keeps every tap in range
+    pad = half // up + 1
+    padded = np.zeros((length + 2 * pad + taps,) + data.shape[1:])
+    padded[pad:pad + length] = data
+
+    phases = min(up, out_length)
+    t = np.arange(phases, dtype=np.int64) * down  # Position at the upsampled rate
+    first = -((half - t) // up)  # First input sample within the filter reach
+    index = (t - first * up + half)[:, None] - np.arange(taps) * up
+    coefs = np.where(index >= 0, h[np.maximum(index, 0)], 0.0)
+
+    out = np.empty((out_length,) + data.shape[1:])
+    strides = padded.strides
+    for phase in range(phases):
+        count = len(range(phase, out_length, up))
+        window = np.lib.stride_tricks.as_strided(
+            padded[first[phase] + pad:], shape=(count, taps) + data.shape[1:],
+            strides=(down * strides[0],) + strides, writeable=False)
+        out[phase::up] = np.tensordot(window, coefs[phase], axes=([1], [0]))
+    return np.moveaxis(out, 0, axis)
+
+def resample(data, sr_orig, sr_new, resampler='hq', axis=0):
+    """
+    Resamples data from sr_orig to sr_new with the chosen resampler.
+
+    Args:
+        data (np.ndarray): The signal.
+        sr_orig (int): Its sample rate.
+        sr_new (int): The target sample rate.
+        resampler (str): "hq" (resampy) or "fast" (NumPy polyphase).
+        axis (int): The time axis.
+
+    Returns:
+        np.ndarray: The resampled signal.
+    """
+    if resampler not in RESAMPLERS:
+        raise ValueError(f"Unknown resampler: {resampler}")
+
+    if resampler == 'fast':
+        g = gcd(int(sr_orig), int(sr_new))
+        up, down = int(sr_new) // g, int(sr_orig) // g
+        if max(up, down) <= MAX_POLYPHASE_FACTOR:
+            return resample_poly(data, up, down, axis=axis)
+        logger.info(f"No fast path for {sr_orig} -> {sr_new} Hz, using resampy")
+
+    import resampy
+    return resampy.resample(data, sr_orig, sr_new, axis=axis)
@@ -0,0 +1,196 @@
+"""
+A script keeping a patch in sync while you work: when the patch is saved
+its [dac~] objects are enumerated again (as in channels), and audio files
+added or modified in the watched directories are (re)loaded into it (as in
+load_audio). Only the transforms and the files concerned by a change run.
+
+Changes are detected with inotify when inotify_simple is installed, by
+polling modification times otherwise.
+"""
+
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+from pdulate.store import CachedPatchStore
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.NOTSET)
+
+class PollingWatcher:
+    """Detects changes by comparing modification times and sizes."""
+    def __init__(self, paths, interval=0.5):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        stack = list(self.paths)
+        while stack:
+            path = stack.pop()
+            try:
+                if os.path.isdir(path):
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            else:
+                                stat = entry.stat()
+                                snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                else:
+                    stat = os.stat(path)
+                    snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass  # Removed while scanning
+        return snapshot
+
+    def wait(self, timeout=None):
+        """Returns the paths changed since the last call, waiting at most timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.scan()
+            changed = {path for path, signature in snapshot.items() if self.snapshot.get(path) != signature}
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic())))
+
+class InotifyWatcher:
+    """Detects changes with inotify, watching directories recursively."""
+    def __init__(self, paths):
+        from inotify_simple import INotify, flags
+        self.flags = flags
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        self.inotify = INotify()
+        self.directories = {}  # watch descriptor -> directory
+        self.roots = []  # watched directory trees
+        self.files = set()  # watched files, through their directory
+        for path in map(os.path.abspath, paths):
+            if os.path.isdir(path):
+                self.roots.append(path)
+                self.add_tree(path)
+            else:
+                self.files.add(path)
+                self.add_directory(os.path.dirname(path))
+
+    def add_directory(self, directory):
+        if directory not in self.directories.values():
+            self.directories[self.inotify.add_watch(directory, self.mask)] = directory
+
+    def add_tree(self, directory):
+        for root, _, _ in os.walk(directory):
+            self.add_directory(root)
+
+    def watched(self, path):
+        return path in self.files or any(path.startswith(os.path.join(root, '')) for root in self.roots)
+
+    def wait(self, timeout=None):
+        changed = set()
+        for event in self.inotify.read(timeout=None if timeout is None else int(timeout * 1000)):
+            path = os.path.join(self.directories.get(event.wd, ''), event.name)
+            if event.mask & self.flags.ISDIR:
+                if event.mask & (self.flags.CREATE | self.flags.MOVED_TO):
+                    self.add_tree(path)
+            elif event.mask & (self.flags.CLOSE_WRITE | self.flags.MOVED_TO) and self.watched(path):
+                changed.add(path)
+        return changed
+
+def make_watcher(paths, interval=0.5):
+    try:
+        return InotifyWatcher(paths)
+    except (ImportError, OSError):
+        logger.info("inotify unavailable, polling for changes")
+        return PollingWatcher(paths, interval)
+
+def batches(watcher, debounce=0.3):
+    """Yields sets of changed paths, once no change came for debounce seconds."""
+    while True:
+        changed = watcher.wait()
+        while True:
+            more = watcher.wait(debounce)
+            if not more:
+                break
+            changed |= more
+        if changed:
+            yield changed
+
+def watch(patch_path, audio_dirs=(), channels=False, target_samplerate=None, sidecar_format=None,
+          resampler='hq', deduplicate=False, debounce=0.3, interval=0.5, store=None):
+    """
+    Watches the patch and the audio directories until interrupted, running
+    channels when the patch changes, and load_audio on the audio files
+    changed, with the prefix load_audio would give them. Files written for
+    the patch, its sidecar directory included, aren't loaded even when in an
+    audio directory. Parsed patches are kept between changes by a
+    CachedPatchStore, until changed here.
+    """
+    from scripts.load_audio import Sidecar, add_audio, directory_prefix, is_audio_file
+    from scripts.channels import channel_dacs
+
+    store = store or CachedPatchStore()
+    patch_path = os.path.abspath(patch_path)
+    audio_dirs = [os.path.abspath(directory) for directory in audio_dirs]
+    channeled_path = str(Path(patch_path).with_name(f"{Path(patch_path).stem}.channeled.pd"))
+    # Sidecar files loaded again would write sidecars of their own, under a longer prefix each time
+    outputs = os.path.join(Sidecar(patch_path).directory, '')
+    watcher = make_watcher([patch_path] + audio_dirs, interval)
+    print(f"Watching {patch_path}" + (f" and {len(audio_dirs)} audio directories" if audio_dirs else ""))
+
+    written = None  # Signature of the patch as last written here
+    for changed in batches(watcher, debounce):
+        if patch_path in changed and store.exists(patch_path) and CachedPatchStore.signature(patch_path) == written:
+            changed.discard(patch_path)  # Not an edit, we wrote it
+
+        # Audio files by the prefix of the directory they are in
+        audio = {}
+        for path in sorted(changed):
+            if path.startswith(outputs) or path in (patch_path, channeled_path):
+                continue
+            directory = next((d for d in audio_dirs if path.startswith(os.path.join(d, ''))), None)
+            if directory and is_audio_file(path):
+                audio.setdefault(directory_prefix(directory, os.path.dirname(path)), []).append(path)
+
+        try:
+            if audio:
+                from pdulate.items import Patch
+                patch = store.read(patch_path) if store.exists(patch_path) else Patch(0, 0, 800, 600)
+                for prefix, paths in audio.items():
+                    add_audio(patch, patch_path, paths, target_samplerate, sidecar_format, resampler,
+                              deduplicate, prefix)
+                store.write(patch_path, patch)
+                # Arrays built by add_audio are read back from the file rather than reused
+                store.discard(patch_path)
+                written = CachedPatchStore.signature(patch_path)
+                print(f"Loaded {sum(map(len, audio.values()))} audio files into {patch_path}")
+
+            if channels and (audio or patch_path in changed):
+                patch = store.read(patch_path)
+                if channel_dacs(patch):
+                    store.write(channeled_path, patch)
+                    store.discard(channeled_path)
+                    print(f"Enumerated [dac~] objects into {channeled_path}")
+                store.discard(patch_path)
+        except Exception as e:
+            # Keep watching, the next save may well fix it
+            store.discard(patch_path)
+            print(f"Error processing changes: {e}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a Pure Data patch in sync with its edits and audio directories.")
+    parser.add_argument('--channels', action='store_true', help='Enumerate [dac~] objects whenever the patch changes')
+    parser.add_argument('--audio', action='append', default=[], metavar='DIR', help='Directory whose new or modified audio files are loaded, may be repeated')
+    parser.add_argument('--sample-rate', type=int, help='Target sample rate for audio files')
+    parser.add_argument('--resampler', choices=['hq', 'fast'], default='hq', help='Resampler for audio files')
+    parser.add_argument('--dedup', action='store_true', help='Store identical audio only once')
+    parser.add_argument('--sidecar', choices=['wav'], help='Keep audio in files next to the patch')
+    parser.add_argument('--debounce', type=float, default=0.3, help='Seconds without changes before processing them')
+    parser.add_argument('patch', type=str, help='Path to the patch file')
+
+    args = parser.parse_args()
+    watch(args.patch, args.audio, args.channels, args.sample_rate, args.sidecar, args.resampler, args.dedup, args.debounce)
+
+if __name__ == "__main__":
+    main()
@@ -24,11 +24,17 @@ setup(
             'resampy>=0.4.3',
             'soundfile>=0.12.1'
         ],
+        'watch': [
+            'inotify_simple>=1.3'
+        ],
+        'arrays': [
+            'numpy>=1.17'
+        ],
     },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "License :: OSI Approved :: The Unlicense (Unlicense)",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
@@ -1,2 +1,7 @@
-from . import items
-from . import parser
+import importlib
+
+# Submodules are imported on first access, keeping "import pdulate" (and pdu) cheap
+def __getattr__(name):
+    if name in ('items', 'parser'):
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,116 @@
+"""
+asyncio versions of loading, saving and adding audio to patches, for
+services that can't have their event loop blocked for seconds by large
+files.
+
+File I/O runs in the loop default executor. Parsing, serializing and audio
+decoding run in configurable executors, at most limit of them at a time.
+Building a very large patch still triggers full garbage collections, which
+pause every thread, the loop included, for a fraction of a second.
+
+Example:
+    patches = await asyncio.gather(*(load_patch(path) for path in paths))
+"""
+
+import asyncio
+import os
+import weakref
+from concurrent.futures import Executor
+from functools import partial
+from typing import Callable, List, Optional
+
+from pdulate.items import Patch
+from pdulate.parser import Parser
+from pdulate.serialize import serialize_patch
+
+def read_file(path: str) -> str:
+    with open(path, 'r') as f:
+        return f.read()
+
+def write_file(path: str, content: str):
+    with open(path, 'w') as f:
+        f.write(content)
+
+def parse(content: str) -> Patch:
+    return Parser().parse_patch(content)
+
+def add_audio_file(*args, **kwargs):
+    # Runs in the worker, which may be another process
+    from pdulate.scripts import import_scripts
+    import_scripts()
+    from scripts.load_audio import load_audio
+    return load_audio(*args, **kwargs)
+
+class PatchIO:
+    """
+    Args:
+        executor (Executor): Where patches are parsed and serialized, the
+            loop default executor if None. Patches are linked object graphs
+            that don't pickle well, this has to be a thread pool.
+        audio_executor (Executor): Where load_audio runs, executor if None.
+            Only paths cross it, a ProcessPoolExecutor gets around the GIL
+            for decoding and resampling.
+        limit (int): Maximum number of parsing, serializing and loading
+            jobs running at once, the number of CPUs by default.
+    """
+    def __init__(self, executor: Optional[Executor] = None, audio_executor: Optional[Executor] = None,
+                 limit: Optional[int] = None):
+        self.executor = executor
+        self.audio_executor = audio_executor or executor
+        self.limit = limit or os.cpu_count() or 1
+        # Before Python 3.10 a semaphore belongs to the loop it was created in
+        self.semaphores = weakref.WeakKeyDictionary()
+
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.limit)
+        return self.semaphores[loop]
+
+    async def run(self, executor: Optional[Executor], function: Callable, *args, **kwargs):
+        """Runs function in executor, waiting for a free slot first."""
+        async with self.semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, partial(function, *args, **kwargs))
+
+    async def load_patch(self, path: str) -> Patch:
+        content = await asyncio.get_running_loop().run_in_executor(None, read_file, path)
+        return await self.run(self.executor, parse, content)
+
+    async def save_patch(self, path: str, patch: Patch):
+        content = await self.run(self.executor, serialize_patch, patch)
+        await asyncio.get_running_loop().run_in_executor(None, write_file, path, content)
+
+    async def load_audio(self, audio_paths: List[str], patch_path: str, target_samplerate: Optional[int] = None,
+                         sidecar_format: Optional[str] = None, resampler: str = 'hq', deduplicate: bool = False,
+                         store=None, max_samples: Optional[int] = None, jobs: Optional[int] = None,
+                         preview: Optional[int] = None):
+        """
+        scripts.load_audio.load_audio, reading and writing the patch at
+        patch_path. store crosses to the audio executor with the rest, in a
+        process it is a copy, whose cache goes away with the call.
+
+        Returns:
+            Dedup: The savings if deduplicating, None otherwise.
+        """
+        return await self.run(self.audio_executor, add_audio_file, list(audio_paths), patch_path, target_samplerate,
+                              sidecar_format, resampler, deduplicate, store=store, max_samples=max_samples,
+                              jobs=jobs, preview=preview)
+
+default = PatchIO()
+
+async def load_patch(path: str) -> Patch:
+    """Reads and parses the patch at path."""
+    return await default.load_patch(path)
+
+async def save_patch(path: str, patch: Patch):
+    """Serializes a patch and writes it to path."""
+    await default.save_patch(path, patch)
+
+async def load_audio(audio_paths: List[str], patch_path: str, target_samplerate: Optional[int] = None,
+                     sidecar_format: Optional[str] = None, resampler: str = 'hq', deduplicate: bool = False,
+                     store=None, max_samples: Optional[int] = None, jobs: Optional[int] = None,
+                     preview: Optional[int] = None):
+    """Loads audio files into the patch at patch_path, as scripts.load_audio.load_audio does, see PatchIO.load_audio."""
+    return await default.load_audio(audio_paths, patch_path, target_samplerate, sidecar_format, resampler,
+                                    deduplicate, store, max_samples, jobs, preview)
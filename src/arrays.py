@@ -0,0 +1,416 @@
+"""
+Batch operations on the data of the arrays of a patch: normalize, trim
+silence, fade in and out, downmix channels and decimate, computed on NumPy
+buffers.
+
+Every operation applies to the arrays of a patch and its subpatches whose
+name matches a Unix shell style pattern, optionally computing several of
+them in parallel threads (NumPy releases the GIL while it computes). Arrays
+are changed in place, with their size and the coords of the graph holding
+them kept in sync, so the patch can be serialized right away. Arrays whose
+content isn't saved in the patch are filled at runtime and left alone.
+
+Arrays may have a preview, a small array named <name>-preview holding their
+min/max envelope (see make_preview), shown while the array itself is kept
+in a closed subpatch. Previews are left out of the arrays matched, and
+regenerated when the operations change their array, only in the blocks of
+samples changed while its size holds (see envelope_update).
+
+Example:
+    normalize(patch, 'drums_*', peak=0.9)
+    trim(patch, 'drums_*', threshold=1e-3)
+    fade(patch, 'drums_*', fade_out=441)
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from pdulate.common import PREVIEW_SUFFIX, ArrayPatch, DataPatch, preview_name
+from pdulate.items import Array, Comment, Patch, Subpatch
+
+logger = logging.getLogger(__name__)
+
+FADE_SHAPES = ('linear', 'cosine')
+
+# load_audio comments the channel arrays it makes of one file with "channels <name> <name>_1 <name>_2..."
+CHANNELS_MARKER = 'channels'
+
+# Values of a preview by default, half minimums and half maximums
+PREVIEW_POINTS = 1000
+
+Previews = Dict[str, Tuple[Patch, Array]]
+
+def walk_arrays(patch: Patch) -> Iterator[Tuple[Patch, Array]]:
+    """The arrays of a patch and its subpatches, with the (sub)patch holding them."""
+    for item in patch.get_items():
+        if isinstance(item, Array):
+            yield patch, item
+        elif isinstance(item, Subpatch):
+            yield from walk_arrays(item)
+
+def find_previews(patch: Patch) -> Previews:
+    """The preview arrays of a patch and its subpatches, with the (sub)patch holding them, by array name."""
+    arrays = list(walk_arrays(patch))
+    names = {array.name for _, array in arrays}
+    return {array.name[:-len(PREVIEW_SUFFIX)]: (owner, array) for owner, array in arrays
+            if array.name.endswith(PREVIEW_SUFFIX) and array.name[:-len(PREVIEW_SUFFIX)] in names}
+
+def find_arrays(patch: Patch, pattern: str = '*') -> List[Tuple[Patch, Array]]:
+    """
+    The arrays with saved content of a patch and its subpatches whose name
+    matches pattern, with the (sub)patch holding them. Previews aren't
+    included.
+    """
+    previews = {id(array) for _, array in find_previews(patch).values()}
+    found = []
+    for owner, array in walk_arrays(patch):
+        if id(array) in previews or not fnmatch(array.name, pattern):
+            continue
+        if array.saves_content():
+            found.append((owner, array))
+        else:
+            logger.debug("Skipping %s, its content isn't saved in the patch", array.name)
+    return found
+
+def channel_markers(patch: Patch) -> Iterator[Tuple[Patch, Comment, List[str]]]:
+    """The channels comments of a patch and its subpatches, with the (sub)patch holding them and their words."""
+    for item in patch.get_items():
+        if isinstance(item, Comment):
+            words = item.text.split()
+            if len(words) > 3 and words[0] == CHANNELS_MARKER:
+                yield patch, item, words[1:]
+        elif isinstance(item, Subpatch):
+            yield from channel_markers(item)
+
+def channel_groups(patch: Patch) -> Dict[str, List[str]]:
+    """The names of the channel arrays load_audio made from one file, by the name of the file."""
+    return {words[0]: words[1:] for _, _, words in channel_markers(patch)}
+
+def get_buffer(array: Array) -> np.ndarray:
+    return np.asarray(array.data, dtype=np.float64)
+
+def as_coord(value: float):
+    # As the parser reads them, whole numbers without a decimal point
+    return int(value) if value.is_integer() else value
+
+def set_buffer(owner: Patch, array: Array, buffer: np.ndarray):
+    """Stores buffer as the data of array, resizing it and updating the bounds of its graph."""
+    size = len(buffer)
+    if size != array.size:
+        array.size = size
+        array.args = [str(size)] + array.args[1:]
+    array.data = buffer.tolist()
+
+    # A graph holding only this array shows all of it, from its lowest to its highest value
+    if isinstance(owner, Subpatch) and owner.get_items() == [array] and owner.get_coords():
+        low, high = (float(buffer.min()), float(buffer.max())) if size else (-1.0, 1.0)
+        if low == high:
+            low, high = low - 1, high + 1
+        coords = list(owner.get_coords())
+        coords[0:4] = [0, as_coord(high), size, as_coord(low)]
+        owner.set_coords(*coords)
+
+def normalized(data: np.ndarray, peak: float = 1.0) -> np.ndarray:
+    """data scaled so its highest absolute value is peak. Silence stays silent."""
+    highest = np.abs(data).max() if len(data) else 0.0
+    if highest == 0:
+        return data
+    return data * (peak / highest)
+
+def trimmed(data: np.ndarray, threshold: float = 0.0) -> np.ndarray:
+    """data without its leading and trailing samples of absolute value up to threshold, at least one sample."""
+    loud = np.flatnonzero(np.abs(data) > threshold)
+    if not len(loud):
+        return data[:1]
+    return data[loud[0]:loud[-1] + 1]
+
+def fade_curve(length: int, shape: str = 'linear') -> np.ndarray:
+    """Rising gains over length samples, starting at 0 and ending just below 1."""
+    ramp = np.arange(length, dtype=np.float64) / max(length, 1)
+    if shape == 'linear':
+        return ramp
+    if shape == 'cosine':
+        return 0.5 - 0.5 * np.cos(np.pi * ramp)
+    raise ValueError(f"Unsupported fade shape: {shape}")
+
+def faded(data: np.ndarray, fade_in: int = 0, fade_out: int = 0, shape: str = 'linear') -> np.ndarray:
+    """data faded in over its first fade_in samples and out over its last fade_out samples."""
+    data = data.copy()
+    fade_in, fade_out = min(fade_in, len(data)), min(fade_out, len(data))
+    if fade_in:
+        data[:fade_in] *= fade_curve(fade_in, shape)
+    if fade_out:
+        data[len(data) - fade_out:] *= fade_curve(fade_out, shape)[::-1]
+    return data
+
+def blocks_of(data: np.ndarray, factor: int) -> np.ndarray:
+    """data as rows of factor samples, the last one padded with its own last sample."""
+    blocks = -(-len(data) // factor)
+    return np.concatenate([data, np.full(blocks * factor - len(data), data[-1])]).reshape(blocks, factor)
+
+def envelope(data: np.ndarray, points: int = PREVIEW_POINTS) -> np.ndarray:
+    """
+    data in at most points values, the minimum then the maximum of each of
+    its blocks, which Pd draws as the outline of the waveform. data of up
+    to points samples is returned as it is.
+    """
+    if points < 2:
+        raise ValueError(f"Invalid preview size: {points}")
+    if len(data) <= points:
+        return data
+    blocks = blocks_of(data, -(-len(data) // (points // 2)))
+    outline = np.empty(2 * len(blocks))
+    outline[0::2] = blocks.min(axis=1)
+    outline[1::2] = blocks.max(axis=1)
+    return outline
+
+def envelope_update(outline: np.ndarray, data: np.ndarray, points: int,
+                    changed: List[Tuple[int, int]]) -> np.ndarray:
+    """
+    outline, the envelope of data of points values (see envelope) before
+    the (start, stop) ranges of samples changed, with only the values of
+    the blocks holding them computed again.
+    """
+    if len(data) <= points:
+        return data
+    size = -(-len(data) // (points // 2))
+    count = -(-len(data) // size)
+    if len(outline) != 2 * count:
+        return envelope(data, points)
+    if not changed:
+        return outline
+    # Blocks covered by a range, counting the ranges started minus those ended
+    starts, stops = np.asarray(changed).T
+    cover = np.zeros(count + 1, dtype=np.int64)
+    np.add.at(cover, starts // size, 1)
+    np.add.at(cover, -(-stops // size), -1)
+    indices = np.flatnonzero(np.cumsum(cover[:-1]) > 0)
+    outline = outline.copy()
+    whole = indices[indices < len(data) // size]
+    blocks = data[:len(data) // size * size].reshape(-1, size)[whole]
+    outline[2 * whole] = blocks.min(axis=1)
+    outline[2 * whole + 1] = blocks.max(axis=1)
+    if len(indices) > len(whole):  # The last block, shorter
+        last = data[(count - 1) * size:]
+        outline[-2:] = last.min(), last.max()
+    return outline
+
+def changed_ranges(old: np.ndarray, new: np.ndarray) -> Optional[List[Tuple[int, int]]]:
+    """The (start, stop) ranges of the samples differing in old and new, None if their sizes differ."""
+    if len(old) != len(new):
+        return None
+    different = np.flatnonzero(old != new)
+    if not len(different):
+        return []
+    breaks = np.flatnonzero(np.diff(different) > 1)
+    starts = np.concatenate([different[:1], different[breaks + 1]])
+    stops = np.concatenate([different[breaks] + 1, different[-1:] + 1])
+    return list(zip(starts.tolist(), stops.tolist()))
+
+def decimated(data: np.ndarray, factor: int, mode: str = 'mean') -> np.ndarray:
+    """
+    data shortened factor times, for control rate lookup tables. Each block
+    of factor samples becomes its mean, its value of highest magnitude
+    ("peak", keeping transients) or its first sample ("pick").
+    """
+    if factor < 1:
+        raise ValueError(f"Invalid decimation factor: {factor}")
+    if factor == 1 or not len(data):
+        return data
+    if mode == 'pick':
+        return data[::factor]
+    padded = blocks_of(data, factor)
+    if mode == 'mean':
+        return padded.mean(axis=1)
+    if mode == 'peak':
+        return padded[np.arange(len(padded)), np.abs(padded).argmax(axis=1)]
+    raise ValueError(f"Unsupported decimation mode: {mode}")
+
+def mixed(channels: List[np.ndarray]) -> np.ndarray:
+    """The mean of channels, the shorter ones padded with silence."""
+    length = max(len(channel) for channel in channels)
+    mix = np.zeros(length)
+    for channel in channels:
+        mix[:len(channel)] += channel
+    return mix / len(channels)
+
+def make_preview(name: str, data: np.ndarray, points: int = PREVIEW_POINTS, x: int = 0, y: int = 0) -> ArrayPatch:
+    """The graph of the preview of the array name holding data, see envelope."""
+    outline = envelope(np.asarray(data, dtype=np.float64), points)
+    return ArrayPatch(x, y, preview_name(name), len(outline), outline.tolist())
+
+def hide(array_patch: ArrayPatch, points: int = PREVIEW_POINTS) -> DataPatch:
+    """
+    array_patch in a closed DataPatch, not drawn, with a preview of points
+    values to show in its place.
+    """
+    array = array_patch.get_array()
+    preview = make_preview(array.name, get_buffer(array), points, array_patch.external_x, array_patch.external_y)
+    return DataPatch(array_patch.external_x, array_patch.external_y, array_patch, preview)
+
+def preview_points(preview: Array, source_size: int) -> int:
+    """The points to regenerate a preview with: as many as it has, unless it was a copy of a short array."""
+    return preview.size if preview.size < source_size else PREVIEW_POINTS
+
+def refresh_preview(previews: Previews, array: Array, buffer: np.ndarray, source_size: int,
+                    changed: Optional[List[Tuple[int, int]]] = None) -> bool:
+    """
+    Stores the envelope of buffer, the new data of array, in its preview if
+    it has one and the envelope differs. With changed, the ranges of samples
+    changed (see changed_ranges), only the blocks holding them are computed
+    again.
+
+    Returns:
+        bool: Whether the preview was changed.
+    """
+    if array.name not in previews:
+        return False
+    owner, preview = previews[array.name]
+    points = preview_points(preview, source_size)
+    if changed is None or len(buffer) != source_size:
+        outline = envelope(buffer, points)
+    else:
+        outline = envelope_update(get_buffer(preview), buffer, points, changed)
+    if len(outline) == preview.size and np.array_equal(outline, get_buffer(preview)):
+        return False
+    set_buffer(owner, preview, outline)
+    return True
+
+def update_previews(patch: Patch, pattern: str = '*') -> List[Array]:
+    """
+    Regenerates the previews of the arrays matching pattern, changed
+    elsewhere, e.g. edited in Pd. Previews already matching their array are
+    left alone.
+
+    Returns:
+        List[Array]: The previews changed.
+    """
+    previews = find_previews(patch)
+    changed = []
+    for _, array in find_arrays(patch, pattern):
+        if refresh_preview(previews, array, get_buffer(array), array.size):
+            changed.append(previews[array.name][1])
+    logger.info("Updated %d previews of arrays matching %s", len(changed), pattern)
+    return changed
+
+def remove_array(owner: Patch, array: Array):
+    """Removes an array, with its graph and the subpatch hiding it (see DataPatch) if they hold nothing else."""
+    if not (isinstance(owner, Subpatch) and owner.get_items() == [array] and owner.patch is not None):
+        owner.remove_item(array)
+        return
+    holder = owner.patch
+    if (isinstance(holder, Subpatch) and holder.get_items() == [owner] and holder.get_name() == array.name
+            and holder.patch is not None):
+        holder.patch.remove_item(holder)
+    else:
+        holder.remove_item(owner)
+
+def apply(patch: Patch, pattern: str, function: Callable[..., np.ndarray], *args,
+          jobs: Optional[int] = None, **kwargs) -> List[Array]:
+    """
+    Replaces the data of the arrays matching pattern by function(data, *args,
+    **kwargs), computed in up to jobs threads, one by one if jobs is 1.
+
+    Returns:
+        List[Array]: The arrays changed.
+    """
+    arrays = find_arrays(patch, pattern)
+    previews = find_previews(patch)
+
+    def compute(array):
+        old = get_buffer(array)
+        new = function(old, *args, **kwargs)
+        # What changed, for the preview to be updated in those blocks only
+        return new, changed_ranges(old, new) if array.name in previews else None
+
+    if jobs == 1 or len(arrays) < 2:
+        results = [compute(array) for _, array in arrays]
+    else:
+        with ThreadPoolExecutor(jobs) as executor:
+            results = list(executor.map(compute, [array for _, array in arrays]))
+    # Stored from this thread, transactions aren't thread safe
+    for (owner, array), (buffer, changed) in zip(arrays, results):
+        size = array.size
+        set_buffer(owner, array, buffer)
+        refresh_preview(previews, array, buffer, size, changed)
+    logger.info("Applied %s to %d arrays matching %s", function.__name__, len(arrays), pattern)
+    return [array for _, array in arrays]
+
+def normalize(patch: Patch, pattern: str = '*', peak: float = 1.0, jobs: Optional[int] = None) -> List[Array]:
+    """Scales each array matching pattern to the given peak, see normalized."""
+    return apply(patch, pattern, normalized, peak, jobs=jobs)
+
+def trim(patch: Patch, pattern: str = '*', threshold: float = 0.0, jobs: Optional[int] = None) -> List[Array]:
+    """Removes the leading and trailing silence of each array matching pattern, see trimmed."""
+    return apply(patch, pattern, trimmed, threshold, jobs=jobs)
+
+def fade(patch: Patch, pattern: str = '*', fade_in: int = 0, fade_out: int = 0, shape: str = 'linear',
+         jobs: Optional[int] = None) -> List[Array]:
+    """Fades each array matching pattern in and out, lengths in samples, see faded."""
+    if shape not in FADE_SHAPES:
+        raise ValueError(f"Unsupported fade shape: {shape}")
+    return apply(patch, pattern, faded, fade_in, fade_out, shape, jobs=jobs)
+
+def decimate(patch: Patch, pattern: str = '*', factor: int = 64, mode: str = 'mean',
+             jobs: Optional[int] = None) -> List[Array]:
+    """Shortens each array matching pattern factor times, see decimated."""
+    return apply(patch, pattern, decimated, factor, mode, jobs=jobs)
+
+def downmix(patch: Patch, pattern: str = '*', groups: Optional[Dict[str, List[str]]] = None) -> List[Array]:
+    """
+    Mixes groups of channel arrays into a single array each. groups gives
+    the names of the arrays to mix by the name of their mix, e.g.
+    {'snare': ['snare_l', 'snare_r']}, by default the channels load_audio
+    made of one file (see channel_groups). Arrays aren't grouped by their
+    names alone, snare_1 and snare_2 may well be two snares. Groups are
+    mixed when all their arrays match pattern. The first channel array
+    holds the mix, the others are removed with their graph. [soundfiler]
+    and playback objects referring to the channels by name aren't updated,
+    load the file again for those.
+
+    Returns:
+        List[Array]: The mixed arrays.
+    """
+    if groups is None:
+        groups = channel_groups(patch)
+    arrays = {array.name: (owner, array) for owner, array in find_arrays(patch, pattern)}
+    found: Dict[str, List[Tuple[Patch, Array]]] = {}
+    for name, channel_names in groups.items():
+        channels = [arrays[channel_name] for channel_name in channel_names if channel_name in arrays]
+        if len(channels) < len(channel_names):
+            logger.debug("Not mixing %s, some of its arrays are missing or don't match %s", name, pattern)
+        elif len(channels) > 1:
+            found[name] = channels
+
+    previews = find_previews(patch)
+    mixed_arrays = []
+    for name, channels in found.items():
+        owner, first = channels[0]
+        size = first.size
+        mix = mixed([get_buffer(array) for _, array in channels])
+        set_buffer(owner, first, mix)
+        refresh_preview(previews, first, mix, size)
+        if first.name in previews:
+            previews[first.name][1].name = preview_name(name)
+        if isinstance(owner, Subpatch) and owner.get_items() == [first]:
+            owner.name = name
+            holder = owner.patch
+            if isinstance(holder, Subpatch) and holder.get_items() == [owner] and holder.get_name() == first.name:
+                holder.name = name
+        first.name = name
+        for owner, array in channels[1:]:
+            if array.name in previews:
+                remove_array(*previews[array.name])
+            remove_array(owner, array)
+        mixed_arrays.append(first)
+
+    # The mixes are single arrays now
+    for owner, comment, words in list(channel_markers(patch)):
+        if words[0] in found:
+            owner.remove_item(comment)
+    logger.info("Downmixed %d arrays matching %s", len(mixed_arrays), pattern)
+    return mixed_arrays
@@ -1,6 +1,12 @@
 from pdulate.items import Object, Subpatch, Array
 from typing import List, Optional
 
+# Name of the array showing the envelope of <name>: <name>-preview
+PREVIEW_SUFFIX = '-preview'
+
+def preview_name(name: str) -> str:
+    return name + PREVIEW_SUFFIX
+
 class Hsl(Object):
     def __init__(self, x: int, y: int, width: int = 128, height: int = 15,
                  min_value: float = 0, max_value: float = 127, default_value: float = 0,
@@ -83,9 +89,11 @@ class ArrayPatch(Subpatch):
 
     @classmethod
     def from_patch(cls, patch: Subpatch) -> Optional['ArrayPatch']:
-        if isinstance(patch, Subpatch) and len(patch.items) == 1 and isinstance(patch.get_items()[0], Array):
+        # get_items, an ArrayPatch built in memory holds its array outside of items
+        if isinstance(patch, Subpatch) and len(patch.get_items()) == 1 and isinstance(patch.get_items()[0], Array):
             array = patch.get_items()[0]
-            return cls(patch.x, patch.y, array.name, array.size, array.data,
+            data = array.data if array.saves_content() else None
+            return cls(patch.x, patch.y, array.name, array.size, data,
                 array.type, array.save_flag, array.draw_style)
         return None
 
@@ -101,9 +109,44 @@ class ArrayPatch(Subpatch):
     def len(self):
         return self._array.data.len()
 
+    def get_array(self):
+        return self._array
+
     def get_data(self):
         return self._array.data
 
+class DataPatch(Subpatch):
+    """
+    A subpatch named after an array, holding its ArrayPatch. Pd only draws
+    the array when the subpatch is opened, which keeps arrays of millions of
+    points from stalling the GUI. preview, if any, is the ArrayPatch shown in
+    its place, see pdulate.arrays.make_preview. It isn't an item of the
+    subpatch, but of the same (sub)patch.
+    """
+    def __init__(self, x: int, y: int, array_patch: ArrayPatch, preview: Optional[ArrayPatch] = None):
+        super().__init__(x, y, 220, 160, array_patch.get_name())
+        array_patch.set_external_x(10)
+        array_patch.set_external_y(10)
+        super().add_item(array_patch)
+        self.preview = preview
+
+    @classmethod
+    def from_patch(cls, patch: Subpatch) -> Optional['DataPatch']:
+        if isinstance(patch, Subpatch) and not patch.is_graph_on_parent() and len(patch.get_items()) == 1:
+            array_patch = ArrayPatch.from_patch(patch.get_items()[0])
+            if array_patch and array_patch.get_name() == patch.get_name():
+                return cls(patch.x, patch.y, array_patch)
+        return None
+
+    def add_item(self, item):
+        raise NotImplementedError("Cannot add items to DataPatch")
+
+    def get_array(self):
+        return self.get_items()[0].get_array()
+
+    def get_data(self):
+        return self.get_array().data
+
 class Bng(Object):
     def __init__(self, x: int, y: int, size: int = 15,
                  hold: int = 250, interrupt: int = 50,
@@ -0,0 +1,291 @@
+"""
+Structural diff of patches.
+
+Patches are read as record trees (see tree_from_file) where every item has a
+content hash and every (sub)patch a Merkle hash of its header, items and
+connections. Identical subtrees, however large their arrays, are skipped
+by comparing two hashes. Elsewhere items are matched by content rather than
+index, so inserting an item doesn't renumber the rest of the patch into
+changes, and array data is compared by value whatever its #A line breaks.
+
+Example:
+    for change in diff_files('old.pd', 'new.pd'):
+        print(change)
+"""
+
+import hashlib
+from collections import Counter, defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pdulate.parser import PdParseError, ITEM_RECORDS
+from pdulate.stats import iter_records
+
+def digest():
+    return hashlib.blake2b(digest_size=16)
+
+class Node:
+    """
+    An item of a record tree.
+
+    Attributes:
+        kind (str): The record type, e.g. "#X obj", "#N canvas" for subpatches.
+        text (str): The record, with whitespace normalized.
+        label (str): Object, subpatch or array name, used to pair modified items.
+        position (Tuple[str, str]): Coordinates, on the parent for subpatches.
+        hash (bytes): Content hash, a Merkle hash for subpatches.
+        children (List[Node]): Items, of subpatches only.
+        connections (List[Tuple[int, int, int, int]]): By item index, of subpatches only.
+        extra (List[str]): Other records, e.g. coords and restore, of subpatches only.
+    """
+    __slots__ = ('kind', 'text', 'label', 'position', 'hash', 'children', 'connections', 'extra', 'data')
+
+    def __init__(self, kind: str, text: str, label: str = '', position: Tuple[str, str] = ('', '')):
+        self.kind = kind
+        self.text = text
+        self.label = label
+        self.position = position
+        self.hash = b''
+        self.data = None
+        if kind == '#N canvas':
+            self.children: List['Node'] = []
+            self.connections: List[Tuple[int, int, int, int]] = []
+            self.extra: List[str] = []
+
+    def is_subpatch(self) -> bool:
+        return self.kind == '#N canvas'
+
+    def describe(self) -> str:
+        """Short description, e.g. [osc~ 440], [pd level1] or [array table-0]."""
+        if self.is_subpatch():
+            return f"[pd {self.label}]"
+        if self.kind == '#X array':
+            return f"[array {self.label}]"
+        rest = self.text.split(' ', 4)[4] if self.text.count(' ') >= 4 else ''
+        if self.kind == '#X obj':
+            return f"[{rest}]"
+        if self.kind == '#X msg':
+            return f"[{rest}("
+        if self.kind == '#X text':
+            return f'"{rest}"'
+        return f"[{self.kind[3:]}]"
+
+    def seal(self):
+        """Computes the hash of a subpatch whose records have all been read."""
+        h = digest()
+        h.update(self.text.encode())
+        for child in self.children:
+            if child.data is not None:
+                # An array, its data is complete
+                child.hash = child.data[0].digest()
+                child.data = None
+            h.update(child.hash)
+        h.update(repr(self.connections).encode())
+        for text in self.extra:
+            h.update(text.encode())
+        self.hash = h.digest()
+
+def add_array_data(array: Node, record: str):
+    """Hashes the values of an #A record, independently of line breaks and of 1.0 vs 1."""
+    h, expected = array.data
+    words = record.split(None, 2)
+    start = int(float(words[1]))
+    payload = words[2] if len(words) > 2 else ''
+    if '\n' in payload or '  ' in payload or '\t' in payload:
+        payload = ' '.join(payload.split())
+    if start != expected:
+        h.update(f"@{start} ".encode())
+    h.update((payload + ' ').replace('.0 ', ' ').encode())
+    array.data = (h, start + payload.count(' ') + 1 if payload else start)
+
+def build_tree(records: Iterable[str]) -> Node:
+    """Builds the record tree of a patch, hashing it on the way."""
+    stack: List[Node] = []
+    array: Optional[Node] = None
+    for record in records:
+        if record.startswith('#A'):
+            if array is None:
+                raise PdParseError(f"Unexpected array data: {record[:100]}")
+            add_array_data(array, record)
+            continue
+        text = ' '.join(record.split())
+        end = text.find(' ', 3)
+        kind = text if end < 0 else text[:end]
+
+        if kind == '#N canvas':
+            words = text.split(' ')
+            node = Node(kind, text, words[6] if len(words) == 8 else '')
+            if stack:
+                stack[-1].children.append(node)
+            stack.append(node)
+        elif not stack:
+            raise PdParseError(f"Expected global canvas, got: {record[:100]}")
+        elif kind == '#X restore':
+            if len(stack) < 2:
+                raise PdParseError("Tried to end a subpatch, but no subpatch was active")
+            node = stack.pop()
+            words = text.split(' ')
+            node.position = tuple(words[2:4])
+            node.extra.append(text)
+            node.seal()
+        elif kind == '#X connect':
+            words = text.split(' ')
+            if len(words) != 6:
+                raise PdParseError(f"Invalid connection format: {record[:100]}")
+            stack[-1].connections.append(tuple(map(int, words[2:])))
+        elif kind == '#X array':
+            words = text.split(' ')
+            array = Node(kind, text, words[2])
+            h = digest()
+            h.update(text.encode())
+            array.data = (h, 0)
+            stack[-1].children.append(array)
+        elif kind in ITEM_RECORDS:
+            words = text.split(' ', 5)
+            label = words[4] if kind == '#X obj' and len(words) > 4 else ''
+            node = Node(kind, text, label, tuple(words[2:4]))
+            node.hash = hashlib.blake2b(text.encode(), digest_size=16).digest()
+            stack[-1].children.append(node)
+        else:
+            # Coords and anything else describing the current canvas
+            stack[-1].extra.append(text)
+
+    if len(stack) != 1:
+        raise PdParseError("Mismatched subpatch structure")
+    stack[0].seal()
+    return stack[0]
+
+def tree_from_file(path: str) -> Node:
+    with open(path, 'r') as f:
+        return build_tree(iter_records(f))
+
+def tree_from_patch(patch) -> Node:
+    from pdulate.parser import split_records
+    from pdulate.serialize import serialize_patch
+    return build_tree(record.strip() for record in split_records(serialize_patch(patch)) if record.strip())
+
+class Change:
+    """
+    A difference between two patches.
+
+    Attributes:
+        change (str): "added", "removed" or "modified".
+        what (str): "item", "connection", "data" (of an array) or "canvas" (a
+            subpatch's own properties).
+        path (Tuple[str, ...]): Names of the subpatches holding it.
+        old (str): The item or connection before, None if added.
+        new (str): The item or connection after, None if removed.
+    """
+    SIGNS = {'added': '+', 'removed': '-', 'modified': '~'}
+
+    def __init__(self, change: str, what: str, path: Tuple[str, ...], old: Optional[str] = None,
+                 new: Optional[str] = None):
+        self.change = change
+        self.what = what
+        self.path = path
+        self.old = old
+        self.new = new
+
+    def as_dict(self) -> dict:
+        return {'change': self.change, 'what': self.what, 'path': list(self.path),
+                'old': self.old, 'new': self.new}
+
+    def __repr__(self):
+        text = self.old if self.new is None else self.new if self.old is None else f"{self.old} -> {self.new}"
+        return f"{self.SIGNS[self.change]} {'/'.join(self.path) or '.'}: {text}"
+
+def pair_leftovers(old: List[Node], old_left: List[int], new: List[Node], new_left: List[int]) -> Dict[int, int]:
+    """
+    Pairs unmatched items as modified versions of each other: same type and
+    position first, then same type and name, in order.
+    """
+    pairs = {}
+    for key in (lambda n: (n.kind, n.label, n.position), lambda n: (n.kind, n.position), lambda n: (n.kind, n.label)):
+        candidates = defaultdict(deque)
+        for i in old_left:
+            candidates[key(old[i])].append(i)
+        remaining = []
+        for j in new_left:
+            queue = candidates.get(key(new[j]))
+            if queue:
+                pairs[j] = queue.popleft()
+            else:
+                remaining.append(j)
+        paired = set(pairs.values())
+        old_left = [i for i in old_left if i not in paired]
+        new_left = remaining
+    return pairs
+
+def diff_nodes(old: Node, new: Node, path: Tuple[str, ...] = (), changes: Optional[List[Change]] = None) -> List[Change]:
+    """Appends to changes the differences between two (sub)patch nodes."""
+    changes = [] if changes is None else changes
+    if old.hash == new.hash:
+        return changes
+
+    if old.text != new.text or old.extra != new.extra:
+        changes.append(Change('modified', 'canvas', path, ' '.join([old.text] + old.extra),
+                              ' '.join([new.text] + new.extra)))
+
+    # Identical items are matched first, in order
+    by_hash = defaultdict(deque)
+    for i, child in enumerate(old.children):
+        by_hash[child.hash].append(i)
+    mapping: Dict[int, int] = {}
+    for j, child in enumerate(new.children):
+        queue = by_hash.get(child.hash)
+        if queue:
+            mapping[j] = queue.popleft()
+    matched = set(mapping.values())
+    old_left = [i for i in range(len(old.children)) if i not in matched]
+    new_left = [j for j in range(len(new.children)) if j not in mapping]
+
+    pairs = pair_leftovers(old.children, old_left, new.children, new_left)
+    for j, i in sorted(pairs.items()):
+        mapping[j] = i
+        old_child, new_child = old.children[i], new.children[j]
+        if old_child.is_subpatch() and new_child.is_subpatch():
+            diff_nodes(old_child, new_child, path + (new_child.label,), changes)
+        elif old_child.text == new_child.text:
+            # Only array data can differ with the same record
+            changes.append(Change('modified', 'data', path, old_child.describe(), new_child.describe()))
+        else:
+            changes.append(Change('modified', 'item', path, old_child.text, new_child.text))
+    paired = set(pairs.values())
+    for i in old_left:
+        if i not in paired:
+            changes.append(Change('removed', 'item', path, old.children[i].describe() if old.children[i].is_subpatch()
+                                  else old.children[i].text))
+    for j in new_left:
+        if j not in pairs:
+            changes.append(Change('added', 'item', path, new=new.children[j].describe() if new.children[j].is_subpatch()
+                                  else new.children[j].text))
+
+    # Connections are compared through the item matching, not indices
+    def describe(source, outlet, target, inlet, nodes):
+        return f"{nodes[source].describe()} {outlet} -> {nodes[target].describe()} {inlet}"
+
+    def valid(connection, nodes):
+        return connection[0] < len(nodes) and connection[2] < len(nodes)
+
+    old_connections = Counter(c for c in old.connections if valid(c, old.children))
+    new_connections = Counter()
+    originals = {}
+    for c in new.connections:
+        if not valid(c, new.children):
+            continue
+        source, outlet, target, inlet = c
+        key = (mapping.get(source, ('new', source)), outlet, mapping.get(target, ('new', target)), inlet)
+        new_connections[key] += 1
+        originals[key] = c
+    for c in (old_connections - new_connections).elements():
+        changes.append(Change('removed', 'connection', path, describe(*c, old.children)))
+    for key in (new_connections - old_connections).elements():
+        changes.append(Change('added', 'connection', path, new=describe(*originals[key], new.children)))
+    return changes
+
+def diff_files(old_path: str, new_path: str) -> List[Change]:
+    """The differences between two patch files."""
+    return diff_nodes(tree_from_file(old_path), tree_from_file(new_path))
+
+def diff_patches(old, new) -> List[Change]:
+    """The differences between two patches in memory."""
+    return diff_nodes(tree_from_patch(old), tree_from_patch(new))
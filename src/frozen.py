@@ -0,0 +1,281 @@
+"""
+Immutable views of patches, for read-only work shared between threads, or
+sent to processes, without locks or deep copies.
+
+Patch.freeze() copies a patch and its subpatches into frozen items, whose
+attributes can't be set, with tuples for lists. Connections are given by
+item index, as in the Pd file: frozen patches have their connections as
+(source, outlet, target, inlet) tuples, and connectable frozen items their
+own as inlets (inlet, source, outlet) and outlets (outlet, target, inlet),
+so a frozen patch holds no reference cycles and pickles as a plain tree.
+
+Frozen items are equal when their content is, whatever their index and
+connections. Frozen patches are equal when their content hash (see
+FrozenPatch.digest, computed once) is, connections included, so they can be
+used as dictionary keys, e.g. to cache analyses.
+
+A Freezer freezes the same patch again and again, sharing with the copies
+it made before the content of the subpatches and the samples of the arrays
+it wasn't told had changed. Transaction snapshots are made this way.
+
+Example:
+    frozen = patch.freeze()
+    with ThreadPoolExecutor() as executor:
+        found = list(executor.map(partial(search_objects, frozen), patterns))
+"""
+
+import hashlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from pdulate.items import (Array, Comment, ConnectableItem, Item, Message, Number, Object, Patch, Subpatch,
+                           Symbol)
+
+class Frozen:
+    """Base of frozen views, built from the values of FIELDS, in order."""
+    FIELDS: Tuple[str, ...] = ()
+    # Fields left out of comparisons
+    POSITIONAL: Tuple[str, ...] = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.FIELDS):
+            raise TypeError(f"{type(self).__name__} takes {len(self.FIELDS)} values, got {len(values)}")
+        for name, value in zip(self.FIELDS, values):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_hash', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is frozen")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is frozen")
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.FIELDS)
+
+    def key(self) -> tuple:
+        """The values compared and hashed."""
+        return (type(self).__name__,) + tuple(getattr(self, name) for name in self.FIELDS
+                                              if name not in self.POSITIONAL)
+
+    def digest(self) -> bytes:
+        """Content hash, stable across processes."""
+        return hashlib.blake2b(repr(self.key()).encode(), digest_size=16).digest()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.key() == other.key()
+
+    def __hash__(self):
+        # Computed once, racing threads would only store the same value
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(self.key()))
+        return self._hash
+
+    def __reduce__(self):
+        return type(self), self.values()
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS
+                           if name not in ('items', 'samples', 'inlets', 'outlets', 'connections'))
+        return f"{type(self).__name__}({values})"
+
+class FrozenItem(Frozen):
+    FIELDS = ('index', 'x', 'y')
+    POSITIONAL = ('index',)
+
+class FrozenConnectable(FrozenItem):
+    FIELDS = FrozenItem.FIELDS + ('inlets', 'outlets')
+    POSITIONAL = FrozenItem.POSITIONAL + ('inlets', 'outlets')
+
+class FrozenObject(FrozenConnectable):
+    FIELDS = FrozenConnectable.FIELDS + ('name', 'args')
+
+class FrozenArray(FrozenObject):
+    """
+    Attributes:
+        samples (bytes): The values, as native 64-bit floats, which pickle
+            with a copy. The data property reads them as a sequence.
+    """
+    FIELDS = FrozenObject.FIELDS + ('size', 'type', 'save_flag', 'draw_style', 'samples')
+
+    @property
+    def data(self) -> memoryview:
+        """The values, as a read-only sequence of floats."""
+        return memoryview(self.samples).cast('d')
+
+    def saves_content(self) -> bool:
+        return bool(int(self.save_flag) & 1)
+
+    def digest(self) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr(self.key()[:-1]).encode())
+        h.update(self.samples)
+        return h.digest()
+
+class FrozenMessage(FrozenConnectable):
+    FIELDS = FrozenConnectable.FIELDS + ('message', 'width')
+
+class FrozenNumber(FrozenConnectable):
+    FIELDS = FrozenConnectable.FIELDS + ('value', 'size', 'lower', 'upper', 'receive', 'send', 'label', 'width')
+
+class FrozenSymbol(FrozenConnectable):
+    FIELDS = FrozenNumber.FIELDS
+
+class FrozenComment(FrozenItem):
+    FIELDS = FrozenItem.FIELDS + ('text', 'width')
+
+class FrozenPatch(Frozen):
+    """
+    Attributes:
+        items (Tuple[FrozenItem, ...]): The items, each knowing its index.
+        connections (Tuple[Tuple[int, int, int, int], ...]): (source, outlet,
+            target, inlet) by item index, in the order Pd saves them.
+    """
+    FIELDS = ('x', 'y', 'width', 'height', 'font_size', 'items', 'connections')
+
+    def get_items(self) -> Tuple[FrozenItem, ...]:
+        return self.items
+
+    def get_location(self) -> Tuple[int, int]:
+        return self.x, self.y
+
+    def get_size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def get_font_size(self) -> Optional[int]:
+        return self.font_size
+
+    def header(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.FIELDS
+                     if name not in ('items', 'connections', 'inlets', 'outlets', 'index'))
+
+    def digest(self) -> bytes:
+        """Merkle hash of the header, items and connections, computed once."""
+        digest = self.__dict__.get('_digest')
+        if digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(repr((type(self).__name__,) + self.header()).encode())
+            for item in self.items:
+                h.update(item.digest())
+            h.update(repr(self.connections).encode())
+            digest = h.digest()
+            object.__setattr__(self, '_digest', digest)
+        return digest
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.digest() == other.digest()
+
+    def __hash__(self):
+        return int.from_bytes(self.digest()[:8], 'little')
+
+class FrozenSubpatch(FrozenConnectable, FrozenPatch):
+    FIELDS = (FrozenConnectable.FIELDS + ('width', 'height', 'font_size', 'items', 'connections', 'name',
+                                          'graph_on_parent', 'coords', 'external_x', 'external_y'))
+
+    def get_name(self) -> str:
+        return self.name
+
+    def get_coords(self) -> Optional[Tuple]:
+        return self.coords
+
+    def is_graph_on_parent(self) -> bool:
+        return self.graph_on_parent
+
+    def __eq__(self, other):
+        return FrozenPatch.__eq__(self, other)
+
+    def __hash__(self):
+        return FrozenPatch.__hash__(self)
+
+Connections = Dict[int, List[Tuple[int, int, int]]]
+
+Content = Tuple[Tuple[FrozenItem, ...], Tuple[Tuple[int, int, int, int], ...]]
+
+class Freezer:
+    """
+    Freezes a patch repeatedly, reusing the frozen content of the
+    (sub)patches, and the samples of the arrays, not marked as changed
+    since. The live objects are kept with what was frozen of them, so their
+    ids aren't reused meanwhile.
+    """
+    def __init__(self):
+        self.contents: Dict[int, Tuple[Patch, Content]] = {}
+        self.samples: Dict[int, Tuple[Array, bytes]] = {}
+
+    def changed(self, *objects):
+        """Marks objects, and the (sub)patches holding them, to be frozen again."""
+        for obj in objects:
+            while obj is not None:
+                self.contents.pop(id(obj), None)
+                self.samples.pop(id(obj), None)
+                obj = getattr(obj, 'patch', None)
+
+    def content(self, patch: Patch) -> Content:
+        cached = self.contents.get(id(patch))
+        if cached is None:
+            cached = self.contents[id(patch)] = (patch, freeze_content(patch, self))
+        return cached[1]
+
+    def array_samples(self, item: Array) -> bytes:
+        cached = self.samples.get(id(item))
+        if cached is None:
+            cached = self.samples[id(item)] = (item, samples(item))
+        return cached[1]
+
+    def freeze(self, patch: Patch) -> FrozenPatch:
+        return freeze(patch, self)
+
+def samples(item: Array) -> bytes:
+    return array('d', item.data or ()).tobytes()
+
+def freeze_content(patch: Patch, freezer: Optional[Freezer] = None) -> Content:
+    """The frozen items and connections of a (sub)patch."""
+    items = patch.get_items()
+    indices = {id(item): i for i, item in enumerate(items)}
+    connections = []
+    inlets: Connections = {}
+    outlets: Connections = {}
+    for source, item in enumerate(items):
+        if isinstance(item, ConnectableItem):
+            for outlet, conns in item.get_outlets():
+                for inlet, target in conns:
+                    target = indices[id(target)]
+                    connections.append((source, outlet, target, inlet))
+                    outlets.setdefault(source, []).append((outlet, target, inlet))
+                    inlets.setdefault(target, []).append((inlet, source, outlet))
+    frozen = tuple(freeze_item(item, i, tuple(inlets.get(i, ())), tuple(outlets.get(i, ())), freezer)
+                   for i, item in enumerate(items))
+    return frozen, tuple(connections)
+
+def freeze_item(item: Item, index: int, inlets: tuple = (), outlets: tuple = (),
+                freezer: Optional[Freezer] = None) -> FrozenItem:
+    if isinstance(item, Subpatch):
+        items, connections = freezer.content(item) if freezer else freeze_content(item)
+        coords = tuple(item.coords) if item.coords else None
+        return FrozenSubpatch(index, item.x, item.y, inlets, outlets, item.width, item.height, item.font_size,
+                              items, connections, item.get_name(), item.graph_on_parent, coords,
+                              item.external_x, item.external_y)
+    if isinstance(item, Array):
+        return FrozenArray(index, item.x, item.y, inlets, outlets, item.name, tuple(item.args), item.size,
+                           item.type, item.save_flag, item.draw_style,
+                           freezer.array_samples(item) if freezer else samples(item))
+    if isinstance(item, Object):
+        return FrozenObject(index, item.x, item.y, inlets, outlets, item.name, tuple(item.args))
+    if isinstance(item, Message):
+        return FrozenMessage(index, item.x, item.y, inlets, outlets, item.message, item.width)
+    if isinstance(item, (Number, Symbol)):
+        kind = FrozenNumber if isinstance(item, Number) else FrozenSymbol
+        return kind(index, item.x, item.y, inlets, outlets, item.value, item.size, item.lower, item.upper,
+                    item.receive, item.send, item.label, item.width)
+    if isinstance(item, Comment):
+        return FrozenComment(index, item.x, item.y, item.text, item.width)
+    if isinstance(item, ConnectableItem):
+        return FrozenConnectable(index, item.x, item.y, inlets, outlets)
+    return FrozenItem(index, item.x, item.y)
+
+def freeze(patch: Patch, freezer: Optional[Freezer] = None) -> FrozenPatch:
+    """A frozen copy of patch, a FrozenSubpatch for a subpatch, see Patch.freeze."""
+    if isinstance(patch, Subpatch):
+        return freeze_item(patch, 0, freezer=freezer)
+    items, connections = freezer.content(patch) if freezer else freeze_content(patch)
+    return FrozenPatch(patch.x, patch.y, patch.width, patch.height, patch.font_size, items, connections)
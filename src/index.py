@@ -0,0 +1,260 @@
+"""
+A persistent index of the objects, messages and comments of many patches,
+kept in SQLite and updated incrementally, answering the same Unix shell
+style patterns as tools.search_objects without parsing anything.
+
+Every indexed item is stored with its file, subpatch path and index in its
+(sub)patch. Its words also go to an inverted index, so patterns starting
+with a wildcard are narrowed down to the items holding their longest
+literal part before being matched.
+
+Example:
+    with Index('index.sqlite') as index:
+        index.update(['project'])
+        for match in index.grep('tabplay~ *'):
+            print(match)
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+from fnmatch import fnmatch
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pdulate.parser import unescape_special_chars
+from pdulate.stats import iter_records
+
+KINDS = ('obj', 'msg', 'text')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, mtime_ns INTEGER, size INTEGER, hash TEXT);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY, file_id INTEGER NOT NULL, subpatch TEXT, position INTEGER, kind TEXT, text TEXT);
+CREATE INDEX IF NOT EXISTS items_text ON items (text);
+CREATE INDEX IF NOT EXISTS items_file ON items (file_id);
+CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL, item_id INTEGER NOT NULL, PRIMARY KEY (term_id, item_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_item ON postings (item_id);
+"""
+
+# An indexed item: subpatch path, index in its (sub)patch, kind and text
+Entry = Tuple[str, int, str, str]
+
+def default_path() -> str:
+    """$PDULATE_INDEX, or index.sqlite in the user cache directory."""
+    if os.environ.get('PDULATE_INDEX'):
+        return os.environ['PDULATE_INDEX']
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'pdulate', 'index.sqlite')
+
+def extract(records: Iterable[str]) -> List[Entry]:
+    """The searchable items of a patch, from its records, with the texts search_objects and search_comments match."""
+    entries = []
+    # (subpatch name, number of items so far) for each open canvas
+    stack: List[Tuple[str, int]] = []
+    for record in records:
+        if record.startswith('#A'):
+            continue
+        words = record.split()
+        kind = ' '.join(words[:2])
+        if kind == '#N canvas':
+            if stack:
+                name, count = stack[-1]
+                stack[-1] = (name, count + 1)
+            stack.append((words[6] if len(words) == 8 else '', 0))
+            continue
+        if kind == '#X restore':
+            stack.pop()
+            continue
+        if kind not in ('#X obj', '#X msg', '#X text', '#X array', '#X floatatom', '#X symbolatom') or not stack:
+            continue
+
+        name, position = stack[-1]
+        stack[-1] = (name, position + 1)
+        path = '/'.join(name for name, _ in stack[1:])
+        if kind == '#X obj' and len(words) > 4:
+            text = ' '.join([words[4]] + [unescape_special_chars(arg) for arg in words[5:]]).strip()
+            entries.append((path, position, 'obj', text))
+        elif kind == '#X array' and len(words) > 5:
+            # Arrays are objects whose arguments are their declaration
+            text = ' '.join([words[2], str(int(float(words[3])))] + words[4:])
+            entries.append((path, position, 'obj', text))
+        elif kind in ('#X msg', '#X text') and len(words) > 4:
+            text = re.sub(r', f -?\d+$', '', ' '.join(words[4:]))
+            entries.append((path, position, kind[3:], unescape_special_chars(text)))
+    return entries
+
+def extract_file(path: str) -> Tuple[str, List[Entry]]:
+    """The content hash and extract() of a patch file."""
+    with open(path, 'rb') as f:
+        digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    with open(path, 'r') as f:
+        return digest, extract(iter_records(f))
+
+def literal_runs(pattern: str) -> List[str]:
+    """The parts of a pattern matched literally, split at wildcards, bracket expressions and spaces."""
+    runs, current, i = [], '', 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char in '*? ':
+            runs.append(current)
+            current = ''
+        elif char == '[':
+            # Skip the expression, a ] right after [ or [! belongs to it
+            end = i + 1
+            if end < len(pattern) and pattern[end] == '!':
+                end += 1
+            if end < len(pattern) and pattern[end] == ']':
+                end += 1
+            end = pattern.find(']', end)
+            if end < 0:
+                current += char
+            else:
+                runs.append(current)
+                current = ''
+                i = end
+        else:
+            current += char
+        i += 1
+    runs.append(current)
+    return [run for run in runs if run]
+
+def literal_prefix(pattern: str) -> str:
+    match = re.match(r'[^*?\[]*', pattern)
+    return match.group(0)
+
+class Index:
+    """An index stored at path (see default_path), created if needed."""
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_path()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self) -> 'Index':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def remove_file(self, file_id: int):
+        self.db.execute("DELETE FROM postings WHERE item_id IN (SELECT id FROM items WHERE file_id = ?)", (file_id,))
+        self.db.execute("DELETE FROM items WHERE file_id = ?", (file_id,))
+
+    def add_entries(self, file_id: int, entries: List[Entry], terms: dict):
+        """Inserts the entries of a file, terms maps the known terms to their id."""
+        next_item = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM items").fetchone()[0]
+        next_term = max(terms.values(), default=0) + 1
+        items, postings, new_terms = [], [], []
+        for item_id, (subpatch, position, kind, text) in enumerate(entries, next_item):
+            items.append((item_id, file_id, subpatch, position, kind, text))
+            for term in set(text.split()):
+                if term not in terms:
+                    terms[term] = next_term
+                    new_terms.append((next_term, term))
+                    next_term += 1
+                postings.append((terms[term], item_id))
+        self.db.executemany("INSERT INTO items (id, file_id, subpatch, position, kind, text) VALUES (?, ?, ?, ?, ?, ?)", items)
+        self.db.executemany("INSERT INTO terms (id, term) VALUES (?, ?)", new_terms)
+        self.db.executemany("INSERT INTO postings (term_id, item_id) VALUES (?, ?)", postings)
+
+    def update(self, roots: Sequence[str], jobs: Optional[int] = None) -> Tuple[int, int, int]:
+        """
+        Indexes the .pd files found in roots (files or directories). Files
+        whose modification time, size or content changed are reindexed,
+        files no longer found under roots are dropped.
+
+        Returns:
+            Tuple[int, int, int]: Numbers of files reindexed, unchanged and dropped.
+        """
+        found = {}
+        for root in roots:
+            root = os.path.abspath(root)
+            if os.path.isfile(root):
+                found[root] = os.stat(root)
+                continue
+            for directory, _, files in os.walk(root):
+                for name in files:
+                    if name.endswith('.pd'):
+                        path = os.path.join(directory, name)
+                        found[path] = os.stat(path)
+
+        known = {path: (file_id, mtime_ns, size, digest) for file_id, path, mtime_ns, size, digest
+                 in self.db.execute("SELECT id, path, mtime_ns, size, hash FROM files")}
+        changed = [path for path, stat in found.items()
+                   if path not in known or known[path][1:3] != (stat.st_mtime_ns, stat.st_size)]
+
+        if len(changed) > 1 and jobs != 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(jobs) as executor:
+                extracted = list(executor.map(extract_file, changed, chunksize=16))
+        else:
+            extracted = [extract_file(path) for path in changed]
+
+        reindexed = 0
+        terms = dict((term, term_id) for term_id, term in self.db.execute("SELECT id, term FROM terms"))
+        with self.db:
+            for path, (digest, entries) in zip(changed, extracted):
+                stat = found[path]
+                if path in known:
+                    file_id, _, _, old_digest = known[path]
+                    self.db.execute("UPDATE files SET mtime_ns = ?, size = ?, hash = ? WHERE id = ?",
+                                    (stat.st_mtime_ns, stat.st_size, digest, file_id))
+                    if digest == old_digest:
+                        # Touched, not modified
+                        continue
+                    self.remove_file(file_id)
+                else:
+                    file_id = self.db.execute("INSERT INTO files (path, mtime_ns, size, hash) VALUES (?, ?, ?, ?)",
+                                              (path, stat.st_mtime_ns, stat.st_size, digest)).lastrowid
+                self.add_entries(file_id, entries, terms)
+                reindexed += 1
+
+            dropped = 0
+            roots = [os.path.abspath(root) for root in roots]
+            for path, (file_id, *_) in known.items():
+                under = any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+                if under and path not in found:
+                    self.remove_file(file_id)
+                    self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                    dropped += 1
+        return reindexed, len(found) - reindexed, dropped
+
+    def grep(self, pattern: str, kinds: Sequence[str] = ('obj',)) -> Iterator[Tuple[str, str, int, str, str]]:
+        """
+        Yields the indexed items of the given kinds ("obj", "msg", "text")
+        matching pattern, as (file path, subpatch path, index, kind, text).
+        """
+        columns = "files.path, items.subpatch, items.position, items.kind, items.text"
+        kind_filter = f"items.kind IN ({', '.join('?' * len(kinds))})"
+        prefix = literal_prefix(pattern)
+        runs = literal_runs(pattern)
+        if prefix:
+            # Matching texts start with the prefix, found through the text index
+            rows = self.db.execute(
+                f"SELECT {columns} FROM items JOIN files ON files.id = items.file_id "
+                f"WHERE items.text >= ? AND items.text < ? AND {kind_filter} ORDER BY files.path, items.id",
+                (prefix, prefix + '\U0010ffff', *kinds))
+        elif runs:
+            # The longest literal part of the pattern lies within one word of matching texts
+            run = max(runs, key=len)
+            rows = self.db.execute(
+                f"SELECT {columns} FROM items JOIN files ON files.id = items.file_id "
+                f"WHERE items.id IN (SELECT item_id FROM postings WHERE term_id IN "
+                f"(SELECT id FROM terms WHERE instr(term, ?) > 0)) AND {kind_filter} ORDER BY files.path, items.id",
+                (run, *kinds))
+        else:
+            rows = self.db.execute(
+                f"SELECT {columns} FROM items JOIN files ON files.id = items.file_id "
+                f"WHERE {kind_filter} ORDER BY files.path, items.id", kinds)
+        for row in rows:
+            if fnmatch(row[4], pattern):
+                yield row
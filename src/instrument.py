@@ -0,0 +1,92 @@
+"""
+Counters and timers for the parser, the serializer and patch stores.
+
+Instrumentation is off unless $PDULATE_PROFILE is set or profiling() is
+active. Hot paths only check the enabled flag, so it costs next to nothing
+when off.
+
+Example:
+    with profiling() as stats:
+        Parser().parse_patch(content)
+    print(stats.report())
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+enabled = bool(os.environ.get('PDULATE_PROFILE'))
+
+class Stats:
+    """Counters, and timers as (calls, total seconds), by name."""
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.timers: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def as_dict(self) -> dict:
+        return {
+            'counters': dict(self.counters),
+            'timers': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in self.timers.items()},
+        }
+
+    def report(self) -> str:
+        lines = []
+        if self.timers:
+            lines.append(f"{'timer':<24} {'calls':>9} {'total':>11} {'per call':>11}")
+            for name, (calls, seconds) in sorted(self.timers.items(), key=lambda t: -t[1][1]):
+                lines.append(f"{name:<24} {calls:>9} {seconds * 1e3:>9.2f}ms {seconds / calls * 1e6:>9.2f}us")
+        if self.counters:
+            lines.append(f"{'counter':<24} {'count':>9}")
+            for name, n in sorted(self.counters.items()):
+                lines.append(f"{name:<24} {n:>9}")
+        return "\n".join(lines)
+
+stats = Stats()
+
+def count(name: str, n: int = 1):
+    if enabled:
+        stats.count(name, n)
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    """Times the block under name, if instrumentation is enabled."""
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(name, time.perf_counter() - start)
+
+@contextmanager
+def profiling(clear: bool = True) -> Iterator[Stats]:
+    """Enables instrumentation within the block, yielding the collected Stats."""
+    global enabled
+    previous = enabled
+    if clear:
+        stats.clear()
+    enabled = True
+    try:
+        yield stats
+    finally:
+        enabled = previous
@@ -3,10 +3,19 @@ import logging
 from collections.abc import ItemsView
 
 
-# Configure logging
+# Configure logging. Hot paths log with %-style arguments, so items are only
+# formatted when debug logging is on
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.NOTSET)
 
+# Open transactions (see pdulate.transaction), which the methods changing a
+# patch record their changes into. Empty otherwise, checking it is all they pay.
+transactions: List = []
+
+def record(entry: Tuple, *objects):
+    from pdulate.transaction import record
+    record(entry, *objects)
+
 class Item:
     def __init__(self, x: int, y: int):
         self.x = x
@@ -48,13 +57,18 @@ class ConnectableItem(Item):
 
         self.outlets[outlet].append((inlet, target))
         target.inlets[inlet].append((outlet, self))
-        logger.debug(
-            f"Connected {self} outlet {outlet} to {target} inlet {inlet}"
-        )
+        if transactions:
+            record(('connect', self, outlet, target, inlet), self, target)
+        logger.debug("Connected %s outlet %s to %s inlet %s", self, outlet, target, inlet)
 
     def disconnect(self, outlet: int, target: 'ConnectableItem', inlet: int):
         conns = self.outlets.get(outlet)
         if conns and (inlet, target) in conns:
+            if transactions:
+                inlet_conns = target.inlets[inlet]
+                record(('disconnect', self, outlet, target, inlet, conns.index((inlet, target)),
+                        inlet_conns.index((outlet, self)), list(self.outlets) if len(conns) == 1 else None,
+                        list(target.inlets) if len(inlet_conns) == 1 else None), self, target)
             self.outlets[outlet].remove((inlet, target))
             if not self.outlets[outlet]:  # Clean up if the list is empty
                 del self.outlets[outlet]
@@ -62,9 +76,7 @@ class ConnectableItem(Item):
                 target.inlets[inlet].remove((outlet, self))
                 if not target.inlets[inlet]:  # Clean up if the list is empty
                     del target.inlets[inlet]
-            logger.debug(
-                f"Disconnected {self} outlet {outlet} from {target} inlet {inlet}"
-            )
+            logger.debug("Disconnected %s outlet %s from %s inlet %s", self, outlet, target, inlet)
         return
 
         logger.warning(
@@ -157,6 +169,13 @@ class Array(Object):
             raise ValueError(f"Data size ({len(data)}) does not match array size ({self.size})")
         self.data = data
 
+    def saves_content(self) -> bool:
+        """
+        Whether the array content is stored in the patch (bit 0 of the save flag).
+        Arrays without it are filled at runtime, e.g. by [soundfiler].
+        """
+        return bool(int(self.save_flag) & 1)
+
     def __repr__(self):
         data_repr = f"[{self.data[0]:.3f}, ..., {self.data[-1]:.3f}]" if self.data else "[]"
         return f"Array({self.x}, {self.y}, {self.name}, size={self.size}, type={self.type}, save_flag={self.save_flag}, draw_style={self.draw_style}, data={data_repr})"
@@ -180,9 +199,11 @@ class Patch:
         self.font_size = font_size
 
     def add_item(self, item: Item):
+        if transactions:
+            record(('add', self, item, len(self.items), item.patch), self)
         self.items.append(item)
         item.patch = self
-        logger.debug(f"Added {item} to patch")
+        logger.debug("Added %s to patch", item)
 
     def add_items(self, items: List[Item]):
         for item in items:
@@ -200,8 +221,30 @@ class Patch:
                 for inlet, target in connections.copy():
                     item.disconnect(outlet, target, inlet)
 
+        if transactions:
+            record(('remove', self, item, self.items.index(item)), self)
         self.items.remove(item)
-        logger.debug(f"Removed {item} from patch")
+        logger.debug("Removed %s from patch", item)
+
+    def transaction(self):
+        """
+        Starts journaling the changes made to this patch and its subpatches,
+        to commit or roll back (see pdulate.transaction). Best used as a
+        context manager, which commits, or rolls back on exceptions. While
+        it is open, other threads mustn't change this patch, and attribute
+        assignments on items of every patch, in every thread, go through
+        the journaling hook.
+        """
+        from pdulate.transaction import Transaction
+        return Transaction(self)
+
+    def freeze(self):
+        """
+        An immutable, hashable copy of this patch and its subpatches (see
+        pdulate.frozen), to share between threads or send to processes.
+        """
+        from pdulate.frozen import freeze
+        return freeze(self)
 
     def get_location(self) -> Tuple[int, int]:
         return self.x, self.y
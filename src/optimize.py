@@ -0,0 +1,248 @@
+"""
+Optimization passes making patches lighter for Pd to run:
+
+- dead objects, from which no connection leads to anything with an effect
+  (an outlet, a send, [dac~], a subpatch...), are removed,
+- identical sibling objects fed by the same sources are merged into one
+  (message boxes aren't, clicking one only sends from that one),
+- pass-through objects, e.g. a [t b] fed by bangs or a [*~ 1], are
+  bypassed and removed.
+
+Only objects known to be free of side effects are removed or merged.
+Anything else, abstractions and GUI objects included, is assumed to matter,
+as are messages sending to receivers (with a ;), and subpatch inlets and
+outlets, which would renumber the subpatch. Pd doesn't define the order in
+which an outlet connected to several inlets sends to them, and merging
+doesn't keep it either.
+
+Example:
+    report = optimize(patch)
+    print(report)  # 120 objects and 340 connections removed: 80 dead, 30 merged, 10 bypassed
+"""
+
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from pdulate.items import Array, ConnectableItem, Item, Message, Object, Patch, Subpatch
+
+logger = logging.getLogger(__name__)
+
+# Objects whose only effect is what they send through their outlets
+PURE = frozenset([
+    # Control
+    'bang', 'b', 'float', 'f', 'int', 'i', 'symbol', 'trigger', 't', 'loadbang', 'receive', 'r',
+    'select', 'sel', 'route', 'moses', 'spigot', 'change', 'swap', 'pack', 'unpack', 'list',
+    'metro', 'delay', 'del', 'pipe', 'line', 'timer', 'random', 'makenote', 'stripnote', 'clip',
+    '+', '-', '*', '/', 'div', 'mod', '%', 'max', 'min', 'pow', 'abs', 'sqrt', 'exp', 'log',
+    'wrap', 'sin', 'cos', 'tan', 'atan', 'atan2', 'mtof', 'ftom', 'dbtorms', 'rmstodb',
+    'dbtopow', 'powtodb', '==', '!=', '>', '<', '>=', '<=', '&&', '||', '&', '|', '<<', '>>',
+    'tabread', 'tabread4',
+    # Signal
+    'osc~', 'phasor~', 'cos~', 'sig~', 'line~', 'vline~', 'noise~', 'receive~', 'r~',
+    '+~', '-~', '*~', '/~', 'max~', 'min~', 'clip~', 'abs~', 'wrap~', 'sqrt~', 'rsqrt~', 'exp~',
+    'log~', 'pow~', 'mtof~', 'ftom~', 'dbtorms~', 'rmstodb~', 'dbtopow~', 'powtodb~',
+    'lop~', 'hip~', 'bp~', 'vcf~', 'samphold~', 'snapshot~', 'env~', 'tabread~', 'tabread4~',
+    'tabplay~', 'tabosc4~', 'delread~', 'delread4~', 'vd~',
+])
+
+# Pure objects two of which, fed the same, still don't send the same
+NONDETERMINISTIC = frozenset(['random', 'noise~'])
+
+# Objects with ~ whose outlets send messages rather than signals
+CONTROL_OUTPUT = frozenset(['snapshot~', 'env~', 'bang~', 'threshold~', 'sigmund~', 'fiddle~', 'bonk~'])
+
+# [<name> <argument>] without a right inlet connection sends its signal unchanged
+SIGNAL_IDENTITIES = {('*~', '1'), ('/~', '1'), ('+~', '0'), ('-~', '0')}
+
+TRIGGER_TYPES = {'b': 'bang', 'bang': 'bang', 'f': 'float', 'float': 'float', 's': 'symbol', 'symbol': 'symbol',
+                 'a': 'anything', 'anything': 'anything'}
+
+class OptimizeReport:
+    """
+    What optimize removed.
+
+    Attributes:
+        dead (int): Objects removed for having no effect.
+        merged (int): Objects merged into an identical sibling.
+        bypassed (int): Pass-through objects removed.
+        connections (int): Connections removed, in total.
+    """
+    def __init__(self):
+        self.dead = 0
+        self.merged = 0
+        self.bypassed = 0
+        self.connections = 0
+
+    @property
+    def objects(self) -> int:
+        return self.dead + self.merged + self.bypassed
+
+    def as_dict(self) -> dict:
+        return {'objects': self.objects, 'connections': self.connections, 'dead': self.dead,
+                'merged': self.merged, 'bypassed': self.bypassed}
+
+    def __repr__(self):
+        return (f"{self.objects} objects and {self.connections} connections removed: "
+                f"{self.dead} dead, {self.merged} merged, {self.bypassed} bypassed")
+
+def text(item: Item) -> Optional[str]:
+    """The content of an object or message box, None for other items."""
+    if isinstance(item, Message):
+        return item.message
+    if isinstance(item, Object) and not isinstance(item, Array):
+        return ' '.join([item.name] + list(item.args))
+    return None
+
+def is_pure(item: Item) -> bool:
+    if isinstance(item, Message):
+        return ';' not in item.message
+    return isinstance(item, Object) and not isinstance(item, Array) and item.name in PURE
+
+def is_signal_source(item: Item) -> bool:
+    return isinstance(item, Object) and item.name.endswith('~') and item.name not in CONTROL_OUTPUT
+
+def sends(item: Item, outlet: int) -> Optional[str]:
+    """What an outlet always sends, "bang", "float" or "symbol", None if it varies."""
+    if not isinstance(item, Object) or isinstance(item, Array):
+        return None
+    if item.name in ('bang', 'b', 'loadbang'):
+        return 'bang'
+    if item.name in ('float', 'f', 'int', 'i'):
+        return 'float'
+    if item.name in ('trigger', 't') and outlet < len(item.args):
+        kind = TRIGGER_TYPES.get(item.args[outlet])
+        return kind if kind != 'anything' else None
+    return None
+
+def connections(item: ConnectableItem) -> int:
+    return sum(len(conns) for _, conns in item.get_outlets())
+
+def count_connections(patch: Patch) -> int:
+    total = 0
+    for item in patch.get_items():
+        if isinstance(item, ConnectableItem):
+            total += connections(item)
+        if isinstance(item, Subpatch):
+            total += count_connections(item)
+    return total
+
+def remove_dead(patch: Patch) -> int:
+    """Removes the pure objects of patch from which no connection leads to an impure one."""
+    items = [item for item in patch.get_items() if isinstance(item, ConnectableItem)]
+    live = [item for item in items if not is_pure(item)]
+    seen: Set[int] = set(map(id, live))
+    # Walk the connections backwards from the items with an effect
+    while live:
+        item = live.pop()
+        for _, conns in item.get_inlets():
+            for _, source in conns:
+                if id(source) not in seen:
+                    seen.add(id(source))
+                    live.append(source)
+
+    dead = [item for item in items if id(item) not in seen]
+    for item in dead:
+        patch.remove_item(item)
+    return len(dead)
+
+def passes_through(item: Item) -> bool:
+    """Whether an item sends what it gets unchanged, given what is connected to it."""
+    if not isinstance(item, Object) or isinstance(item, Array):
+        return False
+    inlets = dict(item.get_inlets())
+    outlets = dict(item.get_outlets())
+    if list(inlets) != [0] or list(outlets) != [0]:
+        return False
+    sources = inlets[0]
+
+    if len(item.args) == 1 and (item.name, item.args[0]) in SIGNAL_IDENTITIES:
+        # A message into the left inlet would come out as a signal
+        return all(is_signal_source(source) for _, source in sources)
+    if item.name in ('trigger', 't') and len(item.args) == 1:
+        kind = TRIGGER_TYPES.get(item.args[0])
+    elif item.name in ('bang', 'b') and not item.args:
+        kind = 'bang'
+    else:
+        return False
+    if kind is None:
+        return False
+    return kind == 'anything' or all(sends(source, outlet) == kind for outlet, source in sources)
+
+def bypass(patch: Patch) -> int:
+    """Connects the sources of the pass-through objects of patch to their targets, and removes them."""
+    bypassed = 0
+    for item in list(patch.get_items()):
+        if not passes_through(item):
+            continue
+        sources = list(item.inlets[0])
+        targets = list(item.outlets[0])
+        # A target already fed directly by a source would then get its messages once instead of twice
+        if any((inlet, target) in source.outlets.get(outlet, [])
+               for outlet, source in sources for inlet, target in targets):
+            continue
+        for outlet, source in sources:
+            for inlet, target in targets:
+                source.connect(outlet, target, inlet)
+        patch.remove_item(item)
+        bypassed += 1
+    return bypassed
+
+def merge_identical(patch: Patch) -> int:
+    """Merges the pure objects of patch with the same content and sources into the first of them."""
+    groups: Dict[Tuple, List[ConnectableItem]] = {}
+    for item in patch.get_items():
+        # A message box also sends when clicked, to its own targets only
+        if isinstance(item, Message) or not is_pure(item) or item.name in NONDETERMINISTIC:
+            continue
+        sources = frozenset((id(source), outlet, inlet) for inlet, conns in item.get_inlets()
+                            for outlet, source in conns)
+        groups.setdefault((type(item), text(item), sources), []).append(item)
+
+    merged = 0
+    for items in groups.values():
+        kept = items[0]
+        for item in items[1:]:
+            kept_targets = {(outlet, inlet, id(target)) for outlet, conns in kept.get_outlets()
+                            for inlet, target in conns}
+            targets = [(outlet, inlet, target) for outlet, conns in item.get_outlets() for inlet, target in conns]
+            # A target fed by both gets twice the messages, or twice the signal
+            if any((outlet, inlet, id(target)) in kept_targets for outlet, inlet, target in targets):
+                continue
+            for outlet, inlet, target in targets:
+                kept.connect(outlet, target, inlet)
+            patch.remove_item(item)
+            merged += 1
+    return merged
+
+def optimize_patch(patch: Patch, dead: bool, merge: bool, bypass_items: bool, recursive: bool,
+                   report: OptimizeReport):
+    if recursive:
+        for item in patch.get_items():
+            if isinstance(item, Subpatch):
+                optimize_patch(item, dead, merge, bypass_items, True, report)
+
+    # Each pass can give the others more to do
+    changed = True
+    while changed:
+        counts = (bypass(patch) if bypass_items else 0, merge_identical(patch) if merge else 0,
+                  remove_dead(patch) if dead else 0)
+        report.bypassed += counts[0]
+        report.merged += counts[1]
+        report.dead += counts[2]
+        changed = any(counts)
+
+def optimize(patch: Patch, dead: bool = True, merge: bool = True, bypass_items: bool = True,
+             recursive: bool = True) -> OptimizeReport:
+    """
+    Runs the selected passes over a patch, and its subpatches if recursive,
+    until none of them finds anything left to do.
+
+    Returns:
+        OptimizeReport: What was removed.
+    """
+    report = OptimizeReport()
+    before = count_connections(patch)
+    optimize_patch(patch, dead, merge, bypass_items, recursive, report)
+    report.connections = before - count_connections(patch)
+    logger.info("%s", report)
+    return report
@@ -1,7 +1,9 @@
 import re
+import time
 from typing import List, Dict, Any, Optional, Callable, Union
 import logging
 
+from pdulate import instrument
 from pdulate.items import (
     Item, ConnectableItem, Message, Object, Number, Symbol,
     Array, Comment, Patch, Subpatch
@@ -14,6 +16,30 @@ class PdParseError(Exception):
     """Custom exception for Pure Data parsing errors."""
     pass
 
+# Record types adding an item to a patch, the global canvas aside
+ITEM_RECORDS = ('#N canvas', '#X obj', '#X msg', '#X floatatom', '#X symbolatom', '#X text', '#X array')
+
+def split_records(content: str) -> List[str]:
+    """
+    Splits patch content on the ; not escaped by a backslash. str.split, with
+    escaped ; joined back, is many times faster than a regex on large patches.
+    """
+    records = content.split(';')
+    if '\\;' not in content:
+        return records
+    joined = []
+    pending = ''
+    for record in records:
+        if record.endswith('\\'):
+            pending += record + ';'
+        else:
+            joined.append(pending + record)
+            pending = ''
+    if pending:
+        # Content ending with a backslash
+        joined.append(pending[:-1])
+    return joined
+
 def unescape_special_chars(text):
     return re.sub(r'\\([,$;\\])', r'\1', text)
 
@@ -31,11 +57,37 @@ class Parser:
         self.clean()
         self.expected = self.parse_global_canvas
 
-        # Use regex to split the content into items, taking escaped ; into account
-        items = re.split(r'(?<!\\);', content)
+        # Split the content into items, taking escaped ; into account
+        with instrument.timer('parse'):
+            items = split_records(content)
+            if instrument.enabled:
+                self.parse_records_profiled(items)
+            else:
+                for item in items:
+                    item = item.strip()
+                    if item:
+                        try:
+                            if self.expected:
+                                self.expected(item)
+                            else:
+                                self.parse_item(item)
+                        except Exception as e:
+                            raise PdParseError(f"Error parsing item: {item[:100]+'...'}") from e
+
+        if len(self.subpatch_stack) != 1:
+            raise PdParseError("Mismatched subpatch structure")
+
+        return self.subpatch_stack[0]
+
+    def parse_records_profiled(self, items: List[str]):
+        """The parse_patch loop, with each record counted and timed by type (e.g. "#X obj")."""
+        stats = instrument.stats
         for item in items:
             item = item.strip()
             if item:
+                words = item.split(None, 2)
+                kind = words[0] if words[0] == '#A' else ' '.join(words[:2])
+                start = time.perf_counter()
                 try:
                     if self.expected:
                         self.expected(item)
@@ -43,11 +95,11 @@ class Parser:
                         self.parse_item(item)
                 except Exception as e:
                     raise PdParseError(f"Error parsing item: {item[:100]+'...'}") from e
-
-        if len(self.subpatch_stack) != 1:
-            raise PdParseError("Mismatched subpatch structure")
-
-        return self.subpatch_stack[0]
+                stats.add_time(f"parse {kind}", time.perf_counter() - start)
+                if kind == '#X connect':
+                    stats.count('parse connections')
+                elif kind in ITEM_RECORDS:
+                    stats.count('parse items')
 
     def parse_global_canvas(self, string: str):
         if not string.startswith('#N canvas'):
@@ -171,7 +223,7 @@ class Parser:
         if not match:
             raise PdParseError(f"Invalid comment format: {string}")
         x, y, text, width = match.groups()
-        comment = Comment(int(x), int(y), text)
+        comment = Comment(int(x), int(y), unescape_special_chars(text))
         if width:
             comment.width = int(width)
         self.current_patch.add_item(comment)
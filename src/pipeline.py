@@ -0,0 +1,127 @@
+import time
+from typing import Callable, List, Optional, Tuple
+import logging
+
+from pdulate.items import Patch, Subpatch, Object, ConnectableItem
+from pdulate.tools import search_objects, replace, duplicate
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.NOTSET)
+
+# A transform modifies a patch in place and describes what it did
+Transform = Callable[[Patch], Optional[str]]
+
+class StageResult:
+    def __init__(self, name: str, seconds: float, report: Optional[str] = None):
+        self.name = name
+        self.seconds = seconds
+        self.report = report
+
+    def __repr__(self):
+        report = f": {self.report}" if self.report else ""
+        return f"{self.name} {self.seconds:.3f}s{report}"
+
+class Pipeline:
+    """
+    An ordered list of transforms applied to a patch parsed once and
+    written once, each of them timed.
+
+    Example:
+        Pipeline().add('replace', replace_stage('osc~ *', 'phasor~')).process('patch.pd')
+    """
+    def __init__(self):
+        self.stages: List[Tuple[str, Transform]] = []
+
+    def add(self, name: str, transform: Transform) -> 'Pipeline':
+        self.stages.append((name, transform))
+        return self
+
+    def run(self, patch: Patch) -> List[StageResult]:
+        """Applies the transforms to a patch in memory."""
+        results = []
+        for name, transform in self.stages:
+            start = time.perf_counter()
+            report = transform(patch)
+            results.append(StageResult(name, time.perf_counter() - start, report))
+            logger.info(results[-1])
+        return results
+
+    def process(self, path: str, output_path: Optional[str] = None, store=None,
+                dry_run: bool = False) -> List[StageResult]:
+        """
+        Reads the patch at path, applies the transforms and writes it to
+        output_path (path by default), unless dry_run, in which case the
+        patch is left untouched and only the reports are produced.
+
+        Returns:
+            List[StageResult]: Timings of reading, every transform and writing,
+            with a report of the changed item and connection counts.
+        """
+        from pdulate.store import PatchStore
+        store = store or PatchStore()
+
+        start = time.perf_counter()
+        patch = store.read(path)
+        results = [StageResult('read', time.perf_counter() - start)]
+        before = count_items(patch)
+
+        try:
+            results.extend(self.run(patch))
+        except Exception:
+            store.discard(path)
+            raise
+
+        after = count_items(patch)
+        results.append(StageResult('total', sum(result.seconds for result in results[1:]),
+                                   f"items {before[0]} -> {after[0]}, connections {before[1]} -> {after[1]}"))
+        if dry_run:
+            store.discard(path)
+            return results
+
+        start = time.perf_counter()
+        store.write(output_path or path, patch)
+        if output_path and output_path != path:
+            store.discard(path)
+        results.append(StageResult('write', time.perf_counter() - start))
+        return results
+
+def count_items(patch: Patch) -> Tuple[int, int]:
+    """Counts the items and connections of a patch and its subpatches."""
+    items = connections = 0
+    for item in patch.get_items():
+        items += 1
+        if isinstance(item, ConnectableItem):
+            connections += sum(len(conns) for _, conns in item.get_outlets())
+        if isinstance(item, Subpatch):
+            sub_items, sub_connections = count_items(item)
+            items += sub_items
+            connections += sub_connections
+    return items, connections
+
+def replace_stage(pattern: str, text: str) -> Transform:
+    """
+    Replaces the objects matching pattern with the object text (name and
+    arguments), keeping their connections.
+    """
+    name, *args = text.split()
+
+    def transform(patch: Patch) -> str:
+        matching = search_objects(patch, pattern)
+        for item in matching:
+            replace(patch, item, Object(item.x, item.y, name, list(args)))
+        return f"{len(matching)} objects replaced by [{text}]"
+    return transform
+
+def duplicate_stage(pattern: str, x: int = 0, y: int = 0) -> Transform:
+    """Duplicates the objects matching pattern, moved (x, y) away."""
+    def transform(patch: Patch) -> str:
+        duplicated = duplicate(patch, search_objects(patch, pattern), x, y)
+        return f"{len(duplicated)} objects duplicated"
+    return transform
+
+def optimize_stage() -> Transform:
+    """Removes dead objects, merges identical ones and bypasses pass-through ones, see pdulate.optimize."""
+    def transform(patch: Patch) -> str:
+        from pdulate.optimize import optimize
+        return str(optimize(patch))
+    return transform
@@ -1,39 +1,366 @@
 import sys
 import os
 import argparse
-from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-# Import scripts
-base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.insert(0, base_dir)
+# Subcommands: name -> (help, function adding its arguments, function running it
+# with the parsed arguments and the PatchStore to go through). Running
+# functions import their script, and its dependencies, themselves, so only
+# the command being run pays for them.
+COMMANDS: Dict[str, Tuple[str, Callable[[argparse.ArgumentParser], None], Callable[[argparse.Namespace, Any], None]]] = {}
 
-def main():
+def command(name: str, help: str, arguments: Callable[[argparse.ArgumentParser], None]):
+    """
+    Registers the decorated function as the runner of a pdu subcommand.
+
+    Args:
+        name (str): The subcommand.
+        help (str): Its description in pdu --help.
+        arguments (Callable): Adds the subcommand arguments to its parser.
+    """
+    def register(run: Callable[[argparse.Namespace, Any], None]):
+        COMMANDS[name] = (help, arguments, run)
+        return run
+    return register
+
+def import_scripts():
+    # The scripts package lives next to pdulate
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if base_dir not in sys.path:
+        sys.path.insert(0, base_dir)
+
+def channels_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--in-place', action='store_true', help='Overwrite the patches, atomically, instead of writing .channeled.pd copies')
+    parser.add_argument('--jobs', type=int, help='Number of patches processed in parallel')
+    parser.add_argument('file_path', nargs='+', type=str, help='Patches, or directories of patches, enumerated together')
+
+@command('channels', 'Process a file with channels', channels_arguments)
+def run_channels(args: argparse.Namespace, store):
+    import_scripts()
+    if len(args.file_path) == 1 and os.path.isfile(args.file_path[0]) and not args.in_place:
+        from scripts.channels import channels
+        from pathlib import Path
+        channels(Path(args.file_path[0]), store)
+        return
+
+    from scripts.channels import channels_project
+    ranges = channels_project(args.file_path, args.in_place, args.jobs, store)
+    for path, (first, last) in ranges.items():
+        print(f"{path}: channels {first} to {last}")
+    if not ranges:
+        print("No [dac~] objects found.")
+
+def load_audio_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--sample-rate', type=int, nargs='?', help='Target sample rate for conversions')
+    parser.add_argument('--resampler', choices=['hq', 'fast'], default='hq', help='hq (resampy) or fast (NumPy only, for common ratios like 44.1k <-> 48k)')
+    parser.add_argument('--dedup', action='store_true', help='Store identical audio only once, aliasing the duplicates')
+    parser.add_argument('--sidecar', choices=['wav'], help='Keep audio in files next to the patch, loaded by [soundfiler], instead of embedding it')
+    parser.add_argument('--files0-from', metavar='FILE', help='Also load the files of a NUL-delimited list, as find -print0 writes, - for standard input')
+    parser.add_argument('--max-samples', type=int, help='Refuse loads holding more samples than this in memory')
+    parser.add_argument('--jobs', type=int, help='Number of threads scanning directories and reading file headers')
+    parser.add_argument('--plan', action='store_true', help='Print the files, arrays and sizes of the load as JSON, and stop')
+    parser.add_argument('--preview', type=int, metavar='POINTS', help='Hide embedded arrays in closed subpatches, shown by a min/max envelope of this many points')
+    parser.add_argument('patch', type=str, help='Path to the patch file')
+    parser.add_argument('path', nargs='*', type=str, help='List of audio files an dirrectories containing them to load')
+
+@command('load-audio', 'Load audio files into a Pure Data patch.', load_audio_arguments)
+def run_load_audio(args: argparse.Namespace, store):
+    import_scripts()
+    from scripts.load_audio import gather_paths, load_audio, print_plan
+    paths = gather_paths(args.path, args.files0_from)
+    if not paths:
+        print("No audio files or directories given", file=sys.stderr)
+        sys.exit(2)
+    if args.plan:
+        print_plan(paths, args.sample_rate, args.sidecar, args.patch, args.jobs)
+        return
+    try:
+        dedup = load_audio(paths, args.patch, args.sample_rate, args.sidecar, args.resampler, args.dedup, store,
+                           args.max_samples, args.jobs, args.preview)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        # The next command parses what was written rather than the patch built in memory
+        store.discard(args.patch)
+    if dedup:
+        print(dedup)
+
+def extract_audio_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--sample-rate', type=int, default=44100, help='Sample rate of the written files')
+    parser.add_argument('--subtype', type=str, help='Sample format, e.g. PCM_16, PCM_24 or FLOAT')
+    parser.add_argument('--format', choices=['wav', 'flac'], default='wav', help='File format')
+    parser.add_argument('--jobs', type=int, help='Number of files written in parallel')
+    parser.add_argument('patch', type=str, help='Path to the patch file')
+    parser.add_argument('output_dir', type=str, help='Directory for the audio files')
+
+@command('extract-audio', 'Write the arrays of a Pure Data patch to audio files.', extract_audio_arguments)
+def run_extract_audio(args: argparse.Namespace, store):
+    import_scripts()
+    from scripts.extract_audio import extract_audio
+    extract_audio(args.patch, args.output_dir, args.sample_rate, args.subtype, args.format, args.jobs, store)
+
+def search_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--comments', action='store_true', help='Search comments instead of objects')
+    parser.add_argument('patch', type=str, help='Path to the patch file')
+    parser.add_argument('pattern', type=str, help='Unix shell style pattern, e.g. "dac~*"')
+
+@command('search', 'Print the objects or comments of a patch matching a pattern, with their index.', search_arguments)
+def run_search(args: argparse.Namespace, store):
+    from pdulate.tools import search_objects, search_comments
+    from pdulate.serialize import serialize_object
+    patch = store.read(args.patch)
+    indices = {item: i for i, item in enumerate(patch.get_items())}
+    search = search_comments if args.comments else search_objects
+    for item in search(patch, args.pattern):
+        print(indices[item], *serialize_object(item))
+
+def stats_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--jobs', type=int, help='Number of files read in parallel')
+    parser.add_argument('--indent', type=int, default=2, help='JSON indentation, 0 for one line')
+    parser.add_argument('patch', nargs='+', type=str, help='Paths to the patch files')
+
+@command('stats', 'Print the item, connection, depth and array figures of patches as JSON.', stats_arguments)
+def run_stats(args: argparse.Namespace, store):
+    import json
+    from pdulate.stats import files_stats
+    # Patches are scanned without being parsed, the store has nothing to offer
+    stats = files_stats(args.patch, args.jobs)
+    print(json.dumps(stats, indent=args.indent or None))
+    if any('error' in result for result in stats.values()):
+        sys.exit(1)
+
+def diff_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--json', action='store_true', help='Print the changes as JSON')
+    parser.add_argument('old', type=str, help='Path to the old patch')
+    parser.add_argument('new', type=str, help='Path to the new patch')
+
+@command('diff', 'Print the added, removed and modified items and connections between two patches.', diff_arguments)
+def run_diff(args: argparse.Namespace, store):
+    from pdulate.diff import diff_files
+    # Patches are hashed from their records, without being parsed
+    changes = diff_files(args.old, args.new)
+    if args.json:
+        import json
+        print(json.dumps([change.as_dict() for change in changes], indent=2))
+    else:
+        for change in changes:
+            print(change)
+    # Like diff, 1 when the patches differ
+    if changes:
+        sys.exit(1)
+
+def index_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--db', type=str, help='Index file, $PDULATE_INDEX or one in the user cache directory otherwise')
+    parser.add_argument('--jobs', type=int, help='Number of files read in parallel')
+    parser.add_argument('root', nargs='+', type=str, help='Patch files and directories containing them')
+
+@command('index', 'Index the objects, messages and comments of patches for pdu grep.', index_arguments)
+def run_index(args: argparse.Namespace, store):
+    from pdulate.index import Index
+    with Index(args.db) as index:
+        reindexed, unchanged, dropped = index.update(args.root, args.jobs)
+    print(f"{reindexed} patches indexed, {unchanged} unchanged, {dropped} dropped")
+
+def shard_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--no-arrays', dest='arrays', action='store_false', help="Don't move array graphs out")
+    parser.add_argument('--min-items', type=int, help='Move out subpatches with at least this many items')
+    parser.add_argument('--jobs', type=int, help='Number of files written in parallel')
+    parser.add_argument('--force', action='store_true', help='Overwrite or remove files changed since they were written')
+    parser.add_argument('-o', '--output', type=str, help='Where to write the main patch, <patch>.sharded.pd by default')
+    parser.add_argument('patch', type=str, help='Path to the patch file')
+
+@command('shard', 'Move the array graphs and large subpatches of a patch out into abstraction files.', shard_arguments)
+def run_shard(args: argparse.Namespace, store):
+    from pdulate.shard import shard_file, sharded_path
+    written, unchanged, removed, skipped = shard_file(args.patch, args.output, args.arrays, args.min_items,
+                                                      args.jobs, args.force)
+    # Cached parses of the files written are stale
+    for path in written:
+        store.discard(path)
+    print(f"{len(written)} files written, {len(unchanged)} unchanged, {len(removed)} shards removed "
+          f"({args.output or sharded_path(args.patch)})")
+    if skipped:
+        print(f"{len(skipped)} files changed since they were written were skipped, --force overwrites or removes them:",
+              *skipped, sep='\n  ', file=sys.stderr)
+        sys.exit(1)
+
+def grep_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--db', type=str, help='Index file, $PDULATE_INDEX or one in the user cache directory otherwise')
+    parser.add_argument('--messages', action='store_true', help='Search messages')
+    parser.add_argument('--comments', action='store_true', help='Search comments')
+    parser.add_argument('--all', action='store_true', help='Search objects, messages and comments')
+    parser.add_argument('pattern', type=str, help='Unix shell style pattern, e.g. "s master-bus"')
+
+@command('grep', 'Print the indexed objects, messages or comments matching a pattern, with their file, subpatch and index.', grep_arguments)
+def run_grep(args: argparse.Namespace, store):
+    from pdulate.index import Index, KINDS
+    kinds = KINDS if args.all else [kind for kind, selected in
+                                    (('obj', not (args.messages or args.comments)), ('msg', args.messages),
+                                     ('text', args.comments)) if selected]
+    found = False
+    with Index(args.db) as index:
+        for path, subpatch, position, kind, text in index.grep(args.pattern, kinds):
+            print(f"{path}:{subpatch}:{position}: {text}")
+            found = True
+    # Like grep, 1 when nothing matched
+    if not found:
+        sys.exit(1)
+
+class StageAction(argparse.Action):
+    """Appends (stage, values) to args.stages, keeping the command line order."""
+    def __call__(self, parser, namespace, values, option_string=None):
+        namespace.stages = namespace.stages + [(self.dest, values)]
+
+def run_arguments(parser: argparse.ArgumentParser):
+    parser.set_defaults(stages=[])
+    parser.add_argument('patch', type=str, help='Path to the patch file, given before the stages')
+    parser.add_argument('--channels', nargs=0, action=StageAction, help='Enumerate [dac~] objects, as pdu channels')
+    parser.add_argument('--load-audio', nargs='+', action=StageAction, metavar='PATH', help='Load audio files and directories, as pdu load-audio')
+    parser.add_argument('--replace', nargs=2, action=StageAction, metavar=('PATTERN', 'OBJECT'), help='Replace the objects matching PATTERN with OBJECT, e.g. "dac~ 1"')
+    parser.add_argument('--duplicate', nargs=3, action=StageAction, metavar=('PATTERN', 'X', 'Y'), help='Duplicate the objects matching PATTERN, moved by X and Y')
+    parser.add_argument('--optimize', nargs=0, action=StageAction, help='Remove dead objects, merge identical ones and bypass pass-through ones')
+    parser.add_argument('--sample-rate', type=int, help='Target sample rate for --load-audio')
+    parser.add_argument('--resampler', choices=['hq', 'fast'], default='hq', help='Resampler for --load-audio')
+    parser.add_argument('--dedup', action='store_true', help='Store identical audio only once in --load-audio')
+    parser.add_argument('--sidecar', choices=['wav'], help='Keep --load-audio audio in files next to the patch')
+    parser.add_argument('-o', '--output', type=str, help='Where to write the result, the patch itself by default')
+    parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing anything, --sidecar excluded')
+
+def make_stage(name: str, values: List[str], args: argparse.Namespace):
+    if name == 'channels':
+        import_scripts()
+        from scripts.channels import channel_dacs
+        return lambda patch: f"{channel_dacs(patch)} [dac~] without arguments enumerated"
+    elif name == 'load_audio':
+        import_scripts()
+        from scripts.load_audio import add_audio
+
+        def transform(patch):
+            dedup = add_audio(patch, args.output or args.patch, values, args.sample_rate,
+                              args.sidecar, args.resampler, args.dedup)
+            if dedup:
+                return f"{len(dedup.aliases)} arrays deduplicated, saving {dedup.bytes_saved} bytes"
+        return transform
+    elif name == 'replace':
+        from pdulate.pipeline import replace_stage
+        return replace_stage(*values)
+    elif name == 'duplicate':
+        from pdulate.pipeline import duplicate_stage
+        return duplicate_stage(values[0], int(values[1]), int(values[2]))
+    elif name == 'optimize':
+        from pdulate.pipeline import optimize_stage
+        return optimize_stage()
+
+@command('run', 'Apply several transforms to a patch, parsing and writing it once.', run_arguments)
+def run_pipeline(args: argparse.Namespace, store):
+    from pdulate.pipeline import Pipeline
+    # Sidecar files are written as the audio loads, before the patch would be
+    if args.dry_run and args.sidecar and any(name == 'load_audio' for name, _ in args.stages):
+        print("--sidecar writes audio files, it can't be used with --dry-run", file=sys.stderr)
+        sys.exit(2)
+    pipeline = Pipeline()
+    for name, values in args.stages:
+        pipeline.add(name.replace('_', '-'), make_stage(name, values, args))
+    for result in pipeline.process(args.patch, args.output, store, args.dry_run):
+        print(result)
+
+def watch_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--channels', action='store_true', help='Enumerate [dac~] objects whenever the patch changes')
+    parser.add_argument('--audio', action='append', default=[], metavar='DIR', help='Directory whose new or modified audio files are loaded, may be repeated')
+    parser.add_argument('--sample-rate', type=int, help='Target sample rate for audio files')
+    parser.add_argument('--resampler', choices=['hq', 'fast'], default='hq', help='Resampler for audio files')
+    parser.add_argument('--dedup', action='store_true', help='Store identical audio only once')
+    parser.add_argument('--sidecar', choices=['wav'], help='Keep audio in files next to the patch')
+    parser.add_argument('--debounce', type=float, default=0.3, help='Seconds without changes before processing them')
+    parser.add_argument('patch', type=str, help='Path to the patch file')
+
+@command('watch', 'Keep a patch in sync with its edits and audio directories.', watch_arguments)
+def run_watch(args: argparse.Namespace, store):
+    import_scripts()
+    from scripts.watch import watch
+    # Watching keeps its own cache, a PatchStore wouldn't keep anything
+    watch(args.patch, args.audio, args.channels, args.sample_rate, args.sidecar, args.resampler,
+          args.dedup, args.debounce)
+
+def serve_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--socket', type=str, help='Socket path, $PDULATE_SOCKET or a per user default otherwise')
+    parser.add_argument('--stop', action='store_true', help='Stop the running server')
+    parser.add_argument('--status', action='store_true', help='Print the state of the running server')
+
+@command('serve', 'Keep answering pdu commands, with parsed patches cached in memory.', serve_arguments)
+def run_serve(args: argparse.Namespace, store):
+    from pdulate.serve import Server, forward_request
+    if args.stop or args.status:
+        status = forward_request('status', path=args.socket)
+        if status is None:
+            print("No server running")
+            sys.exit(1)
+        if args.stop:
+            forward_request('shutdown', path=args.socket)
+        else:
+            print(status)
+        return
+    Server(args.socket).serve()
+
+def build_parser(selected: Optional[str] = None) -> argparse.ArgumentParser:
+    """
+    Builds the pdu parser. Only the selected subcommand gets its arguments,
+    all of them do if selected is None.
+    """
     parser = argparse.ArgumentParser(description="pdulate CLI")
+    parser.add_argument('--profile', action='store_true', help='Print parsing, serializing and I/O counters and timings to stderr, as does $PDULATE_PROFILE')
     subparsers = parser.add_subparsers(dest='command')
+    for name, (help, arguments, _) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help)
+        if selected is None or name == selected:
+            arguments(subparser)
+    return parser
 
-    # Subparser for the "channels" command
-    parser_channels = subparsers.add_parser('channels', help='Process a file with channels')
-    parser_channels.add_argument('file_path', type=str, help='Path to the file')
+def find_command(argv: List[str]) -> Optional[str]:
+    # Top level options don't take values, the first positional is the command
+    return next((arg for arg in argv if not arg.startswith('-')), None)
 
-    # Subparser for the "loadaudio" command
-    parser_loadaudio = subparsers.add_parser('load-audio', help='Load audio files into a Pure Data patch.')
-    parser_loadaudio.add_argument('--sample-rate', type=int, nargs='?', help='Target sample rate for conversions')
-    parser_loadaudio.add_argument('patch', type=str, help='Path to the patch file')
-    parser_loadaudio.add_argument('path', nargs='+', type=str, help='List of audio files an dirrectories containing them to load')
+def run_command(args: argparse.Namespace, store):
+    """Runs the parsed command, followed by a profile report on stderr if asked for."""
+    from pdulate import instrument
+    if not (args.profile or instrument.enabled):
+        COMMANDS[args.command][2](args, store)
+        return
+    with instrument.profiling() as stats:
+        try:
+            COMMANDS[args.command][2](args, store)
+        finally:
+            print(stats.report(), file=sys.stderr)
 
-    try:
-        import argcomplete
-        argcomplete.autocomplete(parser)
-    except:
-        pass
-    args = parser.parse_args()
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    selected = find_command(argv)
 
-    if args.command == 'channels':
-        from scripts.channels import channels
-        channels(Path(args.file_path))
-    elif args.command == 'load-audio':
-        from scripts.load_audio import load_audio
-        load_audio(args.path, args.patch, args.sample_rate)
+    # Completion scripts set _ARGCOMPLETE, don't import argcomplete otherwise
+    if '_ARGCOMPLETE' in os.environ:
+        parser = build_parser()
+        try:
+            import argcomplete
+            argcomplete.autocomplete(parser)
+        except ImportError:
+            pass
+    else:
+        # The server has its own standard input
+        reads_stdin = '-' in argv or '--files0-from=-' in argv
+        if selected not in (None, 'serve', 'watch') and not reads_stdin and not os.environ.get('PDULATE_NO_SERVER'):
+            # Forward to a running server, checking for its socket costs next to nothing
+            from pdulate.serve import socket_path, forward
+            if os.path.exists(socket_path()):
+                status = forward(argv)
+                if status is not None:
+                    sys.exit(status)
+        parser = build_parser(selected)
+
+    args = parser.parse_args(argv)
+    if args.command:
+        from pdulate.store import PatchStore
+        run_command(args, PatchStore())
     else:
         parser.print_help()
 
@@ -1,30 +1,80 @@
 import re
-from typing import List, Union, Dict
+from concurrent.futures import Executor, Future
+from typing import List, Optional, Union, Dict
+from pdulate import instrument
 from pdulate.items import Patch, Subpatch, Object, Message, Number, Symbol, Array, Comment, ConnectableItem
 
-    
+# Values per #A line
+ARRAY_LINE_SIZE = 100
+# Arrays from this many values are formatted by the process pool, if any,
+# in blocks of PARALLEL_BLOCK values (a multiple of ARRAY_LINE_SIZE)
+PARALLEL_MIN_POINTS = 1 << 17
+PARALLEL_BLOCK = 1000 * ARRAY_LINE_SIZE
+
 def escape_special_chars(text):
     return re.sub(r'([,$;\\])', r'\\\1', str(text))
 
-def serialize_patch(patch: Patch) -> str:
-    lines = [f"#N canvas {patch.x} {patch.y} {patch.width} {patch.height} {patch.font_size};"]
-    lines.extend(serialize_content(patch))
-    return "\n".join(lines)
+def serialize_patch(patch: Patch, jobs: Optional[int] = 1, executor: Optional[Executor] = None) -> str:
+    """
+    Renders a patch in the Pd file format.
+
+    Args:
+        patch (Patch): The patch.
+        jobs (int): Number of processes formatting the values of large
+            arrays while the rest of the patch is serialized, as many as
+            CPUs if None. The output is the same whatever their number.
+        executor (Executor): Pool to format them in instead, e.g. one kept
+            for several patches.
+    """
+    if executor is None and jobs != 1 and next(large_arrays(patch), None) is not None:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs) as pool:
+            return serialize_patch(patch, executor=pool)
+
+    with instrument.timer('serialize'):
+        rendered = render_arrays(patch, executor) if executor is not None else None
+        lines = [f"#N canvas {patch.x} {patch.y} {patch.width} {patch.height} {patch.font_size};"]
+        lines.extend(serialize_content(patch, rendered))
+        return "\n".join(lines)
+
+def serialize_array_data(data: List[float], start: int = 0) -> List[str]:
+    """The #A lines of data, the values of an array from index start (a multiple of ARRAY_LINE_SIZE)."""
+    return [f"#A {start + i} {' '.join(map(str, data[i:i + ARRAY_LINE_SIZE]))};"
+            for i in range(0, len(data), ARRAY_LINE_SIZE)]
+
+def large_arrays(patch: Patch):
+    for item in patch.get_items():
+        if isinstance(item, Subpatch):
+            yield from large_arrays(item)
+        elif isinstance(item, Array) and item.saves_content() and len(item.data) >= PARALLEL_MIN_POINTS:
+            yield item
+
+def render_arrays(patch: Patch, executor: Executor) -> Dict[int, List[Future]]:
+    """Submits the formatting of the large arrays of patch to executor, by array id, in blocks."""
+    rendered = {}
+    for array in large_arrays(patch):
+        rendered[id(array)] = [executor.submit(serialize_array_data, array.data[i:i + PARALLEL_BLOCK], i)
+                               for i in range(0, len(array.data), PARALLEL_BLOCK)]
+    return rendered
 
-def serialize_object(obj: Union[Object, Message, Number, Symbol, Array, Comment, Subpatch]) -> List[str]:
+def serialize_object(obj: Union[Object, Message, Number, Symbol, Array, Comment, Subpatch],
+                     rendered: Optional[Dict[int, List[Future]]] = None) -> List[str]:
     lines = []
 
     if isinstance(obj, Subpatch):
-        lines.extend(serialize_subpatch(obj))
+        lines.extend(serialize_subpatch(obj, rendered))
 
     elif isinstance(obj, Array):
         lines.append(f"#X array {obj.name} {obj.size} {obj.type} {obj.save_flag} {obj.draw_style};")
-        if obj.data:
+        if not obj.saves_content():
+            # Content is loaded at runtime, Pd doesn't store it either
+            pass
+        elif rendered and id(obj) in rendered:
+            for block in rendered[id(obj)]:
+                lines.extend(block.result())
+        elif obj.data:
             # Write actual data in chunks to avoid very long lines
-            chunk_size = 100
-            for i in range(0, len(obj.data), chunk_size):
-                chunk = obj.data[i:i+chunk_size]
-                lines.append(f"#A {i} {' '.join(map(str, chunk))};")
+            lines.extend(serialize_array_data(obj.data))
         else:
             # If no data, initialize with zeros
             lines.append(f"#A 0 {' '.join(['0'] * obj.size)};")
@@ -55,19 +105,23 @@ def serialize_object(obj: Union[Object, Message, Number, Symbol, Array, Comment,
 
     return lines
 
-def serialize_content(patch: Patch) -> List[str]:
+def serialize_content(patch: Patch, rendered: Optional[Dict[int, List[Future]]] = None) -> List[str]:
     lines = []
     objects = patch.get_items()
     # Create a map of objects to their indices
     object_index_map = {obj: i for i, obj in enumerate(objects)}
     # Write objects
     for obj in objects:
-        lines.extend(serialize_object(obj))
+        lines.extend(serialize_object(obj, rendered))
     # Write connections
-    lines.extend(serialize_connections(patch, object_index_map))
+    connections = serialize_connections(patch, object_index_map)
+    lines.extend(connections)
+    if instrument.enabled:
+        instrument.count('serialize items', len(objects))
+        instrument.count('serialize connections', len(connections))
     return lines
 
-def serialize_subpatch(subpatch: Subpatch) -> List[str]:
+def serialize_subpatch(subpatch: Subpatch, rendered: Optional[Dict[int, List[Future]]] = None) -> List[str]:
     lines = []
     if subpatch.graph_on_parent:
         lines.append(f"#N canvas {subpatch.x} {subpatch.y} "
@@ -76,7 +130,7 @@ def serialize_subpatch(subpatch: Subpatch) -> List[str]:
         lines.append(f"#N canvas {subpatch.x} {subpatch.y} "
         f"{subpatch.width} {subpatch.height} {subpatch.name} {int(subpatch.graph_on_parent)};")
     
-    lines.extend(serialize_content(subpatch))
+    lines.extend(serialize_content(subpatch, rendered))
     
     if subpatch.coords:
         lines.append(f"#X coords {' '.join(map(str, subpatch.coords))};")
@@ -0,0 +1,236 @@
+"""
+A long-lived pdu process answering commands on a Unix socket, keeping
+parsed patches in memory between them (see CachedPatchStore). pdu forwards
+its commands to the server whenever one is listening.
+
+The protocol is JSON-RPC 2.0, one request or response per line:
+
+- run {"argv": [...], "cwd": "...", "env": {...}}: runs a pdu command,
+  returns its "status" and captured "stdout" and "stderr". env holds the
+  variables of FORWARDED_ENVIRONMENT of the client, null if unset, which
+  apply to the command instead of those of the server.
+- status: returns the server "pid", the "cached" patches, cache "hits" and
+  "misses".
+- shutdown: stops the server.
+"""
+
+import os
+import sys
+from typing import Dict, List, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.NOTSET)
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+
+# Variables changing what a command does, taken from the client
+FORWARDED_ENVIRONMENT = ('PDULATE_JOBS', 'PDULATE_INDEX', 'PDULATE_PROFILE')
+
+def socket_path() -> str:
+    """
+    The socket used by default, $PDULATE_SOCKET if set. It is in
+    $XDG_RUNTIME_DIR, which only the user can access, or else in a
+    pdulate-<uid> directory of the temporary directory, created by the
+    server with 0700 permissions.
+    """
+    if os.environ.get('PDULATE_SOCKET'):
+        return os.environ['PDULATE_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'pdulate.sock')
+    return os.path.join(temporary_directory(), 'pdulate.sock')
+
+def temporary_directory() -> str:
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), f"pdulate-{os.getuid()}")
+
+def private_directory(directory: str):
+    """
+    Creates directory with 0700 permissions if missing. Raises RuntimeError
+    if it is a link, belongs to another user, or others can access it.
+    """
+    import stat
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"{directory} must be a directory of the user with 0700 permissions")
+
+def is_owned(path: str) -> bool:
+    """Whether path is a socket of the current user."""
+    import stat
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+class Server:
+    def __init__(self, path: Optional[str] = None):
+        from pdulate.store import CachedPatchStore
+        self.path = path or socket_path()
+        self.store = CachedPatchStore()
+        self.running = False
+
+    def run(self, argv: List[str], cwd: str, env: Optional[Dict[str, Optional[str]]] = None) -> dict:
+        import io
+        import traceback
+        from contextlib import redirect_stdout, redirect_stderr
+        from pdulate import instrument
+        from pdulate.scripts import build_parser, find_command, run_command
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = 0
+        # Requests are handled one at a time, changing directory and environment is safe
+        previous_cwd = os.getcwd()
+        env = {name: value for name, value in (env or {}).items() if name in FORWARDED_ENVIRONMENT}
+        previous_env = {name: os.environ.get(name) for name in env}
+        previous_enabled = instrument.enabled
+        try:
+            os.chdir(cwd)
+            set_environment(env)
+            if 'PDULATE_PROFILE' in env:
+                # Read once when instrument is imported
+                instrument.enabled = bool(env['PDULATE_PROFILE'])
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    args = build_parser(find_command(argv)).parse_args(argv)
+                    if args.command in ('serve', 'watch'):
+                        print(f"pdu {args.command} can't run in the server", file=sys.stderr)
+                        status = 1
+                    elif args.command:
+                        run_command(args, self.store)
+                except SystemExit as e:
+                    if isinstance(e.code, str):
+                        print(e.code, file=sys.stderr)
+                    status = e.code if isinstance(e.code, int) else int(e.code is not None)
+                except Exception:
+                    # Cached patches may have been left half modified
+                    self.store.clear()
+                    traceback.print_exc()
+                    status = 1
+        finally:
+            instrument.enabled = previous_enabled
+            set_environment(previous_env)
+            os.chdir(previous_cwd)
+        return {'status': status, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+    def dispatch(self, request) -> dict:
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return error(None, INVALID_REQUEST, "Invalid request")
+        id = request.get('id')
+        method, params = request['method'], request.get('params') or {}
+
+        if method == 'run':
+            env = params.get('env') or {}
+            if (not isinstance(params.get('argv'), list) or not isinstance(params.get('cwd'), str)
+                    or not isinstance(env, dict)
+                    or not all(value is None or isinstance(value, str) for value in env.values())):
+                return error(id, INVALID_PARAMS, "run expects argv, cwd and optionally env")
+            result = self.run(params['argv'], params['cwd'], env)
+        elif method == 'status':
+            result = {'pid': os.getpid(), 'cached': len(self.store.patches),
+                      'hits': self.store.hits, 'misses': self.store.misses}
+        elif method == 'shutdown':
+            self.running = False
+            result = None
+        else:
+            return error(id, METHOD_NOT_FOUND, f"Method not found: {method}")
+        return {'jsonrpc': '2.0', 'id': id, 'result': result}
+
+    def serve(self):
+        import json
+        import socketserver
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = server.dispatch(json.loads(line))
+                    except ValueError:
+                        response = error(None, PARSE_ERROR, "Parse error")
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+                    if not server.running:
+                        break
+
+        if os.path.dirname(self.path) == temporary_directory():
+            private_directory(os.path.dirname(self.path))
+        if os.path.lexists(self.path):
+            if not is_owned(self.path):
+                raise RuntimeError(f"{self.path} exists and isn't a socket of the user")
+            if forward_request('status', path=self.path) is not None:
+                raise RuntimeError(f"A server is already listening on {self.path}")
+            os.remove(self.path)  # Left over by a server that didn't stop cleanly
+
+        # Created without permissions for others, rather than changed once bound
+        umask = os.umask(0o077)
+        try:
+            unix_server = socketserver.UnixStreamServer(self.path, Handler)
+        finally:
+            os.umask(umask)
+        with unix_server:
+            logger.info("Serving on %s", self.path)
+            self.running = True
+            try:
+                while self.running:
+                    unix_server.handle_request()
+            finally:
+                os.remove(self.path)
+
+def set_environment(values: Dict[str, Optional[str]]):
+    """Sets environment variables, removing those whose value is None."""
+    for name, value in values.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+def error(id, code: int, message: str) -> dict:
+    return {'jsonrpc': '2.0', 'id': id, 'error': {'code': code, 'message': message}}
+
+def forward_request(method: str, params: Optional[dict] = None, path: Optional[str] = None):
+    """
+    Sends a request to the server. Returns its result, or None if no server
+    is listening, or if its socket doesn't belong to the user.
+    """
+    import json
+    import socket
+
+    path = path or socket_path()
+    if not is_owned(path):
+        if os.path.exists(path):
+            logger.warning("Not forwarding to %s, it doesn't belong to the user", path)
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+            request = {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params or {}}
+            client.sendall(json.dumps(request).encode() + b'\n')
+            with client.makefile('rb') as f:
+                response = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if 'error' in response:
+        raise RuntimeError(response['error']['message'])
+    return response['result']
+
+def forward(argv: List[str], path: Optional[str] = None) -> Optional[int]:
+    """
+    Runs a pdu command on the server, with the FORWARDED_ENVIRONMENT of this
+    process, printing its output. Returns the exit status, or None if no
+    server is listening.
+    """
+    env = {name: os.environ.get(name) for name in FORWARDED_ENVIRONMENT}
+    result = forward_request('run', {'argv': argv, 'cwd': os.getcwd(), 'env': env}, path)
+    if result is None:
+        return None
+    sys.stdout.write(result['stdout'])
+    sys.stderr.write(result['stderr'])
+    return result['status']
@@ -0,0 +1,293 @@
+"""
+Sharding of huge patches into abstraction files, which Pd only opens when
+it creates their instances, and which are small enough to edit one by one.
+
+A subpatch is moved out when it is an array graph (arrays), or holds at
+least min_items items once its own shards are moved out. Its records go to
+an abstraction file in the <patch>_shards directory, and it is replaced by
+an instance of the abstraction at the same index and location, so every
+connection to it, and to its inlets and outlets, holds as it is. Graph on
+parent subpatches keep their coords, their instance shows the same graph.
+
+The patch is split by records, nothing is parsed into items and array data
+isn't decoded. The shards and their digests are kept in a manifest, a
+later run only writes the shards whose content changed, in parallel
+threads, and removes those no longer produced. Files changed since they
+were written, e.g. a shard edited in Pd, are neither overwritten nor
+removed unless forced.
+
+Subpatches using $ arguments are left in place: in an abstraction $0 and
+$1 would refer to the abstraction rather than to the patch holding them.
+
+Example:
+    written, unchanged, removed, skipped = shard_file('huge.pd', min_items=1000)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from pdulate.parser import ITEM_RECORDS
+from pdulate.stats import iter_records
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+class Canvas:
+    """
+    The records of a (sub)patch.
+
+    Attributes:
+        header (str): Its #N canvas record.
+        records (List[Union[str, Canvas]]): Its records, subpatches as Canvas.
+        restore (str): The #X restore record placing it in its parent, '' for the main patch.
+        items (int): Items of the canvas and its subpatches, shards excluded.
+        shard (str): The name of its abstraction, if moved out.
+    """
+    def __init__(self, header: str):
+        self.header = header
+        self.records: List[Union[str, 'Canvas']] = []
+        self.restore = ''
+        self.items = 0
+        self.shard = ''
+
+    def name(self) -> str:
+        """The subpatch name, or the name of the first array of a graph."""
+        words = self.restore.split()
+        if len(words) > 5 and words[4] == 'pd':
+            return ' '.join(words[5:]).split(',')[0].strip()
+        for record in self.records:
+            if isinstance(record, str) and record.startswith('#X array'):
+                return record.split()[2]
+        return 'graph'
+
+    def is_array_graph(self) -> bool:
+        kinds = {' '.join(record.split()[:2]) for record in self.records
+                 if isinstance(record, str) and not record.startswith('#A')}
+        return '#X array' in kinds and kinds <= {'#X array', '#X coords'}
+
+    def uses_arguments(self) -> bool:
+        return any('$' in record if isinstance(record, str) else record.uses_arguments()
+                   for record in self.records)
+
+def build_canvas(records: Iterable[str]) -> Canvas:
+    """The main canvas of a patch, from its records."""
+    stack: List[Canvas] = []
+    main = None
+    for record in records:
+        kind = ' '.join(record.split(None, 2)[:2])
+        if kind == '#N canvas':
+            canvas = Canvas(record)
+            if stack:
+                stack[-1].records.append(canvas)
+            else:
+                main = canvas
+            stack.append(canvas)
+        elif not stack:
+            continue
+        elif kind == '#X restore' and len(stack) > 1:
+            stack.pop().restore = record
+        else:
+            stack[-1].records.append(record)
+    if main is None:
+        raise ValueError("No canvas found")
+    return main
+
+def shard_name(canvas: Canvas, prefix: str, taken: Dict[str, int]) -> str:
+    """A file name for the abstraction of canvas, unique in the patch, in document order."""
+    name = prefix + '_' + re.sub(r'[^\w.-]+', '_', canvas.name()).strip('_.')
+    count = taken.get(name, 0) + 1
+    taken[name] = count
+    return name if count == 1 else f"{name}-{count}"
+
+def select_shards(canvas: Canvas, arrays: bool, min_items: Optional[int], prefix: str,
+                  taken: Dict[str, int], top: bool = True) -> int:
+    """
+    Marks the subpatches of canvas to move out, deepest first, and counts
+    the items left in canvas.
+
+    Returns:
+        int: The items of canvas and its subpatches left in place.
+    """
+    items = 0
+    for record in canvas.records:
+        if isinstance(record, Canvas):
+            # The subpatch counts as one item of its parent
+            items += 1 + select_shards(record, arrays, min_items, prefix, taken, False)
+        elif record.startswith(ITEM_RECORDS[1:]):
+            items += 1
+    canvas.items = items
+
+    if top:
+        return items
+    if (arrays and canvas.is_array_graph()) or (min_items is not None and items >= min_items):
+        if canvas.uses_arguments():
+            logger.warning("Leaving %s in place, it uses $ arguments", canvas.name())
+        else:
+            canvas.shard = shard_name(canvas, prefix, taken)
+            return 0
+    return items
+
+def instance(canvas: Canvas, reference: str) -> str:
+    """The #X obj record replacing a sharded subpatch, where its #X restore was."""
+    words = canvas.restore.split(None, 4)
+    rest = words[4] if len(words) > 4 else ''
+    # Keep a box width given after the name
+    width = rest[rest.index(','):] if ',' in rest else ''
+    return f"#X obj {words[2]} {words[3]} {reference}{width}"
+
+def render(canvas: Canvas, prefix: str, shards: Dict[str, str], font: str) -> List[str]:
+    """
+    The records of canvas, its shards replaced by instances, the content of
+    each shard being added to shards by name. Abstractions are referenced
+    from the main patch through the prefix directory, and from one another
+    by name, as Pd looks for them next to the patch holding them.
+    """
+    records = [canvas.header]
+    for record in canvas.records:
+        if not isinstance(record, Canvas):
+            records.append(record)
+        elif record.shard:
+            words = record.header.split()
+            header = ' '.join(words[:6] + [font])
+            shards[record.shard] = to_text([header] + render(record, '', shards, font)[1:])
+            records.append(instance(record, prefix + record.shard))
+        else:
+            records.extend(render(record, prefix, shards, font))
+            records.append(record.restore)
+    return records
+
+def to_text(records: List[str]) -> str:
+    return ''.join(record + ';\n' for record in records)
+
+def shard_patch(records: Iterable[str], stem: str, arrays: bool = True,
+                min_items: Optional[int] = None) -> Tuple[str, Dict[str, str]]:
+    """
+    Splits a patch, given by its records, into its main patch and shards.
+
+    Args:
+        stem (str): The name of the patch, shards are named <stem>_<subpatch
+            name> and referenced in the <stem>_shards directory.
+        arrays (bool): Move out array graphs.
+        min_items (int): Move out subpatches with at least this many items
+            left once their own shards are out, None not to.
+
+    Returns:
+        Tuple[str, Dict[str, str]]: The content of the main patch, and that
+        of each shard by name.
+    """
+    main = build_canvas(records)
+    words = main.header.split()
+    font = words[6] if len(words) > 6 else '12'
+    select_shards(main, arrays, min_items, stem, {})
+    shards: Dict[str, str] = {}
+    content = to_text(render(main, f"{stem}_shards/", shards, font))
+    return content, shards
+
+def digest(content: str) -> str:
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+def write_atomic(path: str, content: str):
+    """Writes content to path through a temporary file renamed over it."""
+    fd, temporary = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+def sharded_path(path: str) -> str:
+    return str(Path(path).with_name(f"{Path(path).stem}.sharded{Path(path).suffix}"))
+
+def shard_file(path: str, output: Optional[str] = None, arrays: bool = True, min_items: Optional[int] = None,
+               jobs: Optional[int] = None, force: bool = False) -> Tuple[List[str], List[str], List[str], List[str]]:
+    """
+    Shards the patch at path (see shard_patch), writing the main patch to
+    output, <patch>.sharded.pd by default, and the shards to the
+    <patch>_shards directory next to it. Files whose content is the same as
+    the manifest says they were last written with are left alone, the others
+    are written in up to jobs threads. Shards no longer produced are
+    removed from the directory. Files modified since they were written are
+    skipped, with a warning, unless force.
+
+    Returns:
+        Tuple[List[str], List[str], List[str], List[str]]: The files
+        written, those unchanged, the shards removed and the files skipped.
+    """
+    output = output or sharded_path(path)
+    stem = Path(path).stem
+    directory = os.path.join(os.path.dirname(os.path.abspath(output)), f"{stem}_shards")
+    with open(path, 'r') as f:
+        content, shards = shard_patch(iter_records(f), stem, arrays, min_items)
+
+    files = {os.path.join(directory, f"{name}.pd"): text for name, text in shards.items()}
+    files[os.path.abspath(output)] = content
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    def modified(file: str) -> bool:
+        """Whether file changed since the manifest says it was written."""
+        stat = os.stat(file)
+        return manifest[file][1:] != [stat.st_mtime_ns, stat.st_size]
+
+    def write(file: str) -> Tuple[str, str]:
+        """Writes file unless unchanged or modified, returns its digest and "written", "unchanged" or "skipped"."""
+        text = files[file]
+        content_digest = digest(text)
+        if file in manifest and os.path.exists(file):
+            if modified(file):
+                if not force:
+                    logger.warning("Not writing %s, it changed since it was written", file)
+                    return content_digest, 'skipped'
+            elif manifest[file][0] == content_digest:
+                return content_digest, 'unchanged'
+        write_atomic(file, text)
+        return content_digest, 'written'
+
+    os.makedirs(directory, exist_ok=True)
+    if jobs != 1 and len(files) > 1:
+        with ThreadPoolExecutor(jobs) as executor:
+            results = dict(zip(files, executor.map(write, files)))
+    else:
+        results = {file: write(file) for file in files}
+
+    new_manifest = {}
+    for file, (content_digest, result) in results.items():
+        if result == 'skipped':
+            new_manifest[file] = manifest[file]  # Still known as changed on the next run
+        else:
+            stat = os.stat(file)
+            new_manifest[file] = [content_digest, stat.st_mtime_ns, stat.st_size]
+
+    # Shards no longer produced, main patches written elsewhere before are left alone
+    removed = []
+    for file in manifest:
+        if file in files or os.path.dirname(file) != directory or not os.path.exists(file):
+            continue
+        if modified(file) and not force:
+            logger.warning("Not removing %s, it changed since it was written", file)
+            results[file] = (manifest[file][0], 'skipped')
+            new_manifest[file] = manifest[file]
+            continue
+        os.unlink(file)
+        removed.append(file)
+    write_atomic(manifest_path, json.dumps(new_manifest, indent=1))
+
+    written = [file for file, (_, result) in results.items() if result == 'written']
+    unchanged = [file for file, (_, result) in results.items() if result == 'unchanged']
+    skipped = [file for file, (_, result) in results.items() if result == 'skipped']
+    logger.info("%d files written, %d unchanged, %d shards removed, %d skipped", len(written), len(unchanged),
+                len(removed), len(skipped))
+    return written, unchanged, removed, skipped
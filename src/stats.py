@@ -0,0 +1,134 @@
+"""
+Structural figures of patches, computed in one pass over their records
+without building items or decoding array data, so even very large patches
+are summed up quickly and in little memory.
+"""
+
+import os
+from collections import Counter
+from typing import Dict, IO, Iterable, Iterator, List, Optional
+
+from pdulate.parser import PdParseError, split_records
+
+# Pd arrays hold 32-bit floats
+SAMPLE_BYTES = 4
+
+ITEM_TYPES = {
+    '#X obj': 'object',
+    '#X msg': 'message',
+    '#X floatatom': 'number',
+    '#X symbolatom': 'symbol',
+    '#X text': 'comment',
+    '#X array': 'array',
+}
+
+def iter_records(f: IO[str], chunk_size: int = 1 << 20) -> Iterator[str]:
+    """Yields the records of a patch file, stripped, reading it chunk_size characters at a time."""
+    rest = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        records = split_records(rest + chunk)
+        # The last one may continue in the next chunk
+        rest = records.pop()
+        for record in records:
+            record = record.strip()
+            if record:
+                yield record
+    rest = rest.strip()
+    if rest:
+        yield rest
+
+def patch_stats(records: Iterable[str]) -> dict:
+    """
+    Counts what the records of a patch hold.
+
+    Returns:
+        dict: "records", "items" by type, "objects" by name, "connections",
+        "subpatches", "max_depth", "arrays", "array_points", "array_bytes"
+        (in memory in Pd) and "saved_array_points" (stored in the patch).
+    """
+    items: Counter = Counter()
+    objects: Counter = Counter()
+    records_count = connections = subpatches = arrays = 0
+    depth = max_depth = -1
+    array_points = saved_array_points = 0
+
+    for record in records:
+        records_count += 1
+        # Array data is most of a big patch, it's only counted
+        if record.startswith('#A'):
+            continue
+        end = record.find(' ', 3)
+        kind = record if end < 0 else record[:end]
+        if kind == '#X connect':
+            connections += 1
+        elif kind == '#X obj':
+            parts = record.split(None, 5)
+            if len(parts) < 5:
+                raise PdParseError(f"Invalid object format: {record[:100]}")
+            items['object'] += 1
+            objects[parts[4]] += 1
+        elif kind == '#N canvas':
+            depth += 1
+            max_depth = max(max_depth, depth)
+            if depth > 0:
+                subpatches += 1
+                items['subpatch'] += 1
+        elif kind == '#X restore':
+            depth -= 1
+            if depth < 0:
+                raise PdParseError("Tried to end a subpatch, but no subpatch was active")
+        elif kind == '#X array':
+            parts = record.split(None, 6)
+            if len(parts) < 6:
+                raise PdParseError(f"Invalid array format: {record[:100]}")
+            items['array'] += 1
+            arrays += 1
+            size = int(float(parts[3]))
+            array_points += size
+            if int(parts[5]) & 1:
+                saved_array_points += size
+        elif kind in ITEM_TYPES:
+            items[ITEM_TYPES[kind]] += 1
+
+    if depth != 0:
+        raise PdParseError("Mismatched subpatch structure")
+
+    return {
+        'records': records_count,
+        'items': dict(items.most_common()),
+        'objects': dict(objects.most_common()),
+        'connections': connections,
+        'subpatches': subpatches,
+        'max_depth': max_depth,
+        'arrays': arrays,
+        'array_points': array_points,
+        'array_bytes': array_points * SAMPLE_BYTES,
+        'saved_array_points': saved_array_points,
+    }
+
+def file_stats(path: str) -> dict:
+    """patch_stats of the file at path, with its size in "file_bytes"."""
+    with open(path, 'r') as f:
+        stats = patch_stats(iter_records(f))
+    stats['file_bytes'] = os.path.getsize(path)
+    return stats
+
+def safe_file_stats(path: str) -> dict:
+    try:
+        return file_stats(path)
+    except (OSError, ValueError, PdParseError) as e:
+        return {'error': str(e)}
+
+def files_stats(paths: List[str], jobs: Optional[int] = None) -> Dict[str, dict]:
+    """
+    file_stats of several files, computed in parallel processes. A file that
+    can't be read gets {"error": message} instead.
+    """
+    if len(paths) < 2 or jobs == 1:
+        return {path: safe_file_stats(path) for path in paths}
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as executor:
+        return dict(zip(paths, executor.map(safe_file_stats, paths)))
@@ -0,0 +1,98 @@
+import os
+from typing import Dict, Optional, Tuple
+import logging
+
+from pdulate import instrument
+from pdulate.items import Patch
+from pdulate.parser import Parser
+from pdulate.serialize import serialize_patch
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.NOTSET)
+
+def default_jobs() -> Optional[int]:
+    """$PDULATE_JOBS, 1 if unset or invalid, None (all CPUs) for 0."""
+    value = os.environ.get('PDULATE_JOBS') or '1'
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = -1
+    if jobs < 0:
+        logger.warning("Ignoring PDULATE_JOBS=%s, expected a number of processes, 0 for all CPUs", value)
+        return 1
+    return jobs or None
+
+class PatchStore:
+    """
+    Reads and writes patch files. Scripts go through a store, so the same
+    code runs against plain files or against a cache of parsed patches.
+
+    Attributes:
+        jobs (int): Processes formatting large arrays when writing, see
+            serialize_patch. $PDULATE_JOBS, 1 by default, 0 for all CPUs.
+    """
+    @property
+    def jobs(self) -> Optional[int]:
+        return default_jobs()
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def read(self, path: str) -> Patch:
+        """
+        Parses the patch at path. A patch that gets modified must then be
+        written back to path, or discarded.
+        """
+        with instrument.timer('read'), open(path, 'r') as f:
+            content = f.read()
+        return Parser().parse_patch(content)
+
+    def write(self, path: str, patch: Patch):
+        content = serialize_patch(patch, self.jobs)
+        with instrument.timer('write'), open(path, 'w') as f:
+            f.write(content)
+
+    def discard(self, path: str):
+        """Forgets anything known about the patch at path, e.g. once modified elsewhere."""
+        pass
+
+class CachedPatchStore(PatchStore):
+    """
+    A PatchStore keeping parsed patches in memory, by absolute path. A cached
+    patch is used as long as the file keeps its modification time and size.
+    """
+    def __init__(self):
+        self.patches: Dict[str, Tuple[Tuple[int, int], Patch]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def signature(path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def read(self, path: str) -> Patch:
+        path = os.path.abspath(path)
+        signature = self.signature(path)
+        cached = self.patches.get(path)
+        if cached and cached[0] == signature:
+            self.hits += 1
+            instrument.count('cache hits')
+            return cached[1]
+        self.misses += 1
+        instrument.count('cache misses')
+        logger.debug("Parsing %s", path)
+        patch = super().read(path)
+        self.patches[path] = (signature, patch)
+        return patch
+
+    def write(self, path: str, patch: Patch):
+        path = os.path.abspath(path)
+        super().write(path, patch)
+        self.patches[path] = (self.signature(path), patch)
+
+    def discard(self, path: str):
+        self.patches.pop(os.path.abspath(path), None)
+
+    def clear(self):
+        self.patches.clear()
@@ -1,7 +1,8 @@
-from typing import List, Dict, Tuple, Optional, Union
+from typing import List, Dict, Tuple, Optional, Union, Iterator
 import re
 from pathlib import Path
 from pdulate.items import ConnectableItem, Item, Patch, Object, Subpatch, Array, Comment
+from pdulate.frozen import FrozenPatch, FrozenObject, FrozenSubpatch, FrozenArray, FrozenComment
 from pdulate.parser import Parser
 from fnmatch import fnmatch
 from itertools import chain
@@ -11,12 +12,13 @@ import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.NOTSET)
 
-def search_objects(patch: Patch, pattern: str) -> List[Object]:
+def search_objects(patch: Union[Patch, FrozenPatch], pattern: str) -> List[Object]:
     """
     Unix shell style search for objects in a patch by name and arguments.
 
     Args:
-        patch (Patch): The Pure Data patch to search within.
+        patch (Patch): The Pure Data patch to search within, or a frozen one,
+            whose frozen objects are then returned.
         pattern (str): A pattern to match item names and arguments.
 
     Returns:
@@ -25,37 +27,54 @@ def search_objects(patch: Patch, pattern: str) -> List[Object]:
     
     matching_objects = []
     for item in patch.get_items():
-        if isinstance(item, Object):
+        if isinstance(item, (Object, FrozenObject)):
             object_str = f"{item.name} {' '.join(item.args)}".strip()
             if fnmatch(object_str, pattern):
                 matching_objects.append(item)
     
-    logger.info(f"Found {len(matching_objects)} objects matching {pattern}")
+    logger.info("Found %d objects matching %s", len(matching_objects), pattern)
     return matching_objects
 
-def search_comments(patch: Patch, pattern: str) -> List[Comment]:
+def search_comments(patch: Union[Patch, FrozenPatch], pattern: str) -> List[Comment]:
     """
     Unix shell style search for comments in a patch by text pattern.
 
     Args:
-        patch (Patch): The Pure Data patch to search within.
+        patch (Patch): The Pure Data patch to search within, or a frozen one.
         pattern (str): A pattern to match comment text.
 
     Returns:
         List[Comment]: A list of matching comments.
     """
-    if not isinstance(patch, Patch):
-        raise TypeError("patch must be an instance of Patch")
+    if not isinstance(patch, (Patch, FrozenPatch)):
+        raise TypeError("patch must be an instance of Patch or FrozenPatch")
     
     matching_comments = []
     for item in patch.get_items():
-        if isinstance(item, Comment):
+        if isinstance(item, (Comment, FrozenComment)):
             if fnmatch(item.text, pattern):
                 matching_comments.append(item)
     
-    logger.info(f"Found {len(matching_comments)} comments matching {pattern}")
+    logger.info("Found %d comments matching %s", len(matching_comments), pattern)
     return matching_comments
 
+def iter_arrays(patch: Union[Patch, FrozenPatch], path: Tuple[str, ...] = ()) -> Iterator[Tuple[Tuple[str, ...], Array]]:
+    """
+    Walks a patch and all its subpatches, yielding arrays as they are found.
+
+    Args:
+        patch (Patch): The Pure Data patch to search within, or a frozen one.
+        path (Tuple[str, ...]): Names of the subpatches leading to patch.
+
+    Yields:
+        Tuple[Tuple[str, ...], Array]: The subpatch path and the array.
+    """
+    for item in patch.get_items():
+        if isinstance(item, (Array, FrozenArray)):
+            yield path, item
+        elif isinstance(item, (Subpatch, FrozenSubpatch)):
+            yield from iter_arrays(item, path + (item.get_name(),))
+
 def duplicate(patch: Patch, items: List[Item], x=0, y=0) -> List[Item]:
     """
     Duplicate a list of items and move them (x, y) away from the original.
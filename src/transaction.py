@@ -0,0 +1,241 @@
+"""
+Transactions on patches: changes are journaled as they are made, and undone
+in reverse order on rollback, in time proportional to their number rather
+than to the size of the patch.
+
+Journaled changes are Patch.add_item and remove_item, ConnectableItem
+connect and disconnect, and attribute assignments (array.set_data, item.x =
+...) on the items of the patch. Lists modified in place, e.g.
+patch.items.insert() or array.data[0] = ..., aren't seen.
+
+Example:
+    with patch.transaction() as transaction:
+        channel_dacs(patch)
+        if not valid(patch):
+            transaction.rollback()
+
+A mark is a position in the journal to roll back to, taking it costs
+nothing. A snapshot is also a frozen view of the patch (see pdulate.frozen),
+readable after the transaction closes. The first one freezes the whole
+patch, the next ones only the (sub)patches holding what the journal says
+changed since: the other subpatches, and the samples of the arrays left
+unchanged, are shared with the previous snapshots.
+
+Only the changes to the patch of a transaction, and its subpatches, are
+journaled. Attribute assignments are seen through a __setattr__ hook on
+Item and Patch, installed while any transaction is open rather than
+permanently, which would slow every assignment down, parsing included.
+Meanwhile, assignments on all items go through the hook, in every thread,
+so transactions should be kept short. Transactions on different patches
+can be opened from different threads. A patch mustn't be changed from
+another thread while it has one open, as those changes would be journaled,
+and undone, with the transaction's.
+"""
+
+import threading
+from typing import Any, List, Optional, Tuple
+
+from pdulate import items
+from pdulate.frozen import Freezer, FrozenPatch
+from pdulate.items import Item, Patch
+
+MISSING = object()
+
+# Guards installing and removing the __setattr__ hooks with the open transactions
+lock = threading.Lock()
+
+def journaled_setattr(self, name: str, value: Any):
+    transaction = covering(self)
+    if transaction is not None:
+        transaction.entries.append(('set', self, name, self.__dict__.get(name, MISSING)))
+    object.__setattr__(self, name, value)
+
+def covering(*objects) -> Optional['Transaction']:
+    """The innermost open transaction whose patch holds one of objects."""
+    for transaction in reversed(items.transactions):
+        if any(transaction.covers(obj) for obj in objects):
+            return transaction
+    return None
+
+def record(entry: Tuple, *objects):
+    # Called by the journaled methods of items while transactions are open
+    transaction = covering(*objects)
+    if transaction is not None:
+        transaction.entries.append(entry)
+
+Mark = Tuple[int, int]
+
+class Snapshot:
+    """
+    The state of the patch of a transaction at one point.
+
+    Attributes:
+        patch (FrozenPatch): A frozen view of the patch, a FrozenSubpatch for
+            a subpatch.
+        mark (Mark): The point to roll back to, to get to this state again.
+    """
+    def __init__(self, patch: FrozenPatch, mark: Mark):
+        self.patch = patch
+        self.mark = mark
+
+    def __repr__(self):
+        return f"Snapshot({self.mark})"
+
+def touched(entry: Tuple) -> tuple:
+    """The objects whose frozen view a journal entry changes."""
+    kind = entry[0]
+    if kind == 'set':
+        return entry[1],
+    if kind == 'add':
+        return entry[1], entry[4]
+    if kind == 'remove':
+        return entry[1],
+    # Connections are frozen with the (sub)patch holding their ends
+    return entry[1].patch, entry[3].patch
+
+class Transaction:
+    """
+    Journals the changes made to a patch and its subpatches until committed
+    or rolled back. Use Patch.transaction() to start one, see the module
+    documentation for threads.
+    """
+    def __init__(self, patch: Patch):
+        self.patch = patch
+        self.entries: List[Tuple] = []
+        # Positions of the journal rolled back to, invalidating the snapshots past them
+        self.rollbacks: List[int] = []
+        # Frozen content shared by the snapshots, up to the position of the journal of the last one
+        self.freezer: Optional[Freezer] = None
+        self.frozen = 0
+        self.open = True
+        with lock:
+            if not items.transactions:
+                Item.__setattr__ = journaled_setattr
+                Patch.__setattr__ = journaled_setattr
+            items.transactions.append(self)
+
+    def covers(self, obj) -> bool:
+        while obj is not None:
+            if obj is self.patch:
+                return True
+            obj = getattr(obj, 'patch', None)
+        return False
+
+    def mark(self) -> Mark:
+        """
+        A point the transaction can be rolled back to, the position of the
+        journal, costing nothing to take. It is only valid in this
+        transaction while open, and until rolled back to an earlier point.
+        """
+        return len(self.entries), len(self.rollbacks)
+
+    def snapshot(self) -> Snapshot:
+        """
+        The state of the patch, frozen, and a mark to roll back to it. The
+        view only sees journaled changes, lists modified in place aren't.
+        """
+        if self.freezer is None:
+            self.freezer = Freezer()
+        else:
+            for entry in self.entries[self.frozen:]:
+                self.freezer.changed(*touched(entry))
+            # Those of nested transactions still open aren't in this journal yet
+            for transaction in items.transactions:
+                if transaction is not self and self.covers(transaction.patch):
+                    for entry in transaction.entries:
+                        self.freezer.changed(*touched(entry))
+        self.frozen = len(self.entries)
+        return Snapshot(self.freezer.freeze(self.patch), self.mark())
+
+    def rollback_to(self, mark):
+        """Undoes the changes made since mark, or a Snapshot, leaving the transaction open."""
+        position, rollbacks = mark.mark if isinstance(mark, Snapshot) else mark
+        if not self.open:
+            raise ValueError("The transaction is closed")
+        if position > len(self.entries) or any(earlier < position for earlier in self.rollbacks[rollbacks:]):
+            raise ValueError("The mark was undone by an earlier rollback")
+        freezers = [transaction.freezer for transaction in items.transactions if transaction.freezer]
+        while len(self.entries) > position:
+            entry = self.entries.pop()
+            undo(entry)
+            for freezer in freezers:
+                freezer.changed(*touched(entry))
+        self.frozen = min(self.frozen, position)
+        self.rollbacks.append(position)
+
+    def rollback(self):
+        """Undoes every change and closes the transaction."""
+        self.rollback_to((0, 0))
+        self.close()
+
+    def commit(self):
+        """Keeps the changes and closes the transaction. An enclosing transaction can still undo them."""
+        entries = self.entries
+        self.close()
+        outer = covering(self.patch)
+        if outer is not None:
+            outer.entries.extend(entries)
+
+    def close(self):
+        if not self.open:
+            return
+        self.open = False
+        self.entries = []
+        self.freezer = None
+        with lock:
+            items.transactions.remove(self)
+            if not items.transactions:
+                del Item.__setattr__
+                del Patch.__setattr__
+
+    def __enter__(self) -> 'Transaction':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.open:
+            return
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+def restore_key(connections: dict, key: int, keys: Optional[List[int]]):
+    """Recreates an emptied connection list, in its former place among the keys."""
+    if key in connections:
+        return
+    connections[key] = []
+    if keys:
+        reordered = {k: connections[k] for k in keys if k in connections}
+        reordered.update(connections)
+        connections.clear()
+        connections.update(reordered)
+
+def undo(entry: Tuple):
+    kind = entry[0]
+    if kind == 'set':
+        _, obj, name, value = entry
+        if value is MISSING:
+            object.__delattr__(obj, name)
+        else:
+            object.__setattr__(obj, name, value)
+    elif kind == 'add':
+        _, patch, item, index, previous_patch = entry
+        del patch.items[index]
+        object.__setattr__(item, 'patch', previous_patch)
+    elif kind == 'remove':
+        _, patch, item, index = entry
+        patch.items.insert(index, item)
+    elif kind == 'connect':
+        _, source, outlet, target, inlet = entry
+        source.outlets[outlet].pop()
+        if not source.outlets[outlet]:
+            del source.outlets[outlet]
+        target.inlets[inlet].pop()
+        if not target.inlets[inlet]:
+            del target.inlets[inlet]
+    elif kind == 'disconnect':
+        _, source, outlet, target, inlet, outlet_position, inlet_position, outlet_keys, inlet_keys = entry
+        restore_key(source.outlets, outlet, outlet_keys)
+        source.outlets[outlet].insert(outlet_position, (inlet, target))
+        restore_key(target.inlets, inlet, inlet_keys)
+        target.inlets[inlet].insert(inlet_position, (outlet, source))
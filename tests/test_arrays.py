@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from pdulate.arrays import changed_ranges, downmix, envelope, envelope_update, find_arrays
+from pdulate.parser import Parser
+
+def graph(name, values):
+    return [
+        '#N canvas 0 0 450 300 (subpatch) 0',
+        f'#X array {name} {len(values)} float 3 black black',
+        '#A 0 ' + ' '.join(map(str, values)),
+        f'#X coords 0 1 {len(values)} -1 200 140 1',
+        '#X restore 10 10 graph',
+    ]
+
+def parse(records):
+    return Parser().parse_patch('#N canvas 0 0 400 300 12;\n' + ''.join(f"{record};\n" for record in records))
+
+def names(patch):
+    return sorted(array.name for _, array in find_arrays(patch))
+
+def test_arrays_named_like_channels_are_not_mixed():
+    patch = parse(graph('snare_1', [0.1, 0.2]) + graph('snare_2', [0.3, 0.4]))
+    assert downmix(patch) == []
+    assert names(patch) == ['snare_1', 'snare_2']
+
+def test_channels_listed_by_load_audio_are_mixed():
+    patch = parse(graph('pad_1', [0.2, 0.4]) + graph('pad_2', [0.4, 0.0]) + ['#X text 300 10 channels pad pad_1 pad_2'])
+    [mix] = downmix(patch)
+    assert mix.name == 'pad'
+    assert [round(value, 6) for value in mix.data] == [0.3, 0.2]
+    assert names(patch) == ['pad']
+
+def test_groups_given():
+    patch = parse(graph('snare_1', [0.1, 0.2]) + graph('snare_2', [0.3, 0.4]))
+    [mix] = downmix(patch, groups={'snares': ['snare_1', 'snare_2']})
+    assert mix.name == 'snares'
+    assert names(patch) == ['snares']
+
+@pytest.mark.parametrize('size', [999, 1000, 10007])
+def test_envelope_updated_in_the_blocks_changed(size):
+    rng = np.random.default_rng(size)
+    old = rng.uniform(-1, 1, size)
+    new = old.copy()
+    new[:7] = 0
+    new[size // 2:size // 2 + 300] *= 2
+    new[-1] = 5
+    changed = changed_ranges(old, new)
+    assert changed == [(0, 7), (size // 2, size // 2 + 300), (size - 1, size)]
+    assert np.array_equal(envelope_update(envelope(old, 100), new, 100, changed), envelope(new, 100))
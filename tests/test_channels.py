@@ -0,0 +1,7 @@
+from scripts.channels import channel_number
+
+def test_channel_number():
+    assert channel_number('2') == 2
+    assert channel_number('$1') is None
+    assert channel_number('inf') is None
+    assert channel_number('nan') is None
@@ -0,0 +1,48 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+sf = pytest.importorskip('soundfile')
+
+from pdulate import aio
+from pdulate.store import CachedPatchStore, PatchStore
+from scripts.load_audio import Dedup, load_audio
+
+def write_tone(path, frequency, samplerate=44100, frames=1000):
+    sf.write(str(path), 0.5 * np.sin(2 * np.pi * frequency * np.arange(frames) / samplerate), samplerate)
+
+def array_names(patch_path):
+    with open(patch_path) as f:
+        return [line.split()[2] for line in f if line.startswith('#X array')]
+
+@pytest.mark.parametrize('store', [PatchStore, CachedPatchStore])
+def test_reload_keeps_arrays_loaded_before(tmp_path, store):
+    write_tone(tmp_path / 's2.wav', 440)
+    write_tone(tmp_path / 's3.wav', 880)
+    patch_path = str(tmp_path / 'p.pd')
+    shared = store()
+    load_audio([str(tmp_path / 's2.wav')], patch_path, store=shared)
+    load_audio([str(tmp_path / 's3.wav')], patch_path, store=shared)
+    assert array_names(patch_path) == ['s2', 's3']
+
+def test_referenced_files_decoded_only_if_they_may_be_duplicates(tmp_path, monkeypatch):
+    write_tone(tmp_path / 'a.wav', 440)
+    write_tone(tmp_path / 'b.wav', 440)
+    write_tone(tmp_path / 'c.wav', 440, frames=500)
+    decoded = []
+    digest_audio = Dedup.digest_audio
+    monkeypatch.setattr(Dedup, 'digest_audio', staticmethod(
+        lambda file_path, shape: decoded.append(file_path) or digest_audio(file_path, shape)))
+    paths = [str(tmp_path / name) for name in ('a.wav', 'b.wav', 'c.wav')]
+    dedup = load_audio(paths, str(tmp_path / 'p.pd'), sidecar_format='wav', deduplicate=True)
+    assert dedup.aliases == {'b': 'a'}
+    assert sorted(decoded) == paths[:2]
+
+def test_aio_load_audio_returns_the_savings(tmp_path):
+    write_tone(tmp_path / 'a.wav', 440)
+    write_tone(tmp_path / 'b.wav', 440)
+    paths = [str(tmp_path / 'a.wav'), str(tmp_path / 'b.wav')]
+    dedup = asyncio.run(aio.load_audio(paths, str(tmp_path / 'p.pd'), deduplicate=True, preview=100, jobs=1))
+    assert dedup.aliases == {'b': 'a'}
+    assert array_names(tmp_path / 'p.pd') == ['a', 'a-preview']
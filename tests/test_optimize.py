@@ -0,0 +1,38 @@
+from pdulate.items import Message
+from pdulate.optimize import optimize
+from pdulate.parser import Parser
+
+def parse(records):
+    return Parser().parse_patch('#N canvas 0 0 400 300 12;\n' + ''.join(f"{record};\n" for record in records))
+
+def test_identical_messages_without_sources_are_kept():
+    patch = parse([
+        '#X msg 10 10 1',
+        '#X obj 10 40 print A',
+        '#X msg 100 10 1',
+        '#X obj 100 40 print B',
+        '#X connect 0 0 1 0',
+        '#X connect 2 0 3 0',
+    ])
+    report = optimize(patch)
+    assert report.merged == 0
+    messages = [item for item in patch.get_items() if isinstance(item, Message)]
+    assert len(messages) == 2
+    # Each message still only feeds its own [print]
+    targets = [[' '.join(target.args) for _, conns in message.get_outlets() for _, target in conns] for message in messages]
+    assert targets == [['A'], ['B']]
+
+def test_identical_objects_fed_the_same_are_merged():
+    patch = parse([
+        '#X obj 10 10 loadbang',
+        '#X obj 10 40 f 3',
+        '#X obj 100 40 f 3',
+        '#X obj 10 70 print A',
+        '#X obj 100 70 print B',
+        '#X connect 0 0 1 0',
+        '#X connect 0 0 2 0',
+        '#X connect 1 0 3 0',
+        '#X connect 2 0 4 0',
+    ])
+    report = optimize(patch)
+    assert report.merged == 1
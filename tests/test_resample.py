@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from scripts.resample import resample
+
+# Lower bound of the fast resampler's SNR on a pure tone, in dB
+MIN_SNR = 80
+
+def sine(frequency, samplerate, seconds=0.5):
+    return np.sin(2 * np.pi * frequency * np.arange(int(samplerate * seconds)) / samplerate)
+
+def snr(reference, estimate, margin):
+    # The filter edges see the zero padding rather than the tone
+    reference, estimate = reference[margin:-margin], estimate[margin:-margin]
+    return 10 * np.log10(np.sum(reference ** 2) / np.sum((reference - estimate) ** 2))
+
+@pytest.mark.parametrize('sr_orig, sr_new', [(44100, 48000), (48000, 44100), (48000, 96000), (96000, 44100)])
+@pytest.mark.parametrize('frequency', [440, 5000, 15000])
+def test_fast_resampler_snr(sr_orig, sr_new, frequency):
+    resampled = resample(sine(frequency, sr_orig), sr_orig, sr_new, 'fast')
+    expected = sine(frequency, sr_new)
+    assert len(resampled) == len(expected)
+    assert snr(expected, resampled, sr_new // 100) > MIN_SNR
+
+def test_fast_resampler_keeps_channels():
+    stereo = np.stack([sine(440, 44100), sine(880, 44100)], axis=1)
+    resampled = resample(stereo, 44100, 48000, 'fast', axis=0)
+    assert resampled.shape == (24000, 2)
+    assert snr(sine(880, 48000), resampled[:, 1], 480) > MIN_SNR
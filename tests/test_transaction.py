@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from pdulate import items
+from pdulate.arrays import find_arrays
+from pdulate.items import Item, Object, Patch
+from pdulate.parser import Parser
+
+def test_rollback_to_snapshot():
+    patch = Patch(0, 0, 400, 300)
+    with patch.transaction() as transaction:
+        first = Object(10, 10, 'osc~', ['440'])
+        patch.add_item(first)
+        mark = transaction.snapshot()
+        patch.add_item(Object(10, 40, 'dac~', []))
+        first.x = 100
+        transaction.rollback_to(mark)
+        assert patch.get_items() == [first]
+        assert first.x == 10
+
+def test_snapshots_share_what_did_not_change():
+    patch = Parser().parse_patch('#N canvas 0 0 400 300 12;\n' + ''.join(
+        f'#N canvas 0 0 450 300 (subpatch) 0;\n#X array {name} 2 float 3 black black;\n#A 0 0.1 0.2;\n'
+        f'#X coords 0 1 2 -1 200 140 1;\n#X restore 10 {y} graph;\n' for name, y in (('kick', 10), ('snare', 200))))
+    kick, snare = (array for _, array in find_arrays(patch))
+    with patch.transaction() as transaction:
+        before = transaction.snapshot()
+        kick.set_data([0.5, 0.5])
+        after = transaction.snapshot()
+        transaction.rollback_to(before)
+        assert transaction.snapshot().patch == before.patch
+    old_kick, old_snare = before.patch.items
+    new_kick, new_snare = after.patch.items
+    assert new_snare.items is old_snare.items
+    assert new_kick.items[0].samples is not old_kick.items[0].samples
+    assert list(old_kick.items[0].data) == [0.1, 0.2]
+    assert list(new_kick.items[0].data) == [0.5, 0.5]
+
+def test_snapshot_undone_by_earlier_rollback():
+    patch = Patch(0, 0, 400, 300)
+    with patch.transaction() as transaction:
+        start = transaction.snapshot()
+        patch.add_item(Object(10, 10, 'osc~', []))
+        mark = transaction.snapshot()
+        transaction.rollback_to(start)
+        patch.add_item(Object(10, 40, 'dac~', []))
+        patch.add_item(Object(10, 70, 'dac~', []))
+        with pytest.raises(ValueError):
+            transaction.rollback_to(mark)
+
+def test_transactions_in_threads():
+    patches = [Patch(0, 0, 400, 300) for _ in range(4)]
+    barrier = threading.Barrier(len(patches))
+
+    def change(patch):
+        barrier.wait()
+        for _ in range(200):
+            with patch.transaction() as transaction:
+                patch.add_item(Object(10, 10, 'osc~', []))
+                patch.x = 50
+                transaction.rollback()
+
+    threads = [threading.Thread(target=change, args=(patch,)) for patch in patches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(patch.get_items() == [] and patch.x == 0 for patch in patches)
+    assert items.transactions == []
+    assert '__setattr__' not in vars(Item)